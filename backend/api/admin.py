@@ -1,15 +1,172 @@
+import json
+from datetime import date, timedelta
 from django.contrib import admin
-from .models import Order, Product
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.utils.functional import cached_property
+from .models import ArchivedRecord, DailyOrderRollup, Order, Product
+from .partitions import add_months, month_start
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting the rows with the Postgres planner estimate when it's above
+    `exact_count_limit`, instead of a full COUNT(*) of large tables.
+    Smaller results (and other databases) are counted exactly.
+    """
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor == 'postgresql':
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if estimate > self.exact_count_limit:
+                return estimate
+        return super().count
+
+
+class BoundedDates:
+    """
+    Queryset wrapper listing the years, months or days of `dates()` between the MIN and MAX
+    of the field (read from the date indexes), instead of a SELECT DISTINCT over all the rows.
+    Periods without rows in between are listed too.
+    """
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def __getattr__(self, name):
+        return getattr(self.queryset, name)
+
+    def dates(self, field_name, kind, order='ASC'):
+        bounds = self.queryset.aggregate(first=models.Min(field_name), last=models.Max(field_name))
+        if bounds['first'] is None:
+            return []
+        if kind == 'year':
+            periods = [date(year, 1, 1) for year in range(bounds['first'].year, bounds['last'].year + 1)]
+        elif kind == 'month':
+            periods, month = [], month_start(bounds['first'])
+            while month <= bounds['last']:
+                periods.append(month)
+                month = add_months(month, 1)
+        else:
+            days = (bounds['last'] - bounds['first']).days
+            periods = [bounds['first'] + timedelta(days=day) for day in range(days + 1)]
+        return periods if order == 'ASC' else periods[::-1]
+
+
+class BoundedDatesChangeList(ChangeList):
+    """
+    Change list drilling down its date hierarchy with `BoundedDates`.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Read by the date hierarchy once the results are loaded
+        self.queryset = BoundedDates(self.queryset)
+
+
+class DeletedFilter(admin.SimpleListFilter):
+    """
+    Show the active rows by default (served by the partial indexes), the deleted ones on request.
+    """
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return [('deleted', 'Deleted'), ('all', 'All')]
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'Active',
+        }
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        if self.value() == 'all':
+            return queryset
+        return queryset.filter(deleted_at__isnull=self.value() != 'deleted')
+
+
+class SoftDeleteAdmin(admin.ModelAdmin):
+    """
+    Admin of the soft deleted models, listing all the rows (active by default) with estimated counts
+    and bulk soft delete/restore actions run as a single UPDATE.
+    """
+    paginator = EstimatedCountPaginator
+    # No COUNT(*) of the whole table next to the filtered count
+    show_full_result_count = False
+    list_filter = (DeletedFilter,)
+    actions = ['soft_delete_selected', 'restore_selected']
+
+    def get_queryset(self, request):
+        queryset = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        return queryset.order_by(*ordering) if ordering else queryset
+
+    def get_actions(self, request):
+        # The default action hard deletes the rows one by one
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='Soft delete selected %(verbose_name_plural)s', permissions=['delete'])
+    def soft_delete_selected(self, request, queryset):
+        rows = queryset.soft_delete()
+        self.message_user(request, f'{rows} {self.model._meta.verbose_name_plural} deleted.')
+
+    @admin.action(description='Restore selected %(verbose_name_plural)s', permissions=['change'])
+    def restore_selected(self, request, queryset):
+        rows = queryset.restore()
+        self.message_user(request, f'{rows} {self.model._meta.verbose_name_plural} restored.')
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = [f.name for f in Product._meta.fields]
-    search_fields = ('name',)
+class ProductAdmin(SoftDeleteAdmin):
+    list_display = ('id', 'name', 'price', 'updated_at', 'deleted_at')
+    # Prefix search, served by the UPPER(name) index on Postgres
+    search_fields = ('^name',)
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    list_display = [f.name for f in Order._meta.fields]
-    list_filter = ('date',)
-    search_fields = ('name', 'description')
+class OrderAdmin(SoftDeleteAdmin):
+    # Denormalized totals, no query on the products per row
+    list_display = ('id', 'name', 'date', 'product_count', 'total_price', 'updated_at', 'deleted_at')
+    list_select_related = False
+    # Drill down by date ranges, served by the date indexes
+    date_hierarchy = 'date'
+    ordering = ('-date', '-id')
+    # Prefix search, served by the UPPER(name) index on Postgres (the API searches the descriptions)
+    search_fields = ('^name',)
+    # Products are searched on demand, instead of rendering all of them in a select box
+    autocomplete_fields = ('products',)
+
+    def get_changelist(self, request, **kwargs):
+        return BoundedDatesChangeList
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        # Orders can keep their deleted products
+        if db_field.name == 'products':
+            kwargs['queryset'] = Product.all_objects.all()
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
+
+@admin.register(DailyOrderRollup)
+class DailyOrderRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'order_count', 'product_count', 'revenue', 'updated_at')
+    date_hierarchy = 'date'
+
+
+@admin.register(ArchivedRecord)
+class ArchivedRecordAdmin(admin.ModelAdmin):
+    list_display = ('model_label', 'object_id', 'deleted_at', 'archived_at')
+    list_filter = ('model_label',)
+    search_fields = ('=object_id',)
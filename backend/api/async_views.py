@@ -0,0 +1,64 @@
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from .views import OrderViewSet, ProductViewSet
+
+
+class AsyncReadView(View):
+    """
+    Async list and retrieve of a BaseViewSet, served under ASGI without a thread per request.
+    The viewset configuration (queryset, filters, search, ordering, pagination and serializer)
+    is reused, only the database access goes through the async ORM.
+    """
+    viewset_class = None
+    http_method_names = ['get']
+    renderer_class = JSONRenderer
+
+    async def get(self, request, pk=None):
+        viewset = self.get_viewset(request, 'list' if pk is None else 'retrieve', pk)
+        try:
+            data = await (self.list(viewset) if pk is None else self.retrieve(viewset, pk))
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            return JsonResponse(detail, status=exc.status_code, safe=False)
+        return HttpResponse(self.renderer_class().render(data), content_type='application/json')
+
+    def get_viewset(self, request, action, pk):
+        viewset = self.viewset_class(
+            action=action, format_kwarg=None, args=(), kwargs={} if pk is None else {'pk': pk})
+        viewset.request = Request(request)
+        viewset.headers = {}
+        return viewset
+
+    async def list(self, viewset):
+        queryset = viewset.filter_queryset(viewset.get_queryset())
+        paginator = viewset.paginator
+        page = await paginator.apaginate_queryset(queryset, viewset.request, view=viewset) \
+            if paginator is not None else None
+        serializer = viewset.get_serializer(page if page is not None else queryset, many=True)
+        if hasattr(serializer, 'aload_related'):
+            # Fast list serializers fetch their related rows with the async ORM
+            await serializer.aload_related()
+        elif page is None:
+            serializer = viewset.get_serializer([item async for item in queryset], many=True)
+        if page is None:
+            return serializer.data
+        return paginator.get_paginated_response(serializer.data).data
+
+    async def retrieve(self, viewset, pk):
+        queryset = viewset.filter_queryset(viewset.get_queryset())
+        try:
+            instance = await queryset.aget(pk=pk)
+        except queryset.model.DoesNotExist:
+            raise NotFound(f"No {queryset.model._meta.object_name} matches the given query.")
+        return viewset.get_serializer(instance).data
+
+
+class AsyncOrderView(AsyncReadView):
+    viewset_class = OrderViewSet
+
+
+class AsyncProductView(AsyncReadView):
+    viewset_class = ProductViewSet
@@ -0,0 +1,14 @@
+import statistics
+
+
+def summarize_latencies(latencies, elapsed):
+    """
+    Return throughput and p50/p95/p99 latencies (ms) of requests served in `elapsed` seconds.
+    """
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(quantiles[49] * 1000, 2) if quantiles else None,
+        'p95_ms': round(quantiles[94] * 1000, 2) if quantiles else None,
+        'p99_ms': round(quantiles[98] * 1000, 2) if quantiles else None,
+    }
@@ -0,0 +1,93 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+VERSION_KEY = 'version:{}'
+RESPONSE_KEY = 'response:{}:{}:{}'
+STATS_KEY = 'response-cache:{}'
+
+
+def version_key(model):
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def initial_version():
+    # Time based, so a counter evicted from the cache never goes back to a previous value
+    return time.time_ns()
+
+
+def get_versions(*models):
+    """
+    Return the current version counters of the given models.
+    """
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = {key: initial_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    """
+    Bump the version counter of the model, invalidating every cached response depending on it.
+    Bumped again on commit, so responses cached while the transaction was open are discarded too.
+    """
+    key = version_key(model)
+
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, initial_version(), timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_response_key(name, models, request):
+    # Keyed by the URL path, the sorted query params and the versions of the models
+    params = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+    url = hashlib.md5(f'{request.path}?{params}'.encode()).hexdigest()
+    versions = '.'.join(str(version) for version in get_versions(*models))
+    return RESPONSE_KEY.format(name, versions, url)
+
+
+def get_timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def get_response(key):
+    return cache.get(key)
+
+
+def set_response(key, data):
+    cache.set(key, data, get_timeout())
+
+
+def record(outcome):
+    key = STATS_KEY.format(outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_stats():
+    stats = cache.get_many([STATS_KEY.format('hits'), STATS_KEY.format('misses')])
+    hits = stats.get(STATS_KEY.format('hits'), 0)
+    misses = stats.get(STATS_KEY.format('misses'), 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+
+
+def reset_stats():
+    cache.delete_many([STATS_KEY.format('hits'), STATS_KEY.format('misses')])
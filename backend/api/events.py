@@ -0,0 +1,236 @@
+import asyncio
+import json
+import logging
+import threading
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+# Postgres NOTIFY channel of the events, when EVENTS_BROKER is 'postgres'
+CHANNEL = 'api_changes'
+# Above it the event has the count of the rows only (NOTIFY payloads are limited to 8000 bytes)
+MAX_EVENT_IDS = 100
+MAX_PAYLOAD_SIZE = 7900
+
+
+def make_event(model, action, ids=None, count=None):
+    if ids is not None:
+        count = len(ids)
+        ids = ids if len(ids) <= MAX_EVENT_IDS else None
+    return {
+        'model': model._meta.model_name,
+        'action': action,
+        'ids': ids,
+        'count': count,
+        # To resume with the change feed (`?updated_since=`) after a reconnection
+        'at': timezone.now().isoformat(),
+    }
+
+
+def merge_events(events):
+    """
+    Merge the events of the same model and action into one, with their ids (the count only above
+    MAX_EVENT_IDS ids, or if one of them has no ids) and the time of the last one.
+    """
+    merged = {}
+    for event in events:
+        key = (event['model'], event['action'])
+        if key not in merged:
+            merged[key] = dict(event)
+            continue
+        into = merged[key]
+        into['count'] += event['count']
+        if into['ids'] is not None and event['ids'] is not None:
+            ids = into['ids'] + [pk for pk in event['ids'] if pk not in into['ids']]
+            into['ids'] = ids if len(ids) <= MAX_EVENT_IDS else None
+            into['count'] = len(ids)
+        else:
+            into['ids'] = None
+        into['at'] = event['at']
+    return list(merged.values())
+
+
+class PendingEvents:
+    """
+    Events published in a transaction with the 'postgres' broker, notified together once it commits.
+    """
+    def __init__(self, broker, using):
+        self.broker = broker
+        self.using = using
+        self.events = []
+
+    def __call__(self):
+        self.broker.notify(connections[self.using], merge_events(self.events))
+
+
+class Broker:
+    """
+    Fan-out of the change events to the event streams of the process.
+    Events are published once their transaction commits: delivered in process with the 'local'
+    broker (reaching the streams of the same process only), or through Postgres NOTIFY with the
+    'postgres' one (to reach the streams of every worker), one NOTIFY per committed transaction
+    with its merged events, received by a single LISTEN connection per process.
+    Each stream is an asyncio queue on the event loop of the ASGI server, not a thread.
+    """
+    queue_size = 100
+    listen_retry_seconds = 5
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def publish(self, model, action, ids=None, count=None, using='default'):
+        event = make_event(model, action, ids, count)
+        connection = connections[using]
+        if settings.EVENTS_BROKER == 'postgres' and connection.vendor == 'postgresql':
+            if connection.in_atomic_block:
+                self.get_pending(connection).events.append(event)
+            else:
+                # Autocommit, the write is already committed
+                self.notify(connection, [event])
+        else:
+            transaction.on_commit(lambda: self.dispatch(event), using=using)
+
+    def get_pending(self, connection):
+        # One notification per transaction (and savepoint, so a rolled back one drops its events):
+        # the pending events are on its commit callback, registered with the first event
+        savepoint_ids = set(connection.savepoint_ids)
+        for sids, callback, _ in connection.run_on_commit:
+            if isinstance(callback, PendingEvents) and sids == savepoint_ids:
+                return callback
+        pending = PendingEvents(self, connection.alias)
+        # Robust: the write is committed, a failed notification is only logged
+        transaction.on_commit(pending, using=connection.alias, robust=True)
+        return pending
+
+    def notify(self, connection, events):
+        # Single NOTIFY of the events, their ids are dropped if the payload is too large
+        payload = json.dumps(events)
+        if len(payload) > MAX_PAYLOAD_SIZE:
+            payload = json.dumps([{**event, 'ids': None} for event in events])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, payload])
+
+    def dispatch(self, event):
+        # Called from any thread, queues are fed on their event loop
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for loop, queue in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self.put, queue, event)
+
+    @staticmethod
+    def put(queue, event):
+        if queue.full():
+            # Slow client, drop its pending events and let it resync from the change feed
+            while not queue.empty():
+                queue.get_nowait()
+            event = {'action': 'overflow', 'at': timezone.now().isoformat()}
+        queue.put_nowait(event)
+
+    def subscribe(self):
+        """
+        Return the queue of a new stream, to be called on its event loop.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.add((loop, queue))
+        if settings.EVENTS_BROKER == 'postgres' and (self.listener is None or self.listener.done()):
+            self.listener = loop.create_task(self.listen())
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers = {(loop, item) for loop, item in self.subscribers if item is not queue}
+
+    async def listen(self, using='default'):
+        # Dedicated async connection receiving the notifications, reconnected on errors
+        import psycopg
+        params = connections[using].settings_dict
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(
+                    dbname=params['NAME'], user=params['USER'], password=params['PASSWORD'],
+                    host=params['HOST'], port=params['PORT'] or None, autocommit=True)
+                async with conn:
+                    await conn.execute(f'LISTEN {CHANNEL}')
+                    async for notify in conn.notifies():
+                        for event in json.loads(notify.payload):
+                            self.dispatch(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Events listener failed, reconnecting.")
+                await asyncio.sleep(self.listen_retry_seconds)
+
+
+broker = Broker()
+
+
+class EventStreamApp:
+    """
+    ASGI app serving the change events as server-sent events on `path`, other requests go to `app`.
+    `?models=order,product` selects the models (all by default). Idle streams only wait on their
+    queue, with a comment sent every `keepalive_seconds` to keep the connection open.
+    """
+    keepalive_seconds = 15
+    # Reconnection delay suggested to the clients (milliseconds)
+    retry_ms = 5000
+
+    def __init__(self, app, path='/api/events/'):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.app(scope, receive, send)
+        if scope['method'] != 'GET':
+            await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        query = parse_qs(scope.get('query_string', b'').decode())
+        models = {name for value in query.get('models', []) for name in value.split(',') if name}
+        await self.stream(receive, send, models)
+
+    async def stream(self, receive, send, models):
+        queue = broker.subscribe()
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Unbuffered behind nginx
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await self.send_text(send, f'retry: {self.retry_ms}\n\n')
+            while not disconnect.done():
+                get = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {get, disconnect}, timeout=self.keepalive_seconds, return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    if not disconnect.done():
+                        await self.send_text(send, ': keepalive\n\n')
+                    continue
+                event = get.result()
+                if models and event.get('model') not in models and event['action'] != 'overflow':
+                    continue
+                await self.send_text(send, f"event: {event['action']}\ndata: {json.dumps(event)}\n\n")
+        finally:
+            broker.unsubscribe(queue)
+            disconnect.cancel()
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def send_text(send, text):
+        await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
@@ -0,0 +1,73 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """
+    Many related field resolving the whole list of primary keys at once,
+    delegating to the child `BulkPrimaryKeyRelatedField`.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_many(data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key related field that, with `many=True`, validates every pk with
+    a single `filter(pk__in=...)` query (instead of a `get()` per pk) and
+    reports all the missing pks together.
+    The objects for a batch of lists can be loaded upfront with `prefetch()`.
+    """
+    default_error_messages = {
+        'does_not_exist_many': 'Invalid pks "{pk_values}" - objects do not exist.',
+    }
+
+    def __init__(self, **kwargs):
+        self.prefetched = {}
+        super().__init__(**kwargs)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def prefetch(self, data):
+        # Load with one query the objects of many pk lists (e.g. of a bulk request)
+        pks = set()
+        for item in data:
+            try:
+                pks.add(self.to_pk(item))
+            except serializers.ValidationError:
+                continue
+        self.prefetched = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value_many(self, data):
+        pks = [self.to_pk(item) for item in data]
+        objects = {pk: self.prefetched[pk] for pk in pks if pk in self.prefetched}
+        remaining = set(pks) - objects.keys()
+        if remaining:
+            objects.update(self.get_queryset().in_bulk(remaining))
+
+        missing = [str(pk) for pk in dict.fromkeys(pks) if pk not in objects]
+        if missing:
+            self.fail('does_not_exist_many', pk_values=', '.join(missing))
+        return [objects[pk] for pk in pks]
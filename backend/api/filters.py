@@ -0,0 +1,34 @@
+from functools import reduce
+from operator import add
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connections
+from rest_framework import filters
+
+
+class TrigramSearchFilter(filters.SearchFilter):
+    """
+    Search filter backed by the pg_trgm GIN indexes on Postgres.
+    The `icontains` predicates built by SearchFilter are served by the
+    trigram indexes, and results are ranked by trigram word similarity
+    unless an explicit ordering is requested.
+    On other databases it falls back to the default SearchFilter behaviour.
+    """
+    rank_annotation = 'search_rank'
+
+    def filter_queryset(self, request, queryset, view):
+        queryset = super().filter_queryset(request, queryset, view)
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+
+        if not search_fields or not search_terms or \
+                connections[queryset.db].vendor != 'postgresql':
+            return queryset
+
+        # Sum of the similarities of every term against every search field
+        rank = reduce(add, (
+            TrigramWordSimilarity(term, field)
+            for term in search_terms for field in search_fields
+        ))
+        return queryset.annotate(**{self.rank_annotation: rank}).order_by(
+            f'-{self.rank_annotation}', *queryset.query.order_by)
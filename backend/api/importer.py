@@ -0,0 +1,302 @@
+import csv
+import json
+import time
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.utils import timezone
+from . import validators
+from .cache import bump_version
+from .models import DailyOrderRollup, Order, Product
+from .partitions import is_partitioned
+
+
+FORMATS = ['csv', 'ndjson']
+
+
+def read_rows(stream, import_format):
+    """
+    Stream the rows of a CSV (with header) or NDJSON text file as (line number, dict) tuples.
+    Unparsable NDJSON lines are returned as None, to be rejected.
+    """
+    if import_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_num, row if isinstance(row, dict) else None
+
+
+class Importer:
+    """
+    Bulk import of the rows of a model, validated and written in batches.
+    Rows with an `id` are inserted or updated (upsert), the other ones are inserted.
+    On Postgres each batch is written with COPY into temporary staging tables, then merged
+    into the model table with a single statement; other databases use batched executemany.
+    Each batch is written in its own transaction.
+    """
+    model = None
+    # Model fields read from the rows
+    fields = []
+    # Values of the other required columns of the inserted rows
+    defaults = {}
+    # Business validators of the fields, the ones of the API serializers
+    field_validators = {}
+    max_errors = 100
+
+    def __init__(self, batch_size=5000, using='default'):
+        self.batch_size = batch_size
+        self.connection = connections[using]
+        self.using = using
+        self.table = self.model._meta.db_table
+        self.columns = ['id', *self.fields, *self.defaults, 'created_at', 'updated_at', 'deleted_at']
+        self.next_id = None
+
+    def run(self, stream, import_format):
+        """
+        Import the rows of the stream, return the import statistics.
+        """
+        stats = {'rows': 0, 'imported': 0, 'rejected': 0, 'errors': []}
+        start = time.perf_counter()
+        rows = read_rows(stream, import_format)
+        while batch := list(islice(rows, self.batch_size)):
+            valid = []
+            for line_num, row in batch:
+                values, errors = self.clean_row(row) if row is not None else (None, ['Invalid row.'])
+                if errors:
+                    self.reject(stats, line_num, errors)
+                else:
+                    valid.append((line_num, values))
+            valid = self.validate_batch(valid, stats)
+            if valid:
+                with transaction.atomic(using=self.using):
+                    self.write_batch([values for _, values in valid])
+            stats['rows'] += len(batch)
+            stats['imported'] += len(valid)
+        self.reset_sequence()
+        stats['errors'].sort(key=lambda error: error['line'])
+
+        elapsed = time.perf_counter() - start
+        stats['seconds'] = round(elapsed, 2)
+        stats['rows_per_second'] = round(stats['rows'] / elapsed, 2) if elapsed else None
+        return stats
+
+    def reject(self, stats, line_num, errors):
+        stats['rejected'] += 1
+        if len(stats['errors']) < self.max_errors:
+            stats['errors'].append({'line': line_num, 'errors': errors})
+
+    def clean_row(self, row):
+        # Return the model values of the row and its errors
+        values, errors = {}, []
+        raw_id = row.get('id')
+        if raw_id in (None, ''):
+            values['id'] = None
+        else:
+            try:
+                values['id'] = int(raw_id)
+                if values['id'] < 1:
+                    raise ValueError
+            except (TypeError, ValueError):
+                errors.append(f'id: "{raw_id}" is not a valid id.')
+        for name in [*self.fields, 'deleted_at']:
+            field = self.model._meta.get_field(name)
+            value = row.get(name)
+            if value == '' and field.null:
+                value = None
+            try:
+                values[name] = field.clean(value, None)
+                for validator in self.field_validators.get(name, []):
+                    validator(values[name])
+            except ValidationError as exc:
+                errors += [f'{name}: {message}' for message in exc.messages]
+        return values, errors
+
+    def validate_batch(self, valid, stats):
+        # Checks requiring queries run once per batch, later rows win over the same id
+        by_id = {}
+        for line_num, values in valid:
+            by_id[values['id'] if values['id'] is not None else ('line', line_num)] = (line_num, values)
+        return list(by_id.values())
+
+    def allocate_ids(self, count):
+        # Primary keys of the new rows, so they can be linked before being written
+        if self.connection.vendor == 'postgresql':
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                    [self.table, 'id', count])
+                return [row[0] for row in cursor.fetchall()]
+        if self.next_id is None:
+            last = self.model.all_objects.using(self.using).order_by('-id').values_list('id', flat=True).first()
+            self.next_id = (last or 0) + 1
+        ids = list(range(self.next_id, self.next_id + count))
+        self.next_id += count
+        return ids
+
+    def write_batch(self, rows):
+        new = [values for values in rows if values['id'] is None]
+        for values, pk in zip(new, self.allocate_ids(len(new)) if new else []):
+            values['id'] = pk
+        now = timezone.now()
+        defaults = list(self.defaults.values())
+        fields = [self.model._meta.get_field(column) for column in self.columns]
+        records = [
+            [field.get_db_prep_value(value, self.connection) for field, value in zip(fields, [
+                values['id'], *[values[name] for name in self.fields], *defaults, now, now, values['deleted_at']])]
+            for values in rows
+        ]
+        if self.connection.vendor == 'postgresql':
+            self.copy_upsert(self.table, self.columns, records)
+        else:
+            self.executemany_upsert(self.table, self.columns, records)
+        bump_version(self.model)
+
+    def upsert_sql(self, table, columns, source):
+        quote = self.connection.ops.quote_name
+        # created_at is kept on update
+        updates = ', '.join(f'{quote(column)} = EXCLUDED.{quote(column)}'
+                            for column in columns if column not in ('id', 'created_at', *self.defaults))
+        return (f'INSERT INTO {quote(table)} ({", ".join(quote(column) for column in columns)}) {source} '
+                f'ON CONFLICT ({quote("id")}) DO UPDATE SET {updates}')
+
+    def executemany_upsert(self, table, columns, records):
+        values = f'VALUES ({", ".join(["%s"] * len(columns))})'
+        with self.connection.cursor() as cursor:
+            cursor.executemany(self.upsert_sql(table, columns, values), records)
+
+    def copy_into_staging(self, cursor, table, columns, records):
+        # Temporary table with the column types only, dropped at the end of the batch transaction.
+        # Inside an enclosing transaction the batches are savepoints only and the table of the
+        # previous batch is still there
+        quote = self.connection.ops.quote_name
+        staging = f'import_{table}'
+        column_list = ', '.join(quote(column) for column in columns)
+        cursor.execute(f'DROP TABLE IF EXISTS {quote(staging)}')
+        cursor.execute(f'CREATE TEMPORARY TABLE {quote(staging)} ON COMMIT DROP AS '
+                       f'SELECT {column_list} FROM {quote(table)} WITH NO DATA')
+        with cursor.copy(f'COPY {quote(staging)} ({column_list}) FROM STDIN') as copy:
+            for record in records:
+                copy.write_row(record)
+        return staging
+
+    def copy_upsert(self, table, columns, records):
+        quote = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            staging = self.copy_into_staging(cursor, table, columns, records)
+            select = f'SELECT {", ".join(quote(column) for column in columns)} FROM {quote(staging)}'
+            if not is_partitioned(self.connection, table):
+                cursor.execute(self.upsert_sql(table, columns, select))
+                return
+            # Partitioned tables have no unique index on id alone for ON CONFLICT: update the
+            # existing rows (moved to their new partition when their date changes), then insert the new ones
+            updates = ', '.join(f'{quote(column)} = staging.{quote(column)}'
+                                for column in columns if column not in ('id', 'created_at', *self.defaults))
+            cursor.execute(f'UPDATE {quote(table)} SET {updates} FROM {quote(staging)} AS staging '
+                           f'WHERE {quote(table)}.id = staging.id')
+            cursor.execute(f'INSERT INTO {quote(table)} ({", ".join(quote(column) for column in columns)}) '
+                           f'{select} WHERE NOT EXISTS (SELECT 1 FROM {quote(table)} WHERE {quote(table)}.id = '
+                           f'{quote(staging)}.id)')
+
+    def reset_sequence(self):
+        # Explicit ids may be beyond the primary key sequence
+        statements = self.connection.ops.sequence_reset_sql(no_style(), [self.model])
+        if statements:
+            with self.connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+class ProductImporter(Importer):
+    model = Product
+    fields = ['name', 'price']
+    field_validators = {'price': [validators.validate_price]}
+
+    def write_batch(self, rows):
+        updated = [values['id'] for values in rows if values['id'] is not None]
+        super().write_batch(rows)
+        if updated:
+            # Prices and names may have changed, refresh the totals and snapshots of their orders
+            Product.all_objects.using(self.using).filter(pk__in=updated).refresh_orders()
+
+
+class OrderImporter(Importer):
+    """
+    Orders rows have their `products` as a list of ids (or of objects with `id`, as exported)
+    in NDJSON, and as space separated ids in CSV. The links of the imported orders are replaced.
+    """
+    model = Order
+    fields = ['name', 'description', 'date']
+    # Refreshed from the links after the batch is written
+    defaults = {'total_price': 0, 'product_count': 0, 'products_snapshot': []}
+
+    def clean_row(self, row):
+        values, errors = super().clean_row(row)
+        products = row.get('products', row.get('product_ids')) or []
+        if isinstance(products, str):
+            products = products.split()
+        try:
+            values['products'] = sorted({int(product['id'] if isinstance(product, dict) else product)
+                                         for product in products})
+        except (KeyError, TypeError, ValueError):
+            errors.append('products: Invalid list of product ids.')
+            return values, errors
+        try:
+            validators.validate_product_ids(values['products'])
+        except ValidationError as exc:
+            errors += [f'products: {message}' for message in exc.messages]
+        return values, errors
+
+    def validate_batch(self, valid, stats):
+        # Products can be deleted ones, as orders keep them
+        referenced = {pk for _, values in valid for pk in values['products']}
+        existing = set(Product.all_objects.using(self.using).filter(pk__in=referenced)
+                       .values_list('id', flat=True)) if referenced else set()
+        checked = []
+        for line_num, values in valid:
+            missing = [pk for pk in values['products'] if pk not in existing]
+            if missing:
+                self.reject(stats, line_num, [f'products: Invalid pks "{missing}" - objects do not exist.'])
+            else:
+                checked.append((line_num, values))
+        return super().validate_batch(checked, stats)
+
+    def write_batch(self, rows):
+        # Dates of the updated orders before the import
+        updated = [values['id'] for values in rows if values['id'] is not None]
+        previous_dates = Order.all_objects.using(self.using).filter(pk__in=updated).get_dates() if updated else set()
+        super().write_batch(rows)
+        Link = Order.products.through
+        order_ids = [values['id'] for values in rows]
+        links = [[values['id'], pk] for values in rows for pk in values['products']]
+        link_table = Link._meta.db_table
+        Link.objects.using(self.using).filter(order_id__in=order_ids).delete()
+        if links:
+            if self.connection.vendor == 'postgresql':
+                quote = self.connection.ops.quote_name
+                with self.connection.cursor() as cursor:
+                    staging = self.copy_into_staging(cursor, link_table, ['order_id', 'product_id'], links)
+                    cursor.execute(f'INSERT INTO {quote(link_table)} (order_id, product_id) '
+                                   f'SELECT order_id, product_id FROM {quote(staging)}')
+            else:
+                with self.connection.cursor() as cursor:
+                    cursor.executemany(
+                        f'INSERT INTO {self.connection.ops.quote_name(link_table)} (order_id, product_id) '
+                        f'VALUES (%s, %s)', links)
+        Order.all_objects.using(self.using).filter(pk__in=order_ids).refresh_products()
+        # Orders written by raw SQL, their previous and new dates are recomputed
+        DailyOrderRollup.refresh(previous_dates | {values['date'] for values in rows}, using=self.using)
+
+
+IMPORTERS = {
+    'products': ProductImporter,
+    'orders': OrderImporter,
+}
@@ -0,0 +1,97 @@
+import json
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.utils import timezone
+from api.models import ArchivedRecord, Order, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the rows soft deleted longer than the retention period into the archive table "
+        "(or hard delete them with --purge), in bounded batches. Orders go first, then the products "
+        "no longer linked to any order, so orders keep their deleted products."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.ARCHIVE_RETENTION_DAYS,
+                            help="Days a deleted row is kept (default: ARCHIVE_RETENTION_DAYS).")
+        parser.add_argument('--purge', action='store_true', help="Hard delete the rows without archiving them.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per batch (default: 1000).")
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Seconds to wait between batches, to throttle the load (default: 0).")
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after N batches per model.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows to archive.")
+
+    def handle(self, *args, **options):
+        if options['retention_days'] < 0 or options['batch_size'] < 1:
+            raise CommandError("The retention days and the batch size must be positive.")
+        self.options = options
+        self.cutoff = timezone.now() - timedelta(days=options['retention_days'])
+
+        start = time.perf_counter()
+        # Orders first, their products can be removed only once no order links them
+        result = {
+            'cutoff': self.cutoff.isoformat(),
+            'mode': 'dry-run' if options['dry_run'] else 'purge' if options['purge'] else 'archive',
+            'orders': self.process(self.get_orders, self.archive_orders),
+            'products': self.process(self.get_products, self.archive_products),
+        }
+        result['seconds'] = round(time.perf_counter() - start, 2)
+        self.stdout.write(json.dumps(result))
+
+    def get_orders(self):
+        return Order.all_objects.filter(deleted_at__lt=self.cutoff)
+
+    def get_products(self):
+        links = Order.products.through.objects.filter(product_id=models.OuterRef('pk'))
+        return Product.all_objects.filter(deleted_at__lt=self.cutoff).exclude(models.Exists(links))
+
+    def process(self, get_queryset, archive):
+        if self.options['dry_run']:
+            return get_queryset().count()
+        total, batches, last_id = 0, 0, 0
+        model = get_queryset().model
+        while self.options['max_batches'] is None or batches < self.options['max_batches']:
+            with transaction.atomic():
+                # Seek on the primary key (deleted rows partial index), each batch costs the same.
+                # The rows are locked while still deleted past the retention, then exactly those are
+                # archived and deleted: a concurrent restore waits for the batch, or its row is skipped
+                ids = list(get_queryset().filter(pk__gt=last_id).order_by('pk').select_for_update()
+                           .values_list('pk', flat=True)[:self.options['batch_size']])
+                if ids:
+                    if not self.options['purge']:
+                        archive(ids)
+                    model.all_objects.filter(pk__in=ids).delete()
+            if not ids:
+                break
+            last_id = ids[-1]
+            total += len(ids)
+            batches += 1
+            if self.options['verbosity'] > 0:
+                self.stderr.write(f"{model._meta.verbose_name_plural}: "
+                                  f"{total} removed in {batches} batches")
+            if self.options['sleep']:
+                time.sleep(self.options['sleep'])
+        return total
+
+    def archive_rows(self, queryset, extra=None):
+        extra = extra or {}
+        ArchivedRecord.objects.bulk_create([
+            ArchivedRecord(model_label=queryset.model._meta.label_lower, object_id=row['id'],
+                           data={**row, **extra.get(row['id'], {})}, deleted_at=row['deleted_at'])
+            for row in queryset.values()
+        ])
+
+    def archive_orders(self, ids):
+        product_ids = {}
+        links = Order.products.through.objects.filter(order_id__in=ids).order_by('product_id')
+        for order_id, product_id in links.values_list('order_id', 'product_id'):
+            product_ids.setdefault(order_id, []).append(product_id)
+        self.archive_rows(Order.all_objects.filter(pk__in=ids),
+                          {pk: {'product_ids': product_ids.get(pk, [])} for pk in ids})
+
+    def archive_products(self, ids):
+        self.archive_rows(Product.all_objects.filter(pk__in=ids))
@@ -0,0 +1,131 @@
+import json
+import math
+import random
+import time
+from base64 import urlsafe_b64encode
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework.settings import api_settings
+from api.benchmark import summarize_latencies
+from api.models import Order, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the order APIs on the current data (see `seed_data`) through the in-process "
+        "handler, reporting p50/p95/p99 latency, throughput and queries per request as JSON."
+    )
+    scenarios = ['list', 'filter', 'search', 'ordering', 'deep_page', 'keyset_page', 'retrieve', 'create', 'restore']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help="Requests per scenario (default: 100).")
+        parser.add_argument('--scenarios', nargs='+', choices=self.scenarios, default=self.scenarios,
+                            help="Scenarios to run (default: all).")
+        parser.add_argument('--cache', action='store_true',
+                            help="Keep the response cache enabled (disabled by default to measure the database).")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed of the requested ids and pages.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.order_ids = list(Order.objects.values_list('id', flat=True))
+        if not self.order_ids:
+            raise CommandError("No orders to benchmark, seed them with `python manage.py seed_data`.")
+        self.product_ids = list(Product.objects.values_list('id', flat=True)[:1000])
+
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['cache']:
+            overrides['RESPONSE_CACHE_TIMEOUT'] = 0
+        self.client = Client()
+        results = {'orders': len(self.order_ids), 'requests': options['requests'], 'scenarios': {}}
+        with override_settings(**overrides):
+            for scenario in options['scenarios']:
+                requests = getattr(self, f'requests_{scenario}')(options['requests'])
+                results['scenarios'][scenario] = self.run(requests)
+                cleanup = getattr(self, f'cleanup_{scenario}', None)
+                if cleanup is not None:
+                    cleanup()
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, requests):
+        # Requests are (method, path, data) tuples, data is None for GET requests
+        latencies, errors, queries = [], 0, 0
+
+        def count_queries(execute, *args):
+            nonlocal queries
+            queries += 1
+            return execute(*args)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            for method, path, data in requests:
+                request_start = time.perf_counter()
+                if method == 'get':
+                    response = self.client.get(path)
+                else:
+                    response = self.client.generic(
+                        method.upper(), path, json.dumps(data) if data else '', content_type='application/json')
+                latencies.append(time.perf_counter() - request_start)
+                errors += response.status_code >= 400
+        elapsed = time.perf_counter() - start
+        return {
+            'path': requests[0][1] if requests else None,
+            'errors': errors,
+            'queries_per_request': round(queries / len(requests), 2) if requests else None,
+            **summarize_latencies(latencies, elapsed),
+        }
+
+    def requests_list(self, count):
+        return [('get', '/api/orders/', None)] * count
+
+    def requests_filter(self, count):
+        return [('get', '/api/orders/?date__gte=2024-01-01&total_price__gte=100', None)] * count
+
+    def requests_search(self, count):
+        return [('get', f'/api/orders/?search=order+{self.random.randint(1, 999)}', None) for _ in range(count)]
+
+    def requests_ordering(self, count):
+        return [('get', '/api/orders/?ordering=-total_price', None)] * count
+
+    def requests_deep_page(self, count):
+        # Last pages, the worst case of the OFFSET pagination
+        pages = max(math.ceil(len(self.order_ids) / api_settings.PAGE_SIZE), 1)
+        return [
+            ('get', f'/api/orders/?page={max(pages - self.random.randrange(3), 1)}', None) for _ in range(count)
+        ]
+
+    def requests_keyset_page(self, count):
+        # Pages at random depths with keyset pagination, cursors seek from a random order
+        # on the default ordering (-date, -id)
+        orders = Order.objects.filter(pk__in=self.random.sample(self.order_ids, min(count, len(self.order_ids))))
+        cursors = [
+            urlsafe_b64encode(json.dumps(
+                {'o': ['-date', '-id'], 'p': [order['date'].isoformat(), str(order['id'])], 'r': 0},
+                separators=(',', ':')).encode()).decode('ascii')
+            for order in orders.values('date', 'id')
+        ]
+        return [('get', f'/api/orders/?cursor={self.random.choice(cursors)}', None) for _ in range(count)]
+
+    def requests_retrieve(self, count):
+        return [('get', f'/api/orders/{self.random.choice(self.order_ids)}/', None) for _ in range(count)]
+
+    def requests_create(self, count):
+        return [
+            ('post', '/api/orders/', {
+                'name': f'Benchmark order {index}',
+                'description': 'Created by the benchmark',
+                'date': '2024-01-01',
+                'product_ids': self.random.sample(self.product_ids, min(3, len(self.product_ids))),
+            })
+            for index in range(count)
+        ]
+
+    def cleanup_create(self):
+        Order.all_objects.filter(description='Created by the benchmark').delete()
+
+    def requests_restore(self, count):
+        # Soft delete random orders, then restore them through the API
+        order_ids = self.random.sample(self.order_ids, min(count, len(self.order_ids)))
+        Order.objects.filter(pk__in=order_ids).soft_delete()
+        return [('post', f'/api/orders/{order_id}/restore/', None) for order_id in order_ids]
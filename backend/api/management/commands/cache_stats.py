@@ -0,0 +1,15 @@
+import json
+from django.core.management.base import BaseCommand
+from api.cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "Print the hit/miss counters of the API response cache as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(get_stats()))
+        if options['reset']:
+            reset_stats()
@@ -0,0 +1,42 @@
+import json
+from django.core.management.base import BaseCommand
+from api.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the products snapshot of every order (deleted ones included) with its linked products, "
+        "print the drifted orders as JSON and repair them with --repair."
+    )
+    # Drifted order ids listed in the output
+    max_listed = 100
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help="Rewrite the drifted snapshots and totals.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Orders checked per query (default: 1000).")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        checked, drifted = 0, []
+        last_id = 0
+        while True:
+            # Seek on the primary key, each chunk costs the same
+            orders = list(Order.all_objects.filter(pk__gt=last_id).order_by('pk')
+                          .values_list('pk', 'products_snapshot')[:chunk_size])
+            if not orders:
+                break
+            last_id = orders[-1][0]
+            expected = Order.all_objects.filter(pk__in=[pk for pk, _ in orders]).get_snapshots()
+            chunk_drifted = [pk for pk, snapshot in orders if snapshot != expected.get(pk, [])]
+            if chunk_drifted and options['repair']:
+                # Totals too, e.g. the deferred refresh of a product change didn't run
+                Order.all_objects.filter(pk__in=chunk_drifted).refresh_products()
+            checked += len(orders)
+            drifted += chunk_drifted
+
+        self.stdout.write(json.dumps({
+            'checked': checked,
+            'drifted': len(drifted),
+            'repaired': len(drifted) if options['repair'] else 0,
+            'drifted_ids': drifted[:self.max_listed],
+        }))
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, override_settings
+from api.benchmark import summarize_latencies
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare latency and throughput of the sync and async read paths "
+        "under concurrent load, through the in-process ASGI handler."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per path.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Concurrent requests.")
+        parser.add_argument('--resource', choices=['orders', 'products'], default='orders')
+        parser.add_argument('--query', default='', help="Query string, e.g. 'date__gte=2024-01-01'.")
+
+    def handle(self, *args, **options):
+        query = f"?{options['query']}" if options['query'] else ''
+        paths = {
+            'sync': f"/api/{options['resource']}/{query}",
+            'async': f"/api/async/{options['resource']}/{query}",
+        }
+        # Response cache disabled so both paths hit the database
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], RESPONSE_CACHE_TIMEOUT=0):
+            results = {
+                name: asyncio.run(self.load(path, options['requests'], options['concurrency']))
+                for name, path in paths.items()
+            }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    async def load(self, path, requests, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def request():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        # Connections of the thread running the sync code, the test client doesn't close them
+        await sync_to_async(connections.close_all)()
+
+        return {
+            'path': path,
+            'requests': requests,
+            'concurrency': concurrency,
+            'errors': errors,
+            **summarize_latencies(latencies, elapsed),
+        }
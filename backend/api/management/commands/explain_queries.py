@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from api.models import Order, Product
+from api.pagination import KeysetPagination
+from api.partitions import get_index_names
+from api.views import OrderViewSet, ProductViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the queries run by the BaseViewSet/OrderViewSet actions "
+        "and check that the expected indexes are used (Postgres only)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true',
+                            help="Run EXPLAIN ANALYZE (executes the queries).")
+        parser.add_argument('--no-seqscan', action='store_true',
+                            help="Disable sequential scans, to check index usability on small datasets.")
+        parser.add_argument('--check', action='store_true',
+                            help="Exit with an error if an expected index is not used.")
+
+    def handle(self, *args, **options):
+        connection = connections[Order.objects.db]
+        is_postgres = connection.vendor == 'postgresql'
+        missing = []
+
+        with transaction.atomic():
+            if options['no_seqscan'] and is_postgres:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for label, queryset, indexes in self.get_cases():
+                plan = queryset.explain(analyze=options['analyze']) if is_postgres else queryset.explain()
+                # Partitioned tables (orders) scan the indexes of their partitions
+                used = not is_postgres or not indexes or any(
+                    name in plan for index in indexes for name in get_index_names(connection, index))
+                if not used:
+                    missing.append(label)
+                if not is_postgres:
+                    status = 'NOT CHECKED'
+                else:
+                    status = self.style.SUCCESS('OK') if used else self.style.ERROR('MISSING')
+                expected = ', '.join(indexes) if indexes else '-'
+                self.stdout.write(f"== {label} [{status}] expected: {expected}")
+                self.stdout.write(plan + '\n')
+
+        if not is_postgres:
+            self.stdout.write(self.style.WARNING(
+                f"Index usage is checked only on Postgres (current: {connection.vendor})."))
+        if missing and options['check']:
+            raise CommandError(f"Expected indexes not used by: {', '.join(missing)}")
+
+    def get_queryset(self, viewset_class, action, params=None):
+        # Build the queryset exactly as the viewset action does, filters included
+        request = Request(APIRequestFactory().get('/', params or {}))
+        view = viewset_class(action=action, request=request, format_kwarg=None, kwargs={})
+        return view.filter_queryset(view.get_queryset())
+
+    def get_cases(self):
+        page_size = KeysetPagination.page_size
+        order_id = Order.all_objects.values_list('id', flat=True).last() or 1
+        order = Order.all_objects.order_by('-date', '-id').first()
+        product_id = Product.all_objects.values_list('id', flat=True).last() or 1
+
+        orders = self.get_queryset(OrderViewSet, 'list')
+        seek = KeysetPagination.build_seek_filter(
+            ['-date', '-id'], [order.date, order.id] if order else ['2024-01-01', order_id])
+
+        return [
+            ("orders list", orders[:page_size], ['order_live_date_idx']),
+            ("orders list by date range", self.get_queryset(
+                OrderViewSet, 'list', {'date__gte': '2024-01-01', 'date__lte': '2024-01-31'})[:page_size],
+                ['order_live_date_idx']),
+            ("orders keyset page", orders.filter(seek)[:page_size], ['order_live_date_idx']),
+            ("orders search", self.get_queryset(OrderViewSet, 'list', {'search': 'order'})[:page_size],
+                ['order_name_trgm_idx', 'order_description_trgm_idx']),
+            ("orders retrieve", self.get_queryset(OrderViewSet, 'retrieve').filter(pk=order_id),
+                ['api_order_pkey']),
+            ("orders restore lookup", Order.all_objects.filter(pk=order_id, deleted_at__isnull=False),
+                ['api_order_pkey', 'order_deleted_id_idx']),
+            ("order products prefetch", Order.products.through.objects.filter(order_id__in=[order_id]),
+                []),
+            ("products list", self.get_queryset(ProductViewSet, 'list')[:page_size],
+                ['product_live_id_idx']),
+            ("products retrieve", self.get_queryset(ProductViewSet, 'retrieve').filter(pk=product_id),
+                ['api_product_pkey']),
+            ("products restore lookup", Product.all_objects.filter(pk=product_id, deleted_at__isnull=False),
+                ['api_product_pkey', 'product_deleted_id_idx']),
+        ]
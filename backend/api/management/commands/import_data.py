@@ -0,0 +1,34 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from api.importer import FORMATS, IMPORTERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Import products or orders (with their product ids) from a CSV or NDJSON file, streamed and "
+        "written in batches (COPY on Postgres). Prints rows per second and the rejected rows as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=list(IMPORTERS))
+        parser.add_argument('path', help="File to import, `-` for the standard input.")
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help="File format (default: from the file extension).")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per batch (default: 5000).")
+
+    def handle(self, *args, **options):
+        import_format = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if import_format not in FORMATS:
+            raise CommandError(f"Unknown format, use --format with one of: {', '.join(FORMATS)}.")
+
+        importer = IMPORTERS[options['resource']](batch_size=options['batch_size'])
+        if options['path'] == '-':
+            stats = importer.run(sys.stdin, import_format)
+        else:
+            try:
+                with open(options['path'], newline='', encoding='utf-8') as stream:
+                    stats = importer.run(stream, import_format)
+            except OSError as exc:
+                raise CommandError(str(exc))
+        self.stdout.write(json.dumps(stats, indent=2))
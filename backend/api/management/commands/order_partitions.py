@@ -0,0 +1,118 @@
+import json
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from api import partitions
+from api.models import Order
+from api.pagination import KeysetPagination
+from api.views import OrderViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the monthly partitions of the orders table (Postgres only): convert the table "
+        "online with --convert, create the next months partitions, detach (or drop) the old ones "
+        "and check that the date filtered order lists prune the partitions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3,
+                            help="Months after the current one to create the partitions of (default: 3).")
+        parser.add_argument('--detach-months', type=int, default=None,
+                            help="Detach the partitions older than N months before the current one.")
+        parser.add_argument('--drop', action='store_true',
+                            help="Drop the detached partitions and the products links of their orders.")
+        parser.add_argument('--check', action='store_true',
+                            help="Exit with an error if a date filtered order list reads pruned partitions.")
+        parser.add_argument('--convert', action='store_true',
+                            help="Convert the orders table to a partitioned one first, copying its rows online.")
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Ids per batch of the --convert copy (default: 10000).")
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Seconds to wait between the --convert batches, to throttle the load (default: 0).")
+
+    def handle(self, *args, **options):
+        connection = connections[Order.objects.db]
+        if options['ahead'] < 0 or (options['detach_months'] is not None and options['detach_months'] < 1):
+            raise CommandError("The months must be positive.")
+        if options['drop'] and options['detach_months'] is None:
+            raise CommandError("--drop requires --detach-months.")
+        if options['batch_size'] < 1:
+            raise CommandError("The batch size must be positive.")
+        if options['convert']:
+            self.convert(connection, options)
+        elif not partitions.is_partitioned(connection):
+            raise CommandError("The orders table is not partitioned, convert it with --convert (Postgres only).")
+
+        current = partitions.month_start(date.today())
+        with transaction.atomic(using=connection.alias):
+            created = partitions.ensure_partitions(
+                connection, current, partitions.add_months(current, options['ahead']))
+            detached = []
+            if options['detach_months'] is not None:
+                detached = partitions.detach_partitions(
+                    connection, partitions.add_months(current, -options['detach_months']), drop=options['drop'])
+
+        pruning = self.check_pruning()
+        self.stdout.write(json.dumps({
+            'converted': options['convert'],
+            'created': created,
+            'detached': detached,
+            'dropped': options['drop'],
+            'partitions': partitions.get_partitions(connection),
+            'pruning': pruning,
+        }))
+        failed = [label for label, result in pruning.items() if not result['pruned']]
+        if failed and options['check']:
+            raise CommandError(f"Partitions not pruned by: {', '.join(failed)}")
+
+    def convert(self, connection, options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The orders table can only be partitioned on Postgres.")
+        if partitions.is_partitioned(connection):
+            raise CommandError("The orders table is already partitioned.")
+        with transaction.atomic(using=connection.alias):
+            partitions.start_conversion(connection, options['ahead'])
+        for copied in partitions.copy_rows(connection, options['batch_size']):
+            if options['verbosity'] > 0:
+                self.stderr.write(f"orders: {copied} copied")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        with transaction.atomic(using=connection.alias):
+            partitions.finish_conversion(connection)
+
+    def get_queryset(self, params):
+        # Build the queryset exactly as the order list does, filters included
+        request = Request(APIRequestFactory().get('/', params))
+        view = OrderViewSet(action='list', request=request, format_kwarg=None, kwargs={})
+        return view.filter_queryset(view.get_queryset())[:KeysetPagination.page_size]
+
+    def get_cases(self):
+        # (label, list params, first and last month of the partitions to read)
+        today = date.today()
+        last_month = partitions.add_months(partitions.month_start(today), -1)
+        last_days = today - timedelta(days=90)
+        return [
+            ("orders of the last 90 days", {'date__gte': last_days.isoformat()},
+                partitions.month_start(last_days), None),
+            ("orders of the last month", {
+                'date__gte': last_month.isoformat(),
+                'date__lte': (partitions.add_months(last_month, 1) - timedelta(days=1)).isoformat(),
+            }, last_month, last_month),
+        ]
+
+    def check_pruning(self):
+        results = {}
+        for label, params, first, last in self.get_cases():
+            scanned = partitions.get_scanned_partitions(self.get_queryset(params))
+            # Monthly partitions out of the range must not be read, the default one may be
+            outside = [
+                name for name in scanned
+                if (month := partitions.partition_month(name)) is not None
+                and (month < first or (last is not None and month > last))
+            ]
+            results[label] = {'scanned': scanned, 'pruned': not outside}
+        return results
@@ -0,0 +1,31 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from api import pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the database connection pool with a query and print its statistics as JSON. "
+        "Statistics are the ones of this process pool, use the `api/pool-stats/` endpoint for a server worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Database alias (default: default).")
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in connections:
+            raise CommandError(f"Unknown database {alias}.")
+
+        connection_pool = pool.get_pool(alias)
+        if connection_pool is None:
+            raise CommandError(f"Connection pooling is not enabled on database {alias} (set DB_POOL=true).")
+        # Borrow a connection from the pool and return it, like a request would, without closing
+        # the Django connection of the caller (the pool is opened on first use, as Django does)
+        connection_pool.open()
+        with connection_pool.connection() as connection:
+            connection.execute('SELECT 1')
+
+        self.stdout.write(json.dumps(pool.get_pool_stats(alias, reset=options['reset'])))
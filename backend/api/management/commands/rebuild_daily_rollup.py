@@ -0,0 +1,38 @@
+import json
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.models import DailyOrderRollup, Order
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily order rollup from the orders, for all the dates or a date range (backfills)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', default=None, help="First date (YYYY-MM-DD).")
+        parser.add_argument('--to', dest='date_to', default=None, help="Last date (YYYY-MM-DD).")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Dates per refresh (default: 1000).")
+
+    def handle(self, *args, **options):
+        filters = {}
+        try:
+            if options['date_from']:
+                filters['date__gte'] = date.fromisoformat(options['date_from'])
+            if options['date_to']:
+                filters['date__lte'] = date.fromisoformat(options['date_to'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        # Dates with orders (even the deleted ones) or already in the rollup
+        dates = sorted(
+            Order.all_objects.filter(**filters).get_dates() |
+            set(DailyOrderRollup.objects.filter(**filters).values_list('date', flat=True))
+        )
+        chunk_size = options['chunk_size']
+        for offset in range(0, len(dates), chunk_size):
+            with transaction.atomic():
+                DailyOrderRollup.refresh(dates[offset:offset + chunk_size])
+        self.stdout.write(json.dumps({
+            'dates': len(dates),
+            'rollups': DailyOrderRollup.objects.filter(**filters).count(),
+        }))
@@ -0,0 +1,111 @@
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from api.models import Order, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed products and orders with bulk inserts, for load tests at production scale. "
+        "Orders link a skewed number of products (popular products are linked more often) "
+        "and a fraction of the rows is soft deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help="Number of products (default: 1000).")
+        parser.add_argument('--orders', type=int, default=10000, help="Number of orders (default: 10000).")
+        parser.add_argument('--mean-products', type=float, default=3,
+                            help="Mean number of products per order (default: 3).")
+        parser.add_argument('--max-products', type=int, default=20,
+                            help="Maximum number of products per order (default: 20).")
+        parser.add_argument('--deleted-fraction', type=float, default=0.05,
+                            help="Fraction of soft deleted products and orders (default: 0.05).")
+        parser.add_argument('--days', type=int, default=730,
+                            help="Orders are dated in the last N days (default: 730).")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per INSERT (default: 5000).")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed, for reproducible datasets.")
+
+    def handle(self, *args, **options):
+        if options['products'] < 1 and options['orders'] > 0:
+            raise CommandError("Orders need at least one product.")
+        if not 0 <= options['deleted_fraction'] <= 1:
+            raise CommandError("The deleted fraction must be between 0 and 1.")
+        self.random = random.Random(options['seed'])
+        self.options = options
+        self.now = timezone.now()
+
+        start = time.perf_counter()
+        products = self.seed_products()
+        orders, links = self.seed_orders(products)
+        self.stdout.write(json.dumps({
+            'products': len(products),
+            'orders': orders,
+            'order_products': links,
+            'seconds': round(time.perf_counter() - start, 2),
+        }))
+
+    def is_deleted(self):
+        return self.random.random() < self.options['deleted_fraction']
+
+    def seed_products(self):
+        # Return the (id, price) of the created products
+        products = []
+        batch_size = self.options['batch_size']
+        for offset in range(0, self.options['products'], batch_size):
+            batch = [
+                Product(
+                    name=f'Product {offset + index + 1}',
+                    price=Decimal(self.random.randint(100, 50000)) / 100,
+                    deleted_at=self.now if self.is_deleted() else None,
+                )
+                for index in range(min(batch_size, self.options['products'] - offset))
+            ]
+            with transaction.atomic():
+                Product.all_objects.bulk_create(batch)
+            products += [(product.id, product.price) for product in batch]
+        return products
+
+    def pick_products(self, products):
+        # Skewed fan-out (many small orders, few large ones) and product popularity
+        count = min(self.options['max_products'], 1 + int(self.random.expovariate(
+            1 / max(self.options['mean_products'] - 1, 0.01))))
+        picked = {products[int(len(products) * self.random.random() ** 2)] for _ in range(count)}
+        return sorted(picked)
+
+    def seed_orders(self, products):
+        # Orders are inserted with their totals, then linked to their products and snapshotted
+        Link = Order.products.through
+        batch_size = self.options['batch_size']
+        today = date.today()
+        total_orders = total_links = 0
+        for offset in range(0, self.options['orders'], batch_size):
+            batch, picked = [], []
+            for index in range(min(batch_size, self.options['orders'] - offset)):
+                order_products = self.pick_products(products)
+                number = offset + index + 1
+                batch.append(Order(
+                    name=f'Order {number}',
+                    description=f'Seeded order {number} of {len(order_products)} products',
+                    date=today - timedelta(days=self.random.randrange(max(self.options['days'], 1))),
+                    total_price=sum(price for _, price in order_products),
+                    product_count=len(order_products),
+                    deleted_at=self.now if self.is_deleted() else None,
+                ))
+                picked.append(order_products)
+            with transaction.atomic():
+                Order.all_objects.bulk_create(batch)
+                links = [
+                    Link(order_id=order.id, product_id=product_id)
+                    for order, order_products in zip(batch, picked)
+                    for product_id, _ in order_products
+                ]
+                Link.objects.bulk_create(links, batch_size=batch_size)
+                Order.all_objects.filter(pk__in=[order.id for order in batch]).update_snapshots()
+            total_orders += len(batch)
+            total_links += len(links)
+        return total_orders, total_links
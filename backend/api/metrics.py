@@ -0,0 +1,129 @@
+import time
+from contextvars import ContextVar
+from threading import Lock
+
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# SQL stats of the request being served, shared with the threads running its sync code
+current_queries = ContextVar('current_queries', default=None)
+
+
+class QueryStats:
+    """
+    Number and total time of the SQL queries executed while serving a request.
+    """
+    __slots__ = ('count', 'time')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+
+def record_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper, times the queries of the request being served (if any).
+    """
+    stats = current_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.time += time.perf_counter() - start
+
+
+class Metrics:
+    """
+    In-process registry of the request metrics, per route, action and method.
+    Every worker keeps its own metrics, scraped at its metrics URL.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # labels -> [bucket counts, duration sum, count, query count, query time]
+            self.requests = {}
+            # labels + status -> count
+            self.responses = {}
+
+    def observe(self, route, action, method, status, duration, queries):
+        labels = (route, action, method)
+        with self.lock:
+            series = self.requests.get(labels)
+            if series is None:
+                series = self.requests[labels] = [[0] * len(LATENCY_BUCKETS), 0.0, 0, 0, 0.0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += duration
+            series[2] += 1
+            series[3] += queries.count
+            series[4] += queries.time
+            key = (*labels, str(status))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            requests = {labels: [list(series[0]), *series[1:]] for labels, series in self.requests.items()}
+            responses = dict(self.responses)
+
+        lines = [
+            '# HELP api_requests_total Requests served, by route, action, method and status.',
+            '# TYPE api_requests_total counter',
+        ]
+        for (route, action, method, status), count in sorted(responses.items()):
+            lines.append(f'api_requests_total{format_labels(route, action, method, status=status)} {count}')
+
+        lines += [
+            '# HELP api_request_duration_seconds Request latency, by route, action and method.',
+            '# TYPE api_request_duration_seconds histogram',
+        ]
+        for (route, action, method), (buckets, duration, count, _, _) in sorted(requests.items()):
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'api_request_duration_seconds_bucket'
+                             f'{format_labels(route, action, method, le=str(bound))} {cumulative}')
+            labels = format_labels(route, action, method)
+            lines.append(f'api_request_duration_seconds_bucket{format_labels(route, action, method, le="+Inf")} {count}')
+            lines.append(f'api_request_duration_seconds_sum{labels} {duration}')
+            lines.append(f'api_request_duration_seconds_count{labels} {count}')
+
+        lines += [
+            '# HELP api_db_queries_total SQL queries executed, by route, action and method.',
+            '# TYPE api_db_queries_total counter',
+        ]
+        for (route, action, method), series in sorted(requests.items()):
+            lines.append(f'api_db_queries_total{format_labels(route, action, method)} {series[3]}')
+
+        lines += [
+            '# HELP api_db_query_duration_seconds_total Time spent in SQL queries, by route, action and method.',
+            '# TYPE api_db_query_duration_seconds_total counter',
+        ]
+        for (route, action, method), series in sorted(requests.items()):
+            lines.append(f'api_db_query_duration_seconds_total{format_labels(route, action, method)} {series[4]}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(route, action, method, **extra):
+    labels = {'route': route, 'action': action, 'method': method, **extra}
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+metrics = Metrics()
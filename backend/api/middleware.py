@@ -0,0 +1,66 @@
+import re
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .metrics import QueryStats, current_queries, metrics
+
+
+class MetricsMiddleware:
+    """
+    Record latency, SQL query count and SQL time of every request, by resolved route and action.
+    Works for sync and async views, the queries are counted by the `record_queries` execute wrapper.
+    """
+    sync_capable = True
+    async_capable = True
+    # Label of the requests not matching any route, to keep the number of series bounded
+    unmatched_route = 'unmatched'
+    # Named groups of the regex routes (e.g. the DRF router ones)
+    route_group = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        queries = QueryStats()
+        token = current_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        self.observe(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        queries = QueryStats()
+        token = current_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        self.observe(request, response, time.perf_counter() - start, queries)
+        return response
+
+    def observe(self, request, response, duration, queries):
+        route, action = self.get_labels(request)
+        metrics.observe(route, action, request.method, response.status_code, duration, queries)
+
+    def get_labels(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return self.unmatched_route, ''
+        # Viewset routes map the methods to their actions (list, retrieve, restore...)
+        actions = getattr(match.func, 'actions', None) or {}
+        action = actions.get(request.method.lower()) or match.url_name or ''
+        route = self.route_group.sub(r'<\1>', match.route).replace('^', '').replace('$', '')
+        return '/' + route, action
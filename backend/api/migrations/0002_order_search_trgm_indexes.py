@@ -0,0 +1,28 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+import api.operations
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are created concurrently, outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='order',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), condition=models.Q(('deleted_at__isnull', True)), name='order_name_trgm_idx'),
+        ),
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='order',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('description'), name='gin_trgm_ops'), condition=models.Q(('deleted_at__isnull', True)), name='order_description_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+import api.operations
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are created concurrently, outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0002_order_search_trgm_indexes'),
+    ]
+
+    operations = [
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['id'], name='product_live_id_idx'),
+        ),
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['id'], name='product_deleted_id_idx'),
+        ),
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['-date', '-id'], name='order_live_date_idx'),
+        ),
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['id'], name='order_deleted_id_idx'),
+        ),
+    ]
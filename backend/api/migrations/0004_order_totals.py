@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-18 00:33
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    links = Order.products.through.objects.filter(order_id=models.OuterRef('pk')) \
+        .order_by().values('order_id')
+    Order.objects.update(
+        total_price=Coalesce(
+            models.Subquery(links.annotate(total=models.Sum('product__price')).values('total')),
+            models.Value(0), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        product_count=Coalesce(
+            models.Subquery(links.annotate(count=models.Count('pk')).values('count')),
+            models.Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_soft_delete_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
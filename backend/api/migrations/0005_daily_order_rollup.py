@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-18 00:51
+
+from django.db import migrations, models
+
+
+def backfill_daily_rollup(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    DailyOrderRollup = apps.get_model('api', 'DailyOrderRollup')
+    rows = Order.objects.filter(deleted_at__isnull=True).order_by().values('date').annotate(
+        order_count=models.Count('id'),
+        product_count=models.Sum('product_count'),
+        revenue=models.Sum('total_price'),
+    )
+    DailyOrderRollup.objects.bulk_create([DailyOrderRollup(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.RunPython(backfill_daily_rollup, migrations.RunPython.noop),
+    ]
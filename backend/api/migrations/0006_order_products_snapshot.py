@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-18 00:54
+
+from django.db import migrations, models
+
+
+def backfill_products_snapshot(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    Link = Order.products.through
+    order_ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+    for offset in range(0, len(order_ids), 1000):
+        chunk = order_ids[offset:offset + 1000]
+        snapshots = {}
+        links = Link.objects.filter(order_id__in=chunk).order_by('order_id', 'product_id') \
+            .values_list('order_id', 'product_id', 'product__name', 'product__price', 'product__deleted_at')
+        for order_id, product_id, name, price, deleted_at in links:
+            snapshots.setdefault(order_id, []).append(
+                {'id': product_id, 'name': name, 'price': str(price), 'is_deleted': deleted_at is not None})
+        Order.objects.bulk_update(
+            [Order(pk=pk, products_snapshot=snapshots.get(pk, [])) for pk in chunk], ['products_snapshot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_daily_order_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='products_snapshot',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(backfill_products_snapshot, migrations.RunPython.noop),
+    ]
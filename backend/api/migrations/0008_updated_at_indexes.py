@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+import api.operations
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are created concurrently, outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0007_archived_record'),
+    ]
+
+    operations = [
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['updated_at', 'id'], name='order_updated_idx'),
+        ),
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+import api.operations
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are created concurrently, outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0008_updated_at_indexes'),
+    ]
+
+    operations = [
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='order',
+            index=django.contrib.postgres.indexes.BTreeIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='order_name_prefix_idx'),
+        ),
+        api.operations.PostgresAddIndexConcurrently(
+            model_name='product',
+            index=django.contrib.postgres.indexes.BTreeIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='product_name_prefix_idx'),
+        ),
+    ]
@@ -1,13 +1,62 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router, transaction
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from .cache import bump_version
+from .events import broker
 
 
-class SoftDeleteManager(models.Manager):
+class SoftDeleteQuerySet(models.QuerySet):
+    """
+    QuerySet with set-based soft delete and restore, each run as a single UPDATE.
+    Bulk writes bump the model version of the response cache and publish their change event,
+    bulk updates set `updated_at` (e.g. for the change feed).
+    """
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        bump_version(self.model)
+        if rows:
+            if 'deleted_at' not in kwargs:
+                action = 'updated'
+            else:
+                action = 'restored' if kwargs['deleted_at'] is None else 'deleted'
+            broker.publish(self.model, action, count=rows, using=self.db)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bump_version(self.model)
+        if objs:
+            broker.publish(self.model, 'created', ids=[obj.pk for obj in objs], using=self.db)
+        return objs
+
+    def delete(self):
+        deleted = super().delete()
+        bump_version(self.model)
+        return deleted
+
+    def soft_delete(self):
+        now = timezone.now()
+        return self.filter(deleted_at__isnull=True).update(deleted_at=now, updated_at=now)
+
+    def restore(self):
+        return self.filter(deleted_at__isnull=False).update(deleted_at=None, updated_at=timezone.now())
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
     def get_queryset(self):
         # retrive only istances not deleted (deleted_at is null)
         return super().get_queryset().filter(deleted_at__isnull=True)
 
 
+class ConcurrentUpdate(Exception):
+    """
+    Raised by a conditional save when the row was updated since it was read.
+    """
+
+
 class BaseModel(models.Model):
     """
     Abstract base model class inherited by other models.
@@ -19,38 +68,476 @@ class BaseModel(models.Model):
     deleted_at = models.DateTimeField(null=True, blank=True)
 
     objects = SoftDeleteManager()
-    all_objects = models.Manager()
+    all_objects = SoftDeleteQuerySet.as_manager()
+
+    # `updated_at` the row must still have for the next save to update it (optimistic concurrency)
+    _expected_updated_at = None
 
     class Meta:
         abstract = True
 
+    def save(self, *args, event=None, **kwargs):
+        # `event` is the action of the published change event, created or updated by default
+        created = self._state.adding
+        super().save(*args, **kwargs)
+        bump_version(type(self))
+        broker.publish(type(self), event or ('created' if created else 'updated'), ids=[self.pk],
+                       using=self._state.db)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected, self._expected_updated_at = self._expected_updated_at, None
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        # Conditional UPDATE, matching no row if another write came first
+        updated = super()._do_update(
+            base_qs.filter(updated_at=expected), using, pk_val, values, update_fields, forced_update)
+        if not updated:
+            raise ConcurrentUpdate(f"{self._meta.object_name} {pk_val} was updated since it was read.")
+        return updated
+
     def delete(self):
         # override delete with soft delete
         self.deleted_at = timezone.now()
-        self.save()
+        self.save(update_fields=['deleted_at', 'updated_at'], event='deleted')
 
     def restore(self):
         # restore method for soft delete
         self.deleted_at = None
-        self.save()
+        self.save(update_fields=['deleted_at', 'updated_at'], event='restored')
 
     def is_deleted(self):
         return self.deleted_at is not None
 
 
+class ProductQuerySet(SoftDeleteQuerySet):
+    """
+    QuerySet for products, bulk updates refresh the totals and snapshots of the orders containing them.
+    """
+    # Product fields copied in the orders (snapshot and totals)
+    order_fields = {'name', 'price', 'deleted_at'}
+    # Orders refreshed per transaction by refresh_orders
+    refresh_batch_size = 1000
+
+    def update(self, **kwargs):
+        if not self.order_fields.intersection(kwargs):
+            return super().update(**kwargs)
+        # Products can leave the queryset with the update (e.g. soft delete), read their ids before
+        product_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        if product_ids:
+            self.model.all_objects.using(self.db).filter(pk__in=product_ids).refresh_orders()
+        return rows
+
+    def refresh_orders(self):
+        """
+        Refresh the totals and snapshots of the orders (even the deleted ones) containing the products,
+        once the current transaction commits: in batches of orders in pk order, each one in its own
+        transaction, so the product write doesn't lock all the orders of a popular product at once.
+        """
+        using = self.db
+        orders = Order.all_objects.using(using).filter(
+            pk__in=Order.products.through.objects.filter(product_id__in=self.values('pk')).values('order_id')
+        ).order_by('pk')
+
+        def refresh():
+            last = None
+            while True:
+                batch = orders if last is None else orders.filter(pk__gt=last)
+                # Last order of the batch, None for the last batch
+                last = next(iter(batch.values_list('pk', flat=True)
+                                 [self.refresh_batch_size - 1:self.refresh_batch_size]), None)
+                with transaction.atomic(using=using):
+                    (batch if last is None else batch.filter(pk__lte=last)).refresh_products()
+                if last is None:
+                    return
+
+        transaction.on_commit(refresh, using=using)
+
+
+def sum_rollup_values(rows):
+    """
+    Return the daily rollup values of the (date, deleted_at, total_price, product_count) rows of orders by date.
+    """
+    values = {}
+    for date, deleted_at, total_price, product_count in rows:
+        if deleted_at is None:
+            day = values.setdefault(date, {'order_count': 0, 'product_count': 0, 'revenue': 0})
+            day['order_count'] += 1
+            day['product_count'] += product_count
+            day['revenue'] += total_price
+    return values
+
+
+class OrderQuerySet(SoftDeleteQuerySet):
+    """
+    QuerySet for orders, with the set-based refresh of the denormalized totals and products snapshots.
+    Bulk writes add the changes of the written orders to the daily rollup: the orders are locked and
+    their values read before the write, then the difference is added to the rollup of each date.
+    """
+    # Order fields aggregated in the daily rollup, in the order of sum_rollup_values
+    rollup_columns = ('date', 'deleted_at', 'total_price', 'product_count')
+    rollup_fields = set(rollup_columns)
+    # Set by with_product_ids
+    _with_product_ids = False
+
+    def get_dates(self):
+        return set(self.order_by().values_list('date', flat=True).distinct())
+
+    def get_rollup_values(self):
+        """
+        Return the daily rollup values of the active orders by date, with a single aggregate query.
+        """
+        rows = self.filter(deleted_at__isnull=True).order_by().values('date').annotate(
+            order_count=models.Count('id'),
+            product_count=Coalesce(models.Sum('product_count'), 0),
+            revenue=Coalesce(models.Sum('total_price'), models.Value(0),
+                             output_field=models.DecimalField(max_digits=14, decimal_places=2)),
+        )
+        return {row.pop('date'): row for row in rows}
+
+    @classmethod
+    def to_rollup_row(cls, values):
+        # Row of sum_rollup_values from the values by field name (e.g. of an instance, not saved yet)
+        return [Order._meta.get_field(name).to_python(values[name]) for name in cls.rollup_columns]
+
+    def lock_rollup_rows(self):
+        # Lock the orders (in pk order) and read their rollup values, no concurrent write
+        # can change them until the end of the transaction
+        return list(self.select_for_update().order_by('pk').values_list('pk', *self.rollup_columns))
+
+    def update(self, **kwargs):
+        if not self.rollup_fields.intersection(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = self.lock_rollup_rows()
+            pks = [row[0] for row in rows]
+            # Only the locked orders are written, not the ones matching the filters since
+            rows_updated = super(OrderQuerySet, self.filter(pk__in=pks)).update(**kwargs)
+            before = sum_rollup_values(row[1:] for row in rows)
+            if any(hasattr(kwargs.get(name), 'resolve_expression') for name in self.rollup_columns):
+                # New values computed by the database (e.g. totals, bulk_update)
+                after = self.model.all_objects.using(self.db).filter(pk__in=pks).get_rollup_values()
+            else:
+                after = sum_rollup_values(
+                    self.to_rollup_row({**dict(zip(self.rollup_columns, row[1:])), **kwargs}) for row in rows)
+            DailyOrderRollup.add_changes(before, after, using=self.db)
+        return rows_updated
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            if kwargs.get('update_conflicts'):
+                # Upserted orders had unknown previous values, recompute their dates
+                DailyOrderRollup.refresh({obj.date for obj in objs}, using=self.db)
+            else:
+                DailyOrderRollup.add_changes({}, sum_rollup_values(
+                    self.to_rollup_row(obj.__dict__) for obj in objs), using=self.db)
+        return objs
+
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = self.lock_rollup_rows()
+            deleted = super(OrderQuerySet, self.filter(pk__in=[row[0] for row in rows])).delete()
+            DailyOrderRollup.add_changes(sum_rollup_values(row[1:] for row in rows), {}, using=self.db)
+        return deleted
+
+    def update_totals(self):
+        # Single UPDATE computing total_price and product_count from the linked products
+        # (updated_at included, the orders are modified as their products changed)
+        links = self.model.products.through.objects.filter(order_id=models.OuterRef('pk')) \
+            .order_by().values('order_id')
+        return self.update(
+            total_price=Coalesce(
+                models.Subquery(links.annotate(total=models.Sum('product__price')).values('total')),
+                models.Value(0), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+            product_count=Coalesce(
+                models.Subquery(links.annotate(count=models.Count('pk')).values('count')),
+                models.Value(0)),
+        )
+
+    def with_product_ids(self):
+        """
+        Load the ids of the linked products of the fetched orders (see `Order.get_product_ids`)
+        with one query on the through table, instead of prefetching the products.
+        """
+        clone = self._chain()
+        clone._with_product_ids = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_product_ids = self._with_product_ids
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super()._fetch_all()
+        if self._with_product_ids and not fetched:
+            orders = [order for order in self._result_cache if isinstance(order, Order)]
+            links = self.model.products.through.objects.filter(order_id__in=[order.pk for order in orders]) \
+                .order_by('order_id', 'product_id').values_list('order_id', 'product_id')
+            product_ids = {}
+            for order_id, product_id in links:
+                product_ids.setdefault(order_id, []).append(product_id)
+            for order in orders:
+                order._product_ids = product_ids.get(order.pk, [])
+
+    def get_snapshots(self):
+        """
+        Return the products snapshot (id, name, price and is_deleted, sorted by id) of each order.
+        """
+        links = self.model.products.through.objects.filter(order_id__in=self.values('pk')) \
+            .order_by('order_id', 'product_id') \
+            .values_list('order_id', 'product_id', 'product__name', 'product__price', 'product__deleted_at')
+        snapshots = {}
+        for order_id, product_id, name, price, deleted_at in links:
+            snapshots.setdefault(order_id, []).append(
+                {'id': product_id, 'name': name, 'price': str(price), 'is_deleted': deleted_at is not None})
+        return snapshots
+
+    def update_snapshots(self, chunk_size=1000):
+        # Snapshots built in Python and written with one bulk UPDATE per chunk of orders
+        order_ids = list(self.values_list('pk', flat=True))
+        for offset in range(0, len(order_ids), chunk_size):
+            chunk = order_ids[offset:offset + chunk_size]
+            snapshots = self.model.all_objects.filter(pk__in=chunk).get_snapshots()
+            self.model.all_objects.bulk_update(
+                [self.model(pk=pk, products_snapshot=snapshots.get(pk, [])) for pk in chunk],
+                ['products_snapshot'])
+
+    def refresh_products(self):
+        """
+        Refresh the totals and the products snapshots of the orders from their linked products.
+        """
+        self.update_totals()
+        self.update_snapshots()
+
+
 class Product(BaseModel):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=8, decimal_places=2)
 
+    objects = SoftDeleteManager.from_queryset(ProductQuerySet)()
+    all_objects = ProductQuerySet.as_manager()
+
+    _loaded_values = None
+
+    class Meta:
+        indexes = [
+            # Partial indexes for active rows (default manager) and deleted rows (restore)
+            models.Index(fields=['id'], condition=models.Q(deleted_at__isnull=True),
+                         name='product_live_id_idx'),
+            models.Index(fields=['id'], condition=models.Q(deleted_at__isnull=False),
+                         name='product_deleted_id_idx'),
+            # Change feed, deleted rows included
+            models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+            # Postgres only index on UPPER(name) for the admin prefix search
+            # (product_name_prefix_idx) is created by migration 0009
+        ]
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep track of the stored values copied in the orders to detect their changes on save
+        instance._loaded_values = instance.get_order_values()
+        return instance
+
+    def get_order_values(self):
+        return {name: self.__dict__.get(name) for name in ProductQuerySet.order_fields}
+
+    def save(self, *args, **kwargs):
+        changed = not self._state.adding and self.get_order_values() != self._loaded_values
+        super().save(*args, **kwargs)
+        self._loaded_values = self.get_order_values()
+        if changed:
+            Product.all_objects.using(self._state.db).filter(pk=self.pk).refresh_orders()
+
 
 class Order(BaseModel):
     name = models.CharField(max_length=100)
     description = models.CharField(max_length=255)
     date = models.DateField(db_index=True)
     products = models.ManyToManyField(Product)
+    # Denormalized values of the linked products, refreshed by OrderQuerySet.refresh_products
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    product_count = models.PositiveIntegerField(default=0)
+    # Compact copy of the linked products, to read orders without joins
+    products_snapshot = models.JSONField(default=list, blank=True)
+
+    objects = SoftDeleteManager.from_queryset(OrderQuerySet)()
+    all_objects = OrderQuerySet.as_manager()
+
+    # Ids of the linked products loaded by OrderQuerySet.with_product_ids
+    _product_ids = None
+
+    class Meta:
+        indexes = [
+            # Partial indexes for active rows (default manager) and deleted rows (restore)
+            models.Index(fields=['-date', '-id'], condition=models.Q(deleted_at__isnull=True),
+                         name='order_live_date_idx'),
+            models.Index(fields=['id'], condition=models.Q(deleted_at__isnull=False),
+                         name='order_deleted_id_idx'),
+            # Change feed, deleted rows included
+            models.Index(fields=['updated_at', 'id'], name='order_updated_idx'),
+            # Postgres only trigram indexes on name and description for search
+            # (order_name_trgm_idx, order_description_trgm_idx) are created by migration 0002,
+            # the one on UPPER(name) for the admin prefix search (order_name_prefix_idx) by migration 0009
+        ]
 
     def __str__(self):
         return f"Order num: {self.name}"
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is not None and not OrderQuerySet.rollup_fields.intersection(update_fields):
+            return super().save(*args, update_fields=update_fields, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(Order, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            # Stored values, read with the row locked (the loaded ones may be stale)
+            rows = Order.all_objects.using(using).filter(pk=self.pk).lock_rollup_rows() \
+                if not self._state.adding and self.pk is not None else []
+            super().save(*args, update_fields=update_fields, **kwargs)
+            stored = dict(zip(OrderQuerySet.rollup_columns, rows[0][1:])) if rows else {}
+            written = {name: self.__dict__[name] for name in OrderQuerySet.rollup_columns
+                       if name in self.__dict__ and (update_fields is None or name in update_fields)}
+            DailyOrderRollup.add_changes(
+                sum_rollup_values([rows[0][1:]] if rows else []),
+                sum_rollup_values([OrderQuerySet.to_rollup_row({**stored, **written})]), using=using)
+
+    def get_product_ids(self):
+        """
+        Return the ids of the linked products (sorted), read from the through table only.
+        """
+        if self._product_ids is None:
+            self._product_ids = list(Order.products.through.objects.filter(order_id=self.pk)
+                                     .order_by('product_id').values_list('product_id', flat=True))
+        return self._product_ids
+
+    def refresh_totals(self):
+        orders = Order.all_objects.filter(pk=self.pk)
+        expected, self._expected_updated_at = self._expected_updated_at, None
+        if expected is None:
+            orders.refresh_products()
+        else:
+            # Not saved since read (e.g. only the products changed): the totals UPDATE is the conditional one
+            if not orders.filter(updated_at=expected).update_totals():
+                raise ConcurrentUpdate(f"{self._meta.object_name} {self.pk} was updated since it was read.")
+            orders.update_snapshots()
+        self.refresh_from_db(fields=['total_price', 'product_count', 'products_snapshot', 'updated_at'])
+
+    def diff_products(self, products):
+        """
+        Return the ids of the products (or ids) to unlink from and to link to the order to have the given ones.
+        The current ones are read from the prefetched products, if any.
+        """
+        new = {getattr(product, 'pk', product) for product in products}
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('products')
+        if prefetched is not None:
+            current = {product.pk for product in prefetched}
+        else:
+            current = set(Order.products.through.objects.filter(order_id=self.pk)
+                          .values_list('product_id', flat=True))
+        return current - new, new - current
+
+    def update_products(self, removed, added):
+        """
+        Unlink and link the products with one DELETE and one bulk INSERT,
+        then refresh the totals and snapshot once.
+        """
+        Link = Order.products.through
+        if removed:
+            Link.objects.filter(order_id=self.pk, product_id__in=removed).delete()
+        if added:
+            Link.objects.bulk_create([Link(order_id=self.pk, product_id=pk) for pk in sorted(added)])
+        getattr(self, '_prefetched_objects_cache', {}).pop('products', None)
+        self.refresh_totals()
+
+
+class DailyOrderRollup(models.Model):
+    """
+    Daily count, products and revenue of the active orders, kept up to date by the order writes
+    (adding their changes to the rows of their dates) and rebuilt by `rebuild_daily_rollup`.
+    Dates without active orders have no row.
+    """
+    date = models.DateField(unique=True)
+    order_count = models.PositiveIntegerField(default=0)
+    product_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"Orders of {self.date}"
+
+    value_fields = ['order_count', 'product_count', 'revenue']
+
+    @classmethod
+    def add_changes(cls, before, after, using='default'):
+        """
+        Add the differences between the rollup values of the written orders after and before their writes
+        (see `sum_rollup_values`) to the rows of their dates, each one with an UPDATE incrementing it:
+        concurrent writes of the same date add up instead of overwriting each other.
+        Rows are updated in date order (no deadlocks between writes of several dates) and deleted
+        when they have no orders anymore.
+        """
+        now = timezone.now()
+        manager = cls.objects.db_manager(using)
+        for date in sorted(before.keys() | after.keys()):
+            changes = {name: after.get(date, {}).get(name, 0) - before.get(date, {}).get(name, 0)
+                       for name in cls.value_fields}
+            if not any(changes.values()):
+                continue
+            values = {name: models.F(name) + change for name, change in changes.items()}
+            # Rows are created for the first order of their date, and may be deleted concurrently
+            while not manager.filter(date=date).update(updated_at=now, **values):
+                manager.bulk_create([cls(date=date)], ignore_conflicts=True)
+            if changes['order_count'] < 0:
+                manager.filter(date=date, order_count=0).delete()
+
+    @classmethod
+    def refresh(cls, dates, using='default'):
+        """
+        Recompute the rollup of the given dates from the active orders, with a single aggregate query,
+        e.g. after writes of orders by raw SQL. The rows of the dates are locked during the
+        recomputation, so the concurrent order writes are either included or added after it.
+        """
+        dates = sorted({date for date in dates if date is not None})
+        if not dates:
+            return
+        manager = cls.objects.db_manager(using)
+        with transaction.atomic(using=using, savepoint=False):
+            manager.bulk_create([cls(date=date) for date in dates], ignore_conflicts=True)
+            rollups = list(manager.select_for_update().filter(date__in=dates).order_by('date'))
+            values = Order.objects.using(using).filter(date__in=dates).get_rollup_values()
+            for rollup in rollups:
+                for name, value in values.get(rollup.date, {}).items():
+                    setattr(rollup, name, value)
+                rollup.updated_at = timezone.now()
+            manager.bulk_update([rollup for rollup in rollups if rollup.date in values],
+                                cls.value_fields + ['updated_at'])
+            # Dates without active orders anymore
+            manager.filter(pk__in=[rollup.pk for rollup in rollups if rollup.date not in values]).delete()
+
+
+class ArchivedRecord(models.Model):
+    """
+    Row of a soft deleted item removed by `archive_deleted` after the retention period.
+    Orders keep the ids of their products in `data`.
+    """
+    model_label = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    deleted_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model_label', 'object_id'], name='archive_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_label} {self.object_id}"
@@ -0,0 +1,53 @@
+from django.contrib.postgres.indexes import PostgresIndex
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db.migrations import AddIndex
+from .partitions import get_partitions, is_partitioned
+
+
+class PostgresAddIndexConcurrently(AddIndexConcurrently):
+    """
+    Create an index concurrently (without locking writes) on Postgres.
+    On other databases (e.g. SQLite for local tests) the index is created
+    normally, or skipped when it relies on Postgres specific features
+    (e.g. GIN indexes). Those indexes are kept out of the model state,
+    otherwise SQLite would try to recreate them on every table rebuild.
+    Partitioned tables (e.g. the orders) don't support concurrent index creation:
+    the index is created on each partition concurrently, then attached to the table one.
+    """
+
+    def state_forwards(self, app_label, state):
+        if not isinstance(self.index, PostgresIndex):
+            super().state_forwards(app_label, state)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if is_partitioned(schema_editor.connection, model._meta.db_table):
+            self.add_partitioned_index(schema_editor, model)
+        elif schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        elif not isinstance(self.index, PostgresIndex):
+            AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if is_partitioned(schema_editor.connection, model._meta.db_table):
+            # Dropping the table index drops the partition ones
+            schema_editor.remove_index(model, self.index)
+        elif schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        elif not isinstance(self.index, PostgresIndex):
+            AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+    def add_partitioned_index(self, schema_editor, model):
+        table = model._meta.db_table
+        quote = schema_editor.quote_name
+        # Invalid until an index of every partition is attached
+        statement = self.index.create_sql(model, schema_editor)
+        schema_editor.execute(str(statement).replace(f' ON {quote(table)} ', f' ON ONLY {quote(table)} ', 1))
+        for partition in get_partitions(schema_editor.connection, table):
+            name = f'{partition}_{self.index.name}'[:schema_editor.connection.ops.max_name_length()]
+            statement = self.index.create_sql(model, schema_editor, concurrently=True)
+            statement.rename_table_references(table, partition)
+            statement.parts['name'] = quote(name)
+            schema_editor.execute(statement)
+            schema_editor.execute(f'ALTER INDEX {quote(self.index.name)} ATTACH PARTITION {quote(name)}')
@@ -0,0 +1,349 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import timedelta
+from functools import reduce
+from types import SimpleNamespace
+from operator import or_
+
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+Cursor = namedtuple('Cursor', ['position', 'reverse'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over the queryset ordering plus the primary key.
+    Pages are fetched with a WHERE on the last seen key instead of OFFSET,
+    and no COUNT(*) is executed, so every page costs the same.
+    Cursors hold the key values (not positions), so they stay valid while
+    rows are inserted or soft deleted.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([item async for item in self.get_page_queryset(queryset, request)])
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+        self.cursor = self.decode_cursor(request)
+
+        self.reverse = self.cursor is not None and self.cursor.reverse
+        ordering = self.invert_ordering(self.ordering) if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(
+                self.build_seek_filter(ordering, self.to_python(self.cursor.position)))
+        # Fetch one more item to know if there is another page
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def get_ordering(self, queryset):
+        # Use the ordering already applied (e.g. by OrderingFilter) with the pk as tie breaker,
+        # annotations (e.g. search rank) and related fields cannot be part of the key
+        pk_name = self.model._meta.pk.name
+        fields = {field.name for field in self.model._meta.concrete_fields}
+        ordering = []
+        for field in queryset.query.order_by or self.model._meta.ordering:
+            if not isinstance(field, str):
+                continue
+            if field.lstrip('-') == 'pk':
+                field = field.replace('pk', pk_name, 1)
+            if field.lstrip('-') in fields:
+                ordering.append(field)
+        if pk_name not in [field.lstrip('-') for field in ordering]:
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append(f'-{pk_name}' if descending else pk_name)
+        return ordering
+
+    @staticmethod
+    def invert_ordering(ordering):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+    @staticmethod
+    def build_seek_filter(ordering, position):
+        # Row comparison (a, b, c) > (x, y, z) expanded to support mixed directions:
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equals = {f.lstrip('-'): value for f, value in zip(ordering[:index], position)}
+            conditions.append(Q(**equals, **{f'{name}__{lookup}': position[index]}))
+        return reduce(or_, conditions)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if payload['o'] != self.ordering or len(payload['p']) != len(self.ordering):
+                raise ValueError
+            # Validate the position values against the model fields
+            self.to_python(payload['p'])
+            return Cursor(position=payload['p'], reverse=bool(payload['r']))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, cursor):
+        payload = {'o': self.ordering, 'p': cursor.position, 'r': int(cursor.reverse)}
+        encoded = urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def to_python(self, position):
+        return [
+            self.model._meta.get_field(field.lstrip('-')).to_python(value)
+            for field, value in zip(self.ordering, position)
+        ]
+
+    def get_position(self, instance):
+        # Instances can also be rows of a `.values()` queryset
+        if isinstance(instance, dict):
+            instance = SimpleNamespace(**instance)
+        return [
+            self.model._meta.get_field(field.lstrip('-')).value_to_string(instance)
+            for field in self.ordering
+        ]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self.get_position(self.page[-1])
+        else:
+            # Empty page reached backwards, next page starts again from the cursor
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(position=position, reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self.get_position(self.page[0])
+        else:
+            # Empty page reached forwards, previous page ends at the cursor
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(position=position, reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'The pagination cursor value.',
+            'schema': {'type': 'string'},
+        }]
+
+
+class ChangeFeedPagination(KeysetPagination):
+    """
+    Forward only keyset pagination of the change feed on (updated_at, id), deleted rows included,
+    starting from `updated_since` (or from the `cursor`, which takes precedence).
+    The next link is always returned (from the last change, or the current position without changes)
+    to be stored by the clients and polled to resume the feed.
+    Changes that may still be followed by rows committed with an earlier `updated_at` are held back:
+    on Postgres the ones since the start of the oldest open transaction having written, up to
+    `CHANGE_FEED_MAX_DELAY` seconds ago (so a stuck transaction can't freeze the feed), and on every database
+    the ones of the last `CHANGE_FEED_DELAY` seconds, covering the time between the `updated_at` stamp and the
+    first write of its transaction and the clock skew between the servers. Other databases rely on the delay
+    only, so their write transactions must be shorter than it (and than the maximum delay on Postgres).
+    """
+    updated_since_param = 'updated_since'
+    ordering = ['updated_at', 'id']
+
+    def get_ordering(self, queryset):
+        return list(self.ordering)
+
+    def get_oldest_transaction(self, connection):
+        # Start of the oldest open transaction of the other sessions having written (with a transaction id,
+        # read only ones can't commit changes), Postgres only. Read before the changes: a transaction
+        # committing in between is then either seen or held back
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT min(xact_start) FROM pg_stat_activity WHERE datname = current_database() "
+                           "AND pid <> pg_backend_pid() AND backend_xid IS NOT NULL")
+            return cursor.fetchone()[0]
+
+    def get_page_queryset(self, queryset, request):
+        horizon = self.get_oldest_transaction(connections[queryset.db])
+        if horizon is not None or settings.CHANGE_FEED_DELAY:
+            now = timezone.now()
+            horizon = max(min(horizon or now, now), now - timedelta(seconds=settings.CHANGE_FEED_MAX_DELAY))
+            queryset = queryset.filter(updated_at__lt=horizon - timedelta(seconds=settings.CHANGE_FEED_DELAY))
+        return super().get_page_queryset(queryset, request)
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is not None:
+            if cursor.reverse:
+                raise NotFound(self.invalid_cursor_message)
+            return cursor
+        value = request.query_params.get(self.updated_since_param)
+        if not value:
+            return None
+        since = parse_datetime(value)
+        if since is None:
+            raise ValidationError({self.updated_since_param: ["Enter a valid ISO 8601 date and time."]})
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        # Seek from before the first id, the changes at `updated_since` are included
+        return Cursor(position=[since.isoformat(), '0'], reverse=False)
+
+    def get_next_link(self):
+        if self.page:
+            position = self.get_position(self.page[-1])
+        elif self.cursor is not None:
+            position = self.cursor.position
+        else:
+            # No changes at all yet, poll from the start again
+            return self.base_url
+        return self.encode_cursor(Cursor(position=position, reverse=False))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'has_more': self.has_next,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['next', 'has_more', 'results'],
+            'properties': {
+                'next': {'type': 'string', 'format': 'uri'},
+                'has_more': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [{
+            'name': self.updated_since_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Return the changes from this ISO 8601 date and time.',
+            'schema': {'type': 'string', 'format': 'date-time'},
+        }]
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    """
+    DRF page number pagination, with the async evaluation of the page for the async read views.
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        # Validate the page on the items count, then fetch only its items
+        count = await queryset.acount()
+        paginator = self.django_paginator_class(range(count), page_size)
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            # The browsable API should display pagination controls.
+            self.display_page_controls = True
+
+        self.request = request
+        bottom = (self.page.number - 1) * paginator.per_page
+        self.page.object_list = [item async for item in queryset[bottom:bottom + len(self.page)]]
+        return list(self.page)
+
+
+class OrderPagination(PageNumberPagination):
+    """
+    Page number pagination by default (backwards compatible), switches to
+    keyset pagination when requested with `?pagination=keyset` or a `cursor`.
+    """
+    mode_query_param = 'pagination'
+    keyset_mode = 'keyset'
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_keyset(request):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        if self.is_keyset(request):
+            self.keyset = self.keyset_class()
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        self.keyset = None
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def is_keyset(self, request):
+        params = request.query_params
+        return params.get(self.mode_query_param) == self.keyset_mode or \
+            bool(params.get(self.keyset_class.cursor_query_param))
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [{
+            'name': self.mode_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Set to `keyset` to paginate with cursors instead of page numbers.',
+            'schema': {'type': 'string', 'enum': [self.keyset_mode]},
+        }] + self.keyset_class().get_schema_operation_parameters(view)
@@ -0,0 +1,303 @@
+"""
+Postgres declarative range partitioning of the orders table by `date`, with monthly partitions
+(`api_order_pYYYY_MM`) and a default partition catching the dates out of them.
+Partitioned tables can't have unique indexes without the partition key, so the primary key
+is (id, date): ids stay unique through their sequence, and the foreign key of the order
+products links on the orders is replaced by constraint triggers checking the same.
+The orders table is converted online, see `start_conversion`.
+"""
+import re
+from datetime import date
+from django.db import connections, transaction
+from .cache import bump_version
+from .models import DailyOrderRollup, Order
+
+
+TABLE = 'api_order'
+DEFAULT_PARTITION = f'{TABLE}_default'
+LINKS_TABLE = f'{TABLE}_products'
+# Partitioned table built during the conversion, and plain table kept after it (to drop by hand)
+STAGING_TABLE = f'{TABLE}_partitioned'
+OLD_TABLE = f'{TABLE}_unpartitioned'
+MIRROR_TRIGGER = f'{TABLE}_mirror'
+partition_name_re = re.compile(rf'^{TABLE}_p(\d{{4}})_(\d{{2}})$')
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month.year:04d}_{month.month:02d}'
+
+
+def partition_month(name):
+    match = partition_name_re.match(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def is_partitioned(connection, table=TABLE):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def get_partitions(connection, table=TABLE):
+    """
+    Return the names of the attached partitions of the table.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = to_regclass(%s) ORDER BY child.relname', [table])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_index_names(connection, index):
+    """
+    Return the name of the index and of its partition indexes, as they appear in the query plans.
+    """
+    return [index, *get_partitions(connection, index)] if is_partitioned(connection) else [index]
+
+
+def create_partition(connection, month, table=TABLE):
+    """
+    Create the partition of the month, if missing. The rows of the month already in the default
+    partition are moved into it, before attaching it (the indexes are created on attach).
+    """
+    name = partition_name(month)
+    if name in get_partitions(connection, table):
+        return False
+    quote = connection.ops.quote_name
+    bounds = [month, add_months(month, 1)]
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f'WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} WHERE date >= %s AND date < %s '
+                       f'RETURNING *) INSERT INTO {quote(name)} SELECT * FROM moved', bounds)
+        cursor.execute(f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(name)} '
+                       f'FOR VALUES FROM (%s) TO (%s)', bounds)
+    return True
+
+
+def ensure_partitions(connection, first, last, table=TABLE):
+    """
+    Create the missing monthly partitions from the month of `first` to the one of `last`,
+    return the names of the created ones.
+    """
+    created, month = [], month_start(first)
+    while month <= last:
+        if create_partition(connection, month, table):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def detach_partitions(connection, before, drop=False, table=TABLE):
+    """
+    Detach the monthly partitions entirely before the month of `before`, return their names.
+    Detached partitions are kept as plain tables (e.g. to be archived or reattached),
+    with `drop` they are dropped along with the order products links of their orders.
+    Their orders leave the table either way: the daily rollup of their months is recomputed
+    and the cached order responses are invalidated.
+    """
+    quote = connection.ops.quote_name
+    detached = []
+    with connection.cursor() as cursor:
+        for name in get_partitions(connection, table):
+            month = partition_month(name)
+            if month is None or add_months(month, 1) > month_start(before):
+                continue
+            cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}')
+            if drop:
+                cursor.execute(f'DELETE FROM {quote(LINKS_TABLE)} '
+                               f'WHERE order_id IN (SELECT id FROM {quote(name)})')
+                cursor.execute(f'DROP TABLE {quote(name)}')
+            detached.append(name)
+    if detached:
+        months = [partition_month(name) for name in detached]
+        rollups = DailyOrderRollup.objects.using(connection.alias).filter(
+            date__gte=min(months), date__lt=add_months(max(months), 1))
+        DailyOrderRollup.refresh(rollups.values_list('date', flat=True), using=connection.alias)
+        bump_version(Order)
+    return detached
+
+
+def get_scanned_partitions(queryset):
+    """
+    Return the partitions of the orders table read by the query plan of the queryset.
+    """
+    plan = queryset.explain()
+    connection = connections[queryset.db]
+    return [name for name in get_partitions(connection) if re.search(rf'\b{re.escape(name)}\b', plan)]
+
+
+def get_index_definitions(cursor, table):
+    # Indexes other than the primary key, as (name, definition)
+    cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() "
+                   "AND tablename = %s AND indexname <> %s ORDER BY indexname", [table, f'{table}_pkey'])
+    return cursor.fetchall()
+
+
+def suffixed(name, suffix):
+    return f'{name[:63 - len(suffix)]}{suffix}'
+
+
+def get_foreign_keys(cursor, table, referenced):
+    cursor.execute("SELECT conname FROM pg_constraint WHERE contype = 'f' AND conrelid = to_regclass(%s) "
+                   "AND confrelid = to_regclass(%s)", [table, referenced])
+    return [row[0] for row in cursor.fetchall()]
+
+
+MIRROR_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION {MIRROR_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM {STAGING_TABLE} WHERE id = OLD.id;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO {STAGING_TABLE} SELECT NEW.*;
+    END IF;
+    RETURN NULL;
+END $$
+"""
+
+# Checks of the foreign key of the links, deferred to the commit like the Django foreign keys:
+# the order of a link must exist (locked as a foreign key would), and an order can't be
+# deleted while linked (rows moved to another partition by a date change still exist)
+LINKS_INTEGRITY_SQL = [
+    f"""
+    CREATE OR REPLACE FUNCTION {LINKS_TABLE}_check_order() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM 1 FROM {TABLE} WHERE id = NEW.order_id FOR KEY SHARE;
+        IF NOT FOUND THEN
+            RAISE foreign_key_violation USING MESSAGE = format(
+                'Key (order_id)=(%s) is not present in table "{TABLE}".', NEW.order_id);
+        END IF;
+        RETURN NULL;
+    END $$
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION {TABLE}_check_links() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM {LINKS_TABLE} WHERE order_id = OLD.id)
+                AND NOT EXISTS (SELECT 1 FROM {TABLE} WHERE id = OLD.id) THEN
+            RAISE foreign_key_violation USING MESSAGE = format(
+                'Key (id)=(%s) is still referenced from table "{LINKS_TABLE}".', OLD.id);
+        END IF;
+        RETURN NULL;
+    END $$
+    """,
+    f"""
+    CREATE CONSTRAINT TRIGGER {LINKS_TABLE}_order_fk AFTER INSERT OR UPDATE OF order_id ON {LINKS_TABLE}
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION {LINKS_TABLE}_check_order()
+    """,
+    f"""
+    CREATE CONSTRAINT TRIGGER {TABLE}_links_fk AFTER DELETE ON {TABLE}
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION {TABLE}_check_links()
+    """,
+]
+
+
+def start_conversion(connection, months_ahead=3):
+    """
+    First step of the online conversion of the orders table: create the partitioned table next to it,
+    with its partitions and indexes, and a trigger mirroring every write of the orders table into it.
+    Return False when already started (e.g. to resume an interrupted copy).
+    """
+    quote = connection.ops.quote_name
+    sequence = f'{STAGING_TABLE}_id_seq'
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [STAGING_TABLE])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(f'CREATE TABLE {quote(STAGING_TABLE)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS '
+                       f'INCLUDING CONSTRAINTS) PARTITION BY RANGE (date)')
+        # Ids from a sequence of its own, identity columns of partitioned tables need Postgres 17
+        cursor.execute(f'CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(STAGING_TABLE)}.id')
+        cursor.execute(f"ALTER TABLE {quote(STAGING_TABLE)} ALTER COLUMN id "
+                       f"SET DEFAULT nextval('{sequence}'::regclass)")
+        cursor.execute(f'SELECT min(date) FROM {quote(TABLE)}')
+        first = cursor.fetchone()[0] or date.today()
+        cursor.execute(f'CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {quote(STAGING_TABLE)} DEFAULT')
+        ensure_partitions(connection, first, add_months(month_start(date.today()), months_ahead), STAGING_TABLE)
+        # Created empty then filled by the copy, the indexes get their names on the swap
+        cursor.execute(f'ALTER TABLE {quote(STAGING_TABLE)} ADD CONSTRAINT {quote(f"{STAGING_TABLE}_pkey")} '
+                       f'PRIMARY KEY (id, date)')
+        for name, definition in get_index_definitions(cursor, TABLE):
+            cursor.execute(re.sub(
+                rf'^(CREATE (?:UNIQUE )?INDEX) {re.escape(name)} ON (?:ONLY )?\S+ ',
+                lambda match: f'{match[1]} {quote(suffixed(name, "_new"))} ON {quote(STAGING_TABLE)} ',
+                definition))
+        cursor.execute(MIRROR_FUNCTION_SQL)
+        cursor.execute(f'CREATE TRIGGER {quote(MIRROR_TRIGGER)} AFTER INSERT OR UPDATE OR DELETE '
+                       f'ON {quote(TABLE)} FOR EACH ROW EXECUTE FUNCTION {quote(MIRROR_TRIGGER)}()')
+    return True
+
+
+def copy_rows(connection, batch_size=10000):
+    """
+    Second step: copy the rows of the orders table into the partitioned one by ranges of ids, each one
+    in its own transaction, yielding the count of copied rows after each batch. The rows of a batch are
+    locked FOR SHARE in id order: a concurrent write either waits for the batch (then mirrors its change),
+    or has committed and its version, already mirrored, is skipped.
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT coalesce(max(id), 0) FROM {quote(TABLE)}')
+        last = cursor.fetchone()[0]
+    copied, start = 0, 0
+    while start < last:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {quote(STAGING_TABLE)} SELECT * FROM (SELECT * FROM {quote(TABLE)} '
+                           f'WHERE id > %s AND id <= %s ORDER BY id FOR SHARE) AS batch ON CONFLICT DO NOTHING',
+                           [start, start + batch_size])
+            copied += cursor.rowcount
+        start += batch_size
+        yield copied
+
+
+def finish_conversion(connection, lock_timeout=5):
+    """
+    Last step, in a transaction: swap the tables under an exclusive lock held for renames only.
+    The plain table is kept as `api_order_unpartitioned` (to compare, or to swap back before new writes),
+    and the foreign key of the links is replaced by constraint triggers on the partitioned table.
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        # Give up rather than queueing every order query behind a long transaction
+        cursor.execute("SELECT set_config('lock_timeout', %s, true)", [f'{lock_timeout}s'])
+        cursor.execute(f'LOCK TABLE {quote(TABLE)}, {quote(LINKS_TABLE)} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'DROP TRIGGER {quote(MIRROR_TRIGGER)} ON {quote(TABLE)}')
+        cursor.execute(f'DROP FUNCTION {quote(MIRROR_TRIGGER)}()')
+        for constraint in get_foreign_keys(cursor, LINKS_TABLE, TABLE):
+            cursor.execute(f'ALTER TABLE {quote(LINKS_TABLE)} DROP CONSTRAINT {quote(constraint)}')
+        indexes = [name for name, _ in get_index_definitions(cursor, TABLE)]
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [TABLE, 'id'])
+        sequence = cursor.fetchone()[0]
+
+        cursor.execute(f'ALTER TABLE {quote(TABLE)} RENAME TO {quote(OLD_TABLE)}')
+        cursor.execute(f'ALTER TABLE {quote(OLD_TABLE)} RENAME CONSTRAINT {quote(f"{TABLE}_pkey")} '
+                       f'TO {quote(f"{OLD_TABLE}_pkey")}')
+        cursor.execute(f'ALTER SEQUENCE {sequence} RENAME TO {quote(f"{OLD_TABLE}_id_seq")}')
+        for name in indexes:
+            cursor.execute(f'ALTER INDEX {quote(name)} RENAME TO {quote(suffixed(name, "_old"))}')
+
+        cursor.execute(f'ALTER TABLE {quote(STAGING_TABLE)} RENAME TO {quote(TABLE)}')
+        cursor.execute(f'ALTER TABLE {quote(TABLE)} RENAME CONSTRAINT {quote(f"{STAGING_TABLE}_pkey")} '
+                       f'TO {quote(f"{TABLE}_pkey")}')
+        cursor.execute(f'ALTER SEQUENCE {quote(f"{STAGING_TABLE}_id_seq")} RENAME TO {quote(f"{TABLE}_id_seq")}')
+        for name in indexes:
+            cursor.execute(f'ALTER INDEX {quote(suffixed(name, "_new"))} RENAME TO {quote(name)}')
+        # After the ids allocated from the plain table, e.g. by an import not written yet
+        cursor.execute('SELECT setval(%s, nextval(%s))', [f'{TABLE}_id_seq', f'{OLD_TABLE}_id_seq'])
+        for sql in LINKS_INTEGRITY_SQL:
+            cursor.execute(sql)
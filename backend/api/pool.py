@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db import connections
+
+
+def get_pool(alias):
+    # The psycopg pool of the database, None when pooling is not enabled (or not supported)
+    return getattr(connections[alias], 'pool', None)
+
+
+def get_pool_stats(alias, reset=False):
+    """
+    Return the statistics of the connection pool of the database, None when it is not pooled.
+    Counters (requests, waits, errors) are cumulated since the pool start or the last reset.
+    """
+    pool = get_pool(alias)
+    if pool is None:
+        return None
+    stats = pool.pop_stats() if reset else pool.get_stats()
+    size, available = stats.get('pool_size', 0), stats.get('pool_available', 0)
+    return {
+        'min_size': stats.get('pool_min'),
+        'max_size': stats.get('pool_max'),
+        'size': size,
+        'available': available,
+        'in_use': size - available,
+        'waiting': stats.get('requests_waiting', 0),
+        'requests': stats.get('requests_num', 0),
+        'requests_queued': stats.get('requests_queued', 0),
+        'wait_ms': stats.get('requests_wait_ms', 0),
+        'request_errors': stats.get('requests_errors', 0),
+        'connections': stats.get('connections_num', 0),
+        'connection_ms': stats.get('connections_ms', 0),
+        'connection_errors': stats.get('connections_errors', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+    }
+
+
+def get_all_pool_stats(reset=False):
+    """
+    Return the pool statistics of every configured database.
+    """
+    return {alias: get_pool_stats(alias, reset) for alias in settings.DATABASES if alias != 'test'}
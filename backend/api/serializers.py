@@ -1,5 +1,10 @@
+from django.db import transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
 from rest_framework import serializers
-from .models import Product, Order
+from . import validators
+from .fields import BulkPrimaryKeyRelatedField
+from .models import DailyOrderRollup, Product, Order
 
 
 class BaseSerializer(serializers.ModelSerializer):
@@ -8,12 +13,47 @@ class BaseSerializer(serializers.ModelSerializer):
     Contains base fields: id, created_at, updated_at, deleted_at and is_deleted
     with logics for soft delete and restore mechanism.
     """
+    # Model columns of the fields not backed by a model field
+    column_sources = {'is_deleted': 'deleted_at'}
+
     class Meta:
         abstract = True
         fields = ['id',  'created_at', 'updated_at', 'is_deleted', 'deleted_at']
         read_only_fields = ['created_at', 'updated_at', 'is_deleted', 'deleted_at']
         write_only_fields = []
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            # Sparse fieldset, drop the readable fields not requested
+            for name, field in list(self.fields.items()):
+                if not field.write_only and name not in fields:
+                    self.fields.pop(name)
+
+    def save_changes(self, instance, validated_data):
+        """
+        Save only the changed fields of the instance (plus updated_at), nothing if none changed.
+        Return the changed fields.
+        """
+        changed = [attr for attr, value in validated_data.items() if getattr(instance, attr) != value]
+        for attr in changed:
+            setattr(instance, attr, validated_data[attr])
+        if changed:
+            instance.save(update_fields=[*changed, 'updated_at'])
+        return changed
+
+    def update(self, instance, validated_data):
+        self.save_changes(instance, validated_data)
+        return instance
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """
+    Serializer for the list of ids of bulk actions, optional when a filter is used.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False)
+
 
 class ProductSerializer(BaseSerializer):
     class Meta(BaseSerializer.Meta):
@@ -24,14 +64,95 @@ class ProductSerializer(BaseSerializer):
         """
         Validator for product price, cannot be negative.
         """
-        if value < 0:
-            raise serializers.ValidationError("Price cannot be negative.")
+        validators.validate_price(value)
         return value
 
 
+class OrderListSerializer(serializers.ListSerializer):
+    """
+    List serializer for bulk writes of orders.
+    Items with an `id` update the matching order (instance must be a dict of orders by id),
+    the others create a new order. Orders and product links are written with bulk queries
+    inside a single transaction.
+    """
+
+    def to_internal_value(self, data):
+        # Load the products of all the items with a single query
+        if isinstance(data, list):
+            self.child.fields['product_ids'].child_relation.prefetch(
+                product_id for item in data
+                if isinstance(item, dict) and isinstance(item.get('product_ids'), list)
+                for product_id in item['product_ids']
+            )
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        order_id = data.get('id') if isinstance(data, dict) else None
+        self.child.instance = None
+        if order_id is not None:
+            self.child.instance = (self.instance or {}).get(order_id)
+            if self.child.instance is None:
+                raise serializers.ValidationError({'id': ["Order not found."]})
+        elif self.partial:
+            raise serializers.ValidationError({'id': ["This field is required for partial updates."]})
+        self.child.initial_data = data
+        validated = super().run_child_validation(data)
+        if self.child.instance is not None:
+            validated['id'] = self.child.instance.id
+        return validated
+
+    def create(self, validated_data):
+        return self.bulk_save(validated_data)
+
+    def update(self, instance, validated_data):
+        return self.bulk_save(validated_data)
+
+    @transaction.atomic
+    def bulk_save(self, validated_data):
+        now = timezone.now()
+        orders, to_create, to_update = [], [], []
+        update_fields = set()
+        links = []
+
+        for attrs in validated_data:
+            attrs = dict(attrs)
+            product_ids = attrs.pop('product_ids', None)
+            order_id = attrs.pop('id', None)
+            if order_id is None:
+                order = Order(**attrs)
+                to_create.append(order)
+            else:
+                order = self.instance[order_id]
+                for attr, value in attrs.items():
+                    setattr(order, attr, value)
+                order.updated_at = now
+                update_fields.update(attrs)
+                to_update.append(order)
+            orders.append(order)
+            if product_ids is not None:
+                links.append((order, order_id, product_ids))
+
+        Order.objects.bulk_create(to_create)
+        if to_update:
+            Order.objects.bulk_update(to_update, fields=sorted(update_fields) + ['updated_at'])
+
+        # Replace the product links of all the written orders with two queries
+        through = Order.products.through
+        through.objects.filter(order_id__in=[
+            order_id for _, order_id, _ in links if order_id is not None]).delete()
+        through.objects.bulk_create([
+            through(order_id=order.id, product_id=product_id)
+            for order, _, products in links
+            for product_id in dict.fromkeys(product.pk for product in products)
+        ])
+        # Links written in bulk do not send m2m_changed, refresh the totals and snapshots in bulk
+        Order.all_objects.filter(pk__in=[order.id for order, _, _ in links]).refresh_products()
+        return orders
+
+
 class OrderSerializer(BaseSerializer):
     products = ProductSerializer(many=True, read_only=True)
-    product_ids = serializers.PrimaryKeyRelatedField(
+    product_ids = BulkPrimaryKeyRelatedField(
         queryset=Product.objects.all(),
         many=True,
         write_only=True
@@ -40,17 +161,30 @@ class OrderSerializer(BaseSerializer):
     class Meta(BaseSerializer.Meta):
         model = Order
         fields = BaseSerializer.Meta.fields + \
-            ['name', 'description', 'date', 'products', 'product_ids']
+            ['name', 'description', 'date', 'total_price', 'product_count', 'products', 'product_ids']
+        read_only_fields = BaseSerializer.Meta.read_only_fields + \
+            ['total_price', 'product_count']
         write_only_fields = BaseSerializer.Meta.write_only_fields + \
             ['product_ids']
+        list_serializer_class = OrderListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'products' not in self.fields:
+            return
+        if self.context.get('product_ids_only'):
+            # Products represented by their ids only, read from the through table
+            self.fields['products'] = serializers.ListField(
+                child=serializers.IntegerField(), source='get_product_ids', read_only=True)
+        elif self.context.get('product_snapshot'):
+            # Products read from the order snapshot (id, name, price and is_deleted), without joins
+            self.fields['products'] = serializers.JSONField(source='products_snapshot', read_only=True)
 
     def validate_product_ids(self, value):
         """
         Validator for order products, need at least one product for order.
         """
-        if not value:
-            raise serializers.ValidationError(
-                "Order must contain at least one product.")
+        validators.validate_product_ids(value)
         return value
 
     def create(self, validated_data):
@@ -62,14 +196,132 @@ class OrderSerializer(BaseSerializer):
         order.products.set(product_ids)
         return order
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """
         Override update method to accept only active product by id.
+        Only the changed fields and product links are written.
         """
         product_ids = validated_data.pop('product_ids', None)
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        if product_ids is not None:
-            instance.products.set(product_ids)
-        instance.save()
+        removed, added = instance.diff_products(product_ids) if product_ids is not None else ((), ())
+        self.save_changes(instance, validated_data)
+        if removed or added:
+            # The totals refresh sets updated_at, no save needed when only the products changed
+            instance.update_products(removed, added)
         return instance
+
+
+class DailyOrderRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyOrderRollup
+        fields = ['date', 'order_count', 'product_count', 'revenue']
+
+
+class OrderSummarySerializer(serializers.Serializer):
+    """
+    Aggregates of the orders summary, the prices rendered as strings like the other decimals of the API.
+    """
+    order_count = serializers.IntegerField()
+    total_price_sum = serializers.DecimalField(max_digits=None, decimal_places=2)
+    total_price_avg = serializers.DecimalField(max_digits=None, decimal_places=2, allow_null=True)
+    total_price_min = serializers.DecimalField(max_digits=None, decimal_places=2, allow_null=True)
+    total_price_max = serializers.DecimalField(max_digits=None, decimal_places=2, allow_null=True)
+    product_count_sum = serializers.IntegerField()
+
+
+class OrderFastListSerializer:
+    """
+    Read-only fast path for order lists, built from `.values()` rows of the orders
+    and a single query on the products through table, skipping the per row and
+    per field work of DRF serializers.
+    The output is the same of `OrderSerializer(many=True).data`, with the same
+    sparse `fields`, `product_ids_only` and `product_snapshot` context support.
+    """
+    serializer_class = OrderSerializer
+    # Values computed from other columns instead of model fields
+    computed = {
+        'is_deleted': lambda row: row['deleted_at'] is not None,
+    }
+
+    def __init__(self, instance, context=None, fields=None):
+        self.instance = instance
+        self.context = context or {}
+        self.serializer = self.serializer_class(context=self.context, fields=fields)
+        products = self.serializer.fields.get('products')
+        if isinstance(products, serializers.ListSerializer):
+            self.products_mode = 'full'
+        elif isinstance(products, serializers.ListField):
+            self.products_mode = 'ids'
+        else:
+            # No products, or read from the snapshot column
+            self.products_mode = None
+        self.products = None
+
+    @classmethod
+    def get_columns(cls, snapshot=False):
+        # The products snapshot is read only when requested
+        return [field.attname for field in Order._meta.concrete_fields
+                if snapshot or field.name != 'products_snapshot']
+
+    def get_converters(self, serializer):
+        # (name, value getter, representation) of the readable fields, in the serializer order
+        converters = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name == 'products' and self.products_mode is not None:
+                # Nested products, already represented
+                converters.append((name, lambda row: self.products.get(row['id'], []), lambda value: value))
+                continue
+            getter = self.computed.get(field.source) or (lambda row, source=field.source: row[source])
+            converters.append((name, getter, field.to_representation))
+        return converters
+
+    def represent(self, row, converters):
+        ret = {}
+        for name, getter, to_representation in converters:
+            value = getter(row)
+            ret[name] = None if value is None else to_representation(value)
+        return ret
+
+    def get_products_query(self, rows):
+        links = Order.products.through.objects.filter(order_id__in=[row['id'] for row in rows]) \
+            .order_by('product_id')
+        if self.products_mode == 'ids':
+            # Through table only
+            return links.values('order_id', 'product_id')
+        product_fields = [field.attname for field in Product._meta.concrete_fields]
+        return links.values('order_id', *[f'product__{field}' for field in product_fields])
+
+    def set_products(self, links):
+        # Products of each order, each distinct product is represented once
+        self.products = {}
+        if self.products_mode == 'ids':
+            for link in links:
+                self.products.setdefault(link['order_id'], []).append(link['product_id'])
+            return
+        converters = self.get_converters(ProductSerializer(context=self.context))
+        represented = {}
+        for link in links:
+            product = {key[len('product__'):]: value for key, value in link.items() if key != 'order_id'}
+            if product['id'] not in represented:
+                represented[product['id']] = self.represent(product, converters)
+            self.products.setdefault(link['order_id'], []).append(represented[product['id']])
+
+    def load_related(self):
+        self.rows = list(self.instance)
+        load = self.rows and self.products_mode is not None
+        self.set_products(self.get_products_query(self.rows) if load else [])
+
+    async def aload_related(self):
+        self.rows = [row async for row in self.instance] if not isinstance(self.instance, list) \
+            else self.instance
+        load = self.rows and self.products_mode is not None
+        self.set_products([link async for link in self.get_products_query(self.rows)] if load else [])
+
+    @cached_property
+    def data(self):
+        if self.products is None:
+            self.load_related()
+        converters = self.get_converters(self.serializer)
+        return [self.represent(row, converters) for row in self.rows]
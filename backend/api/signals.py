@@ -0,0 +1,31 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from .metrics import record_queries
+from .models import Order
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def update_order_totals(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep the denormalized order totals and products snapshot up to date when the order products change.
+    """
+    if action == 'pre_clear' and reverse:
+        # Orders linked to the product are not known anymore after the clear
+        instance._cleared_order_ids = list(instance.order_set.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.refresh_totals()
+    else:
+        order_ids = instance.__dict__.pop('_cleared_order_ids', []) if action == 'post_clear' else pk_set
+        Order.all_objects.filter(pk__in=order_ids).refresh_products()
+
+
+@receiver(connection_created)
+def install_query_metrics(sender, connection, **kwargs):
+    """
+    Time the queries of every database connection for the request metrics.
+    """
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
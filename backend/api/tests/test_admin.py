@@ -0,0 +1,90 @@
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from ..admin import EstimatedCountPaginator
+from ..models import Order, Product
+
+
+class SoftDeleteAdminTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@admin.com', 'password'))
+        self.product = Product.objects.create(name='Test Product', price=10)
+        self.orders = [Order.objects.create(name=f'Order {i}', description='Test', date='2024-01-01')
+                       for i in range(3)]
+        self.orders[2].delete()
+
+    def test_changelist_status_filter(self):
+        url = reverse('admin:api_order_changelist')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        response = self.client.get(url, {'status': 'deleted'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.orders[2]])
+        response = self.client.get(url, {'status': 'all', 'date__year': '2024'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_date_hierarchy_bounds(self):
+        Order.objects.create(name='Order 3', description='Test', date='2022-03-15')
+        url = reverse('admin:api_order_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        # Years between the first and last dates, with no DISTINCT over the rows
+        self.assertFalse([query for query in queries if 'DISTINCT' in query['sql']])
+        self.assertContains(response, 'date__year=2023')
+        years = response.context['cl'].queryset.dates('date', 'year')
+        self.assertEqual([year.year for year in years], [2022, 2023, 2024])
+        response = self.client.get(url, {'date__year': '2022'})
+        self.assertContains(response, 'date__month=3')
+        self.assertNotContains(response, 'date__month=4')
+
+    def test_prefix_search(self):
+        url = reverse('admin:api_order_changelist')
+        self.assertEqual(self.client.get(url, {'q': 'order'}).context['cl'].result_count, 2)
+        self.assertEqual(self.client.get(url, {'q': 'der'}).context['cl'].result_count, 0)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Postgres only')
+    def test_prefix_search_indexes(self):
+        # Created by migration 0009 with their operator class, and used by the admin search
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        for model, index in [(Order, 'order_name_prefix_idx'), (Product, 'product_name_prefix_idx')]:
+            queryset = model.all_objects.filter(name__istartswith='order').order_by()
+            self.assertIn(index, queryset.explain())
+
+    def test_deleted_order_change_form(self):
+        response = self.client.get(reverse('admin:api_order_change', args=[self.orders[2].pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_actions(self):
+        url = reverse('admin:api_order_changelist')
+        ids = [order.pk for order in self.orders[:2]]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, {'action': 'soft_delete_selected', '_selected_action': ids})
+        # The selected orders are soft deleted with a single UPDATE
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "api_order" SET "deleted_at"')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(Order.objects.filter(pk__in=ids).exists())
+        self.client.post(url + '?status=deleted', {'action': 'restore_selected', '_selected_action': ids})
+        self.assertEqual(Order.objects.filter(pk__in=ids).count(), 2)
+
+    def test_no_hard_delete_action(self):
+        response = self.client.get(reverse('admin:api_product_changelist'))
+        self.assertNotIn('delete_selected', dict(response.context['action_form'].fields['action'].choices))
+
+
+class EstimatedCountPaginatorTest(TestCase):
+    def setUp(self):
+        for i in range(3):
+            Product.objects.create(name=f'Product {i}', price=10)
+
+    def test_exact_count(self):
+        self.assertEqual(EstimatedCountPaginator(Product.objects.order_by('pk'), 10).count, 3)
+
+    def test_estimated_count(self):
+        plan = '[{"Plan": {"Plan Rows": 123456}}]'
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch('django.db.models.query.QuerySet.explain', return_value=plan):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.order_by('pk'), 10).count, 123456)
@@ -0,0 +1,49 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from ..models import Product, Order
+
+
+class AsyncReadViewTestCase(TestCase):
+    """
+    The async read path must return the same responses of the sync viewsets.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.products = [Product.objects.create(name=f'Test Product {i}', price=10.0 + i) for i in range(5)]
+        for i in range(120):
+            order = Order.objects.create(name=f'Order {i}', description=f'Description {i}',
+                                         date=f'2024-01-{i % 28 + 1:02}')
+            order.products.add(self.products[i % 5], self.products[(i + 1) % 5])
+        self.products[0].delete()  # Deleted products are still shown in orders
+
+    async def assertSameResponse(self, sync_url, async_url):
+        sync_response = await sync_to_async(self.client.get)(sync_url)
+        async_response = await self.async_client.get(async_url)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertJSONEqual(async_response.content.decode().replace('/async/', '/'),
+                             sync_response.content.decode())
+        return async_response
+
+    async def test_list_orders(self):
+        for query in ['', '?page=2', '?date__gte=2024-01-10&date__lte=2024-01-20', '?search=Order 1',
+                      '?ordering=name', '?pagination=keyset', '?page=10']:
+            await self.assertSameResponse(reverse('order-list') + query, reverse('async-order-list') + query)
+
+    async def test_keyset_next_page(self):
+        response = await self.async_client.get(reverse('async-order-list') + '?pagination=keyset')
+        next_url = response.json()['next']
+        await self.assertSameResponse(next_url.replace('/async/', '/'), next_url)
+
+    async def test_retrieve_order(self):
+        order = await Order.objects.afirst()
+        await self.assertSameResponse(reverse('order-detail', args=[order.id]),
+                                      reverse('async-order-detail', args=[order.id]))
+        await self.assertSameResponse(reverse('order-detail', args=[0]), reverse('async-order-detail', args=[0]))
+
+    async def test_products(self):
+        await self.assertSameResponse(reverse('product-list'), reverse('async-product-list'))
+        await self.assertSameResponse(reverse('product-detail', args=[self.products[0].id]),
+                                      reverse('async-product-detail', args=[self.products[0].id]))
@@ -0,0 +1,368 @@
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
+from django.core.management import call_command, CommandError
+from django.db import connection, IntegrityError, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from .. import partitions
+from ..models import ArchivedRecord, DailyOrderRollup, Product, Order
+
+
+class ExplainQueriesCommandTestCase(TestCase):
+    def setUp(self):
+        product = Product.objects.create(name='Test Product', price=10.0)
+        order = Order.objects.create(name='Test Order', description='Test', date='2024-01-01')
+        order.products.add(product)
+
+    def test_explain_all_viewset_queries(self):
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        output = out.getvalue()
+        for label in ['orders list', 'orders keyset page', 'orders search', 'orders restore lookup',
+                      'products list', 'products restore lookup']:
+            self.assertIn(f'== {label} [', output)
+
+
+class CompareReadPathsCommandTestCase(TransactionTestCase):
+    # Requests are served by other threads, data must be committed
+    def setUp(self):
+        product = Product.objects.create(name='Test Product', price=10.0)
+        for i in range(5):
+            order = Order.objects.create(name=f'Order {i}', description='Test', date='2024-01-01')
+            order.products.add(product)
+
+    def test_compare_sync_and_async(self):
+        out = StringIO()
+        call_command('compare_read_paths', '--requests', '10', '--concurrency', '5', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(set(results), {'sync', 'async'})
+        self.assertEqual(results['async']['path'], '/api/async/orders/')
+        self.assertEqual(results['sync']['errors'], 0)
+        self.assertEqual(results['async']['errors'], 0)
+
+
+POOL_STATS = {
+    'pool_min': 2, 'pool_max': 10, 'pool_size': 3, 'pool_available': 1,
+    'requests_waiting': 0, 'requests_num': 42, 'requests_wait_ms': 15, 'connections_num': 3,
+}
+
+
+class SeedDataCommandTestCase(TestCase):
+    def test_seed(self):
+        out = StringIO()
+        call_command('seed_data', '--products', '20', '--orders', '50', '--batch-size', '15',
+                     '--deleted-fraction', '0', '--seed', '1', stdout=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Order.objects.count(), 50)
+        self.assertEqual(Order.products.through.objects.count(), result['order_products'])
+
+        # Totals are consistent with the linked products
+        for order in Order.objects.all()[:10]:
+            total_price, product_count = order.total_price, order.product_count
+            order.refresh_totals()
+            self.assertEqual((order.total_price, order.product_count), (total_price, product_count))
+            self.assertGreaterEqual(product_count, 1)
+
+    def test_deleted_fraction(self):
+        call_command('seed_data', '--products', '5', '--orders', '5', '--deleted-fraction', '1', stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Order.all_objects.count(), 5)
+
+    def test_invalid_options(self):
+        with self.assertRaises(CommandError):
+            call_command('seed_data', '--products', '0', '--orders', '5', stdout=StringIO())
+
+
+class BenchmarkCommandTestCase(TestCase):
+    def test_no_orders(self):
+        with self.assertRaisesMessage(CommandError, 'seed_data'):
+            call_command('benchmark', stdout=StringIO())
+
+    def test_benchmark(self):
+        call_command('seed_data', '--products', '10', '--orders', '30', '--deleted-fraction', '0', '--seed', '1',
+                     stdout=StringIO())
+        out = StringIO()
+        call_command('benchmark', '--requests', '3', '--seed', '1', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(set(results['scenarios']), {
+            'list', 'filter', 'search', 'ordering', 'deep_page', 'keyset_page', 'retrieve', 'create', 'restore'})
+        for scenario in results['scenarios'].values():
+            self.assertEqual(scenario['errors'], 0)
+            self.assertGreater(scenario['queries_per_request'], 0)
+            self.assertIsNotNone(scenario['p99_ms'])
+        # Created orders are removed, restored ones are active again
+        self.assertEqual(Order.all_objects.count(), 30)
+        self.assertEqual(Order.objects.count(), 30)
+
+
+class ImportDataCommandTestCase(TestCase):
+    def import_data(self, resource, content, suffix):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('import_data', resource, file.name, '--batch-size', '2', stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_import_products_csv(self):
+        product = Product.objects.create(name='Existing', price=1)
+        order = Order.objects.create(name='Order', description='Test', date='2024-01-01')
+        order.products.add(product)
+
+        # Orders of the updated products are refreshed after the batch commits
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = self.import_data(
+                'products', f'id,name,price\n,New,10.50\n,Invalid,abc\n{product.id},Updated,5\n,Negative,-1\n',
+                '.csv')
+        self.assertEqual((stats['rows'], stats['imported'], stats['rejected']), (4, 2, 2))
+        self.assertEqual(stats['errors'][0]['line'], 3)
+        # Same business validation as the API
+        self.assertEqual(stats['errors'][1], {'line': 5, 'errors': ['price: Price cannot be negative.']})
+        self.assertFalse(Product.all_objects.filter(name='Negative').exists())
+        self.assertIn('rows_per_second', stats)
+
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.price), ('Updated', 5))
+        self.assertTrue(Product.objects.filter(name='New', price='10.50').exists())
+        # Totals of the orders of the updated products are refreshed
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, 5)
+
+        # New rows after the imported ones get the next ids
+        self.assertGreater(Product.objects.create(name='Next', price=1).id, product.id)
+
+    def test_import_orders_ndjson(self):
+        products = [Product.objects.create(name=f'Product {i}', price=10) for i in range(3)]
+        existing = Order.objects.create(name='Existing', description='Test', date='2024-01-01')
+        existing.products.add(products[0])
+        rows = [
+            {'name': 'New', 'description': 'Test', 'date': '2024-02-01', 'products': [products[0].id, products[1].id]},
+            {'id': existing.id, 'name': 'Updated', 'description': 'Test', 'date': '2024-01-01',
+             'products': [{'id': products[2].id}]},
+            {'name': 'Missing product', 'description': 'Test', 'date': '2024-01-01', 'products': [0]},
+            {'name': 'No products', 'description': 'Test', 'date': '2024-01-01', 'products': []},
+        ]
+        stats = self.import_data('orders', '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n', '.ndjson')
+        self.assertEqual((stats['imported'], stats['rejected']), (2, 3))
+        self.assertIn({'line': 4, 'errors': ['products: Order must contain at least one product.']},
+                      stats['errors'])
+        self.assertFalse(Order.all_objects.filter(name='No products').exists())
+
+        new = Order.objects.get(name='New')
+        self.assertEqual(list(new.products.values_list('id', flat=True)), [products[0].id, products[1].id])
+        self.assertEqual((new.total_price, new.product_count), (20, 2))
+        existing.refresh_from_db()
+        self.assertEqual(existing.name, 'Updated')
+        self.assertEqual(list(existing.products.values_list('id', flat=True)), [products[2].id])
+
+    def test_import_exported_orders_csv(self):
+        product = Product.objects.create(name='Product', price=10)
+        order = Order.objects.create(name='Order', description='Test', date='2024-01-01')
+        order.products.add(product)
+        export = b''.join(self.client.get('/api/orders/export/?export_format=csv').streaming_content).decode()
+        Order.all_objects.all().delete()
+
+        stats = self.import_data('orders', export, '.csv')
+        self.assertEqual((stats['imported'], stats['rejected']), (1, 0))
+        imported = Order.objects.get(pk=order.id)
+        self.assertEqual(list(imported.products.all()), [product])
+
+    def test_unknown_format(self):
+        with self.assertRaisesMessage(CommandError, 'format'):
+            call_command('import_data', 'orders', 'orders.xml', stdout=StringIO())
+
+
+class PoolStatsCommandTestCase(TestCase):
+    def test_not_pooled(self):
+        with self.assertRaisesMessage(CommandError, 'not enabled'):
+            call_command('pool_stats', stdout=StringIO())
+
+    def test_stats(self):
+        pool = mock.MagicMock(**{'get_stats.return_value': POOL_STATS})
+        out = StringIO()
+        with mock.patch('api.pool.get_pool', return_value=pool):
+            call_command('pool_stats', stdout=out)
+        # Checked with a connection of the pool, returned to it
+        pool.connection.return_value.__enter__.return_value.execute.assert_called_once_with('SELECT 1')
+        pool.connection.return_value.__exit__.assert_called_once()
+        stats = json.loads(out.getvalue())
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(stats['requests'], 42)
+        self.assertEqual(stats['wait_ms'], 15)
+        self.assertEqual(stats['request_errors'], 0)
+
+    def test_reset(self):
+        pool = mock.MagicMock(**{'pop_stats.return_value': POOL_STATS})
+        with mock.patch('api.pool.get_pool', return_value=pool):
+            call_command('pool_stats', '--reset', stdout=StringIO())
+        pool.pop_stats.assert_called_once()
+
+
+class ArchiveDeletedCommandTestCase(TestCase):
+    def setUp(self):
+        old = timezone.now() - timedelta(days=100)
+        self.live_product = Product.objects.create(name='Live', price=10)
+        # Deleted product of a live order, kept to be read with the order
+        self.linked_product = Product.objects.create(name='Linked', price=5, deleted_at=old)
+        self.old_product = Product.objects.create(name='Old', price=3, deleted_at=old)
+        self.recent_product = Product.objects.create(name='Recent', price=3, deleted_at=timezone.now())
+        self.live_order = Order.objects.create(name='Live', description='Test', date='2024-01-01')
+        self.live_order.products.add(self.live_product, self.linked_product)
+        self.old_orders = []
+        for i in range(3):
+            order = Order.objects.create(name=f'Old {i}', description='Test', date='2024-01-01')
+            order.products.add(self.live_product, self.old_product)
+            self.old_orders.append(order)
+        Order.objects.filter(pk__in=[order.pk for order in self.old_orders]).update(deleted_at=old)
+
+    def call(self, *args):
+        out = StringIO()
+        call_command('archive_deleted', '--batch-size', '2', *args, stdout=out, stderr=StringIO())
+        return json.loads(out.getvalue())
+
+    def test_archive(self):
+        result = self.call()
+        self.assertEqual((result['mode'], result['orders'], result['products']), ('archive', 3, 1))
+        self.assertFalse(Order.all_objects.filter(pk__in=[order.pk for order in self.old_orders]).exists())
+        self.assertFalse(Product.all_objects.filter(pk=self.old_product.pk).exists())
+        self.assertEqual(set(Product.all_objects.values_list('pk', flat=True)),
+                         {self.live_product.pk, self.linked_product.pk, self.recent_product.pk})
+        archived = ArchivedRecord.objects.get(model_label='api.order', object_id=self.old_orders[0].pk)
+        self.assertEqual(archived.data['name'], 'Old 0')
+        self.assertEqual(archived.data['product_ids'], sorted([self.live_product.pk, self.old_product.pk]))
+        self.assertTrue(ArchivedRecord.objects.filter(model_label='api.product', object_id=self.old_product.pk)
+                        .exists())
+        # The live order still reads its deleted product
+        response = self.client.get(f'/api/orders/{self.live_order.pk}/')
+        self.assertEqual(len(response.json()['products']), 2)
+
+    def test_purge(self):
+        result = self.call('--purge')
+        self.assertEqual((result['orders'], result['products']), (3, 1))
+        self.assertFalse(ArchivedRecord.objects.exists())
+        self.assertEqual(Order.all_objects.count(), 1)
+
+    def test_dry_run_and_retention(self):
+        self.assertEqual(self.call('--dry-run')['orders'], 3)
+        self.assertEqual(Order.all_objects.count(), 4)
+        result = self.call('--retention-days', '200')
+        self.assertEqual((result['orders'], result['products']), (0, 0))
+
+    def test_max_batches(self):
+        # Two orders per batch, products are processed once no order links them
+        result = self.call('--max-batches', '1')
+        self.assertEqual((result['orders'], result['products']), (2, 0))
+        self.assertEqual(self.call()['orders'], 1)
+
+    def test_batches_locked(self):
+        # Each batch is selected with its rows locked, in the transaction archiving and deleting them
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                               side_effect=QuerySet.select_for_update) as lock:
+            result = self.call()
+        self.assertEqual((result['orders'], result['products']), (3, 1))
+        # Two batches of products (the last one empty)
+        self.assertEqual([call.args[0].model for call in lock.call_args_list].count(Product), 2)
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(CommandError):
+            call_command('archive_deleted', '--batch-size', '0', stdout=StringIO())
+
+
+class OrderPartitionsCommandTestCase(TestCase):
+    def test_months(self):
+        self.assertEqual(partitions.add_months(date(2024, 11, 1), 3), date(2025, 2, 1))
+        self.assertEqual(partitions.add_months(date(2024, 1, 1), -1), date(2023, 12, 1))
+        self.assertEqual(partitions.partition_name(date(2024, 3, 1)), 'api_order_p2024_03')
+        self.assertEqual(partitions.partition_month('api_order_p2024_03'), date(2024, 3, 1))
+        self.assertIsNone(partitions.partition_month(partitions.DEFAULT_PARTITION))
+
+    def test_not_partitioned(self):
+        with self.assertRaisesMessage(CommandError, 'not partitioned'):
+            call_command('order_partitions', stdout=StringIO())
+
+    @skipIf(connection.vendor == 'postgresql', 'Postgres converts the table')
+    def test_convert_requires_postgres(self):
+        with self.assertRaisesMessage(CommandError, 'only be partitioned on Postgres'):
+            call_command('order_partitions', '--convert', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Postgres only')
+class OrderPartitionsConversionTestCase(TransactionTestCase):
+    # The conversion commits its steps (the swap DDL can't run with the deferred triggers of a
+    # test transaction pending), the plain table is swapped back after each test
+    def setUp(self):
+        with connection.cursor() as cursor:
+            indexes = [name for name, _ in partitions.get_index_definitions(cursor, partitions.TABLE)]
+            foreign_keys = partitions.get_foreign_keys(cursor, partitions.LINKS_TABLE, partitions.TABLE)
+        self.addCleanup(self.swap_back, indexes, foreign_keys)
+
+    def swap_back(self, indexes, foreign_keys):
+        quote = connection.ops.quote_name
+        old, table, links = partitions.OLD_TABLE, partitions.TABLE, partitions.LINKS_TABLE
+        if not partitions.is_partitioned(connection):
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {quote(f"{links}_order_fk")} ON {quote(links)}')
+            cursor.execute(f'DROP TABLE {quote(table)}')
+            cursor.execute(f'DROP FUNCTION {quote(f"{links}_check_order")}(), {quote(f"{table}_check_links")}()')
+            cursor.execute(f'ALTER TABLE {quote(old)} RENAME TO {quote(table)}')
+            cursor.execute(f'ALTER TABLE {quote(table)} RENAME CONSTRAINT {quote(f"{old}_pkey")} '
+                           f'TO {quote(f"{table}_pkey")}')
+            cursor.execute(f'ALTER SEQUENCE {quote(f"{old}_id_seq")} RENAME TO {quote(f"{table}_id_seq")}')
+            for name in indexes:
+                cursor.execute(f'ALTER INDEX {quote(partitions.suffixed(name, "_old"))} RENAME TO {quote(name)}')
+            # Emptied by the flush after the test, the links don't need to be checked
+            for name in foreign_keys:
+                cursor.execute(f'ALTER TABLE {quote(links)} ADD CONSTRAINT {quote(name)} FOREIGN KEY (order_id) '
+                               f'REFERENCES {quote(table)} (id) DEFERRABLE INITIALLY DEFERRED NOT VALID')
+
+    def test_maintenance(self):
+        current = partitions.month_start(date.today())
+        old = partitions.add_months(current, -24)
+        order = Order.objects.create(name='Old', description='Test', date=old)
+        order.products.add(Product.objects.create(name='Test Product', price=10))
+        call_command('order_partitions', '--convert', '--batch-size', '1', stdout=StringIO(), stderr=StringIO())
+        self.assertTrue(partitions.is_partitioned(connection))
+        self.assertIn(partitions.partition_name(old), partitions.get_partitions(connection))
+        self.assertTrue(Order.objects.filter(pk=order.pk, date=old).exists())
+        # The plain table is kept, new ids follow its ids
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {partitions.OLD_TABLE}')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        self.assertGreater(Order.objects.create(name='New', description='Test', date=current).pk, order.pk)
+
+        # Rows of a month without partition are moved from the default partition on creation
+        older = partitions.add_months(old, -1)
+        Order.objects.create(name='Older', description='Test', date=older)
+        partitions.ensure_partitions(connection, older, older)
+        self.assertTrue(Order.objects.filter(date=older).exists())
+        self.assertTrue(DailyOrderRollup.objects.filter(date=old).exists())
+
+        out = StringIO()
+        call_command('order_partitions', '--ahead', '2', '--detach-months', '12', '--drop', '--check', stdout=out)
+        result = json.loads(out.getvalue())
+        self.assertIn(partitions.partition_name(partitions.add_months(current, 2)), result['partitions'])
+        self.assertIn(partitions.partition_name(old), result['detached'])
+        self.assertFalse(Order.all_objects.filter(pk=order.pk).exists())
+        self.assertFalse(Order.products.through.objects.filter(order_id=order.pk).exists())
+        self.assertFalse(DailyOrderRollup.objects.filter(date__in=[old, older]).exists())
+        self.assertTrue(all(case['pruned'] for case in result['pruning'].values()))
+
+    def test_links_integrity(self):
+        call_command('order_partitions', '--convert', stdout=StringIO(), stderr=StringIO())
+        product = Product.objects.create(name='Test Product', price=10)
+        Link = Order.products.through
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Link.objects.create(order_id=0, product=product)
+            connection.check_constraints()
+        order = Order.objects.create(name='Test', description='Test', date=date.today())
+        order.products.add(product)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.all_objects.filter(pk=order.pk)._raw_delete(connection.alias)
+            connection.check_constraints()
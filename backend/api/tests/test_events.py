@@ -0,0 +1,152 @@
+import asyncio
+import json
+from unittest import mock, skipUnless
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from ..events import CHANNEL, EventStreamApp, broker, merge_events
+from ..models import Order, Product
+
+
+class ModelEventsTest(TestCase):
+    def get_events(self, write):
+        with mock.patch.object(broker, 'dispatch') as dispatch:
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+        return [(call.args[0]['model'], call.args[0]['action'], call.args[0]['ids'], call.args[0]['count'])
+                for call in dispatch.call_args_list]
+
+    def test_save_events(self):
+        product = Product.objects.create(name='Test Product', price=10)
+        self.assertEqual(self.get_events(lambda: Product.objects.create(name='New', price=1))[0][:2],
+                         ('product', 'created'))
+        self.assertEqual(self.get_events(product.delete), [('product', 'deleted', [product.id], 1)])
+        self.assertEqual(self.get_events(product.restore), [('product', 'restored', [product.id], 1)])
+
+    def test_bulk_events(self):
+        products = [Product.objects.create(name=f'Product {i}', price=10) for i in range(3)]
+        events = self.get_events(lambda: Product.objects.filter(pk__in=[p.pk for p in products]).soft_delete())
+        self.assertEqual(events, [('product', 'deleted', None, 3)])
+        events = self.get_events(lambda: Product.all_objects.bulk_create([Product(name='Bulk', price=1)]))
+        self.assertEqual(events[0][:2], ('product', 'created'))
+
+    def test_no_events_on_rollback(self):
+        def write():
+            with transaction.atomic():
+                Order.objects.create(name='Order', description='Test', date='2024-01-01')
+                transaction.set_rollback(True)
+        self.assertEqual(self.get_events(write), [])
+
+
+@override_settings(EVENTS_BROKER='postgres')
+class PostgresBrokerTest(TestCase):
+    def test_one_notification_per_transaction(self):
+        products = [Product.objects.create(name=f'Product {i}', price=10) for i in range(3)]
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch.object(broker, 'notify') as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for product in products[:2]:
+                        product.name = 'Renamed'
+                        product.save()
+                    products[2].delete()
+                    with transaction.atomic():
+                        Product.objects.create(name='Rolled back', price=1)
+                        transaction.set_rollback(True)
+        notify.assert_called_once()
+        events = [(event['model'], event['action'], event['ids'], event['count'])
+                  for event in notify.call_args.args[1]]
+        self.assertEqual(events, [('product', 'updated', [products[0].id, products[1].id], 2),
+                                  ('product', 'deleted', [products[2].id], 1)])
+
+    def test_merge_events(self):
+        events = [{'model': 'order', 'action': 'updated', 'ids': ids, 'count': count, 'at': at}
+                  for ids, count, at in [([1], 1, 'a'), ([1, 2], 2, 'b'), (None, 5, 'c')]]
+        self.assertEqual(merge_events(events[:2]),
+                         [{'model': 'order', 'action': 'updated', 'ids': [1, 2], 'count': 2, 'at': 'b'}])
+        self.assertEqual(merge_events(events),
+                         [{'model': 'order', 'action': 'updated', 'ids': None, 'count': 7, 'at': 'c'}])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Postgres only')
+@override_settings(EVENTS_BROKER='postgres')
+class PostgresNotifyTest(TransactionTestCase):
+    def test_notified_once_on_commit(self):
+        import psycopg
+        params = connection.settings_dict
+        with psycopg.connect(dbname=params['NAME'], user=params['USER'],
+                             password=params['PASSWORD'], host=params['HOST'], port=params['PORT'] or None,
+                             autocommit=True) as listener:
+            listener.execute(f'LISTEN {CHANNEL}')
+            with transaction.atomic():
+                products = [Product.objects.create(name=f'Product {i}', price=10) for i in range(3)]
+            notifies = list(listener.notifies(timeout=1))
+        self.assertEqual(len(notifies), 1)
+        self.assertEqual(json.loads(notifies[0].payload)[0]['ids'], [product.id for product in products])
+
+
+class EventStreamAppTest(TestCase):
+    async def start(self, path='/api/events/', query=b''):
+        self.messages = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+
+        async def receive():
+            await self.disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            await self.messages.put(message)
+
+        app = EventStreamApp(mock.AsyncMock())
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query}
+        self.task = asyncio.ensure_future(app(scope, receive, send))
+        return app
+
+    async def next_body(self):
+        message = await asyncio.wait_for(self.messages.get(), 1)
+        return message['body'].decode()
+
+    async def stop(self):
+        self.disconnected.set()
+        await asyncio.wait_for(self.task, 1)
+
+    async def test_stream(self):
+        await self.start(query=b'models=order')
+        start = await asyncio.wait_for(self.messages.get(), 1)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual(await self.next_body(), 'retry: 5000\n\n')
+        self.assertEqual(len(broker.subscribers), 1)
+
+        # Filtered out, then delivered
+        broker.dispatch({'model': 'product', 'action': 'updated', 'ids': [1], 'count': 1})
+        broker.dispatch({'model': 'order', 'action': 'deleted', 'ids': [2], 'count': 1})
+        body = await self.next_body()
+        self.assertTrue(body.startswith('event: deleted\ndata: '))
+        self.assertEqual(json.loads(body.split('data: ')[1])['ids'], [2])
+
+        await self.stop()
+        self.assertEqual(len(broker.subscribers), 0)
+
+    async def test_keepalive(self):
+        with mock.patch.object(EventStreamApp, 'keepalive_seconds', 0.01):
+            await self.start()
+            await asyncio.wait_for(self.messages.get(), 1)
+            await self.next_body()
+            self.assertEqual(await self.next_body(), ': keepalive\n\n')
+            await self.stop()
+
+    async def test_overflow(self):
+        with mock.patch.object(broker, 'queue_size', 2):
+            await self.start()
+            await asyncio.wait_for(self.messages.get(), 1)
+            await self.next_body()
+            # Fill the queue before the stream reads it
+            for i in range(3):
+                broker.put(next(iter(broker.subscribers))[1], {'model': 'order', 'action': 'updated'})
+            self.assertTrue((await self.next_body()).startswith('event: overflow\n'))
+            await self.stop()
+
+    async def test_other_paths(self):
+        app = await self.start(path='/api/orders/')
+        await asyncio.wait_for(self.task, 1)
+        app.app.assert_awaited_once()
@@ -0,0 +1,49 @@
+from unittest import mock, skipUnless
+from django.db import connection
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from ..filters import TrigramSearchFilter
+from ..models import Order
+from ..views import OrderViewSet
+
+
+class TrigramSearchFilterTestCase(TestCase):
+    def setUp(self):
+        Order.objects.create(name='Special Order', description='A special order', date='2023-01-01')
+        Order.objects.create(name='Regular Order', description='Special delivery', date='2023-01-02')
+        Order.objects.create(name='Other Order', description='Nothing to see', date='2023-01-03')
+        self.view = OrderViewSet()
+
+    def filter(self, query):
+        request = Request(APIRequestFactory().get('/', query))
+        return TrigramSearchFilter().filter_queryset(request, Order.objects.order_by('-date'), self.view)
+
+    def test_fallback_matches_name_and_description(self):
+        with mock.patch.object(connection, 'vendor', 'sqlite'):
+            queryset = self.filter({'search': 'special'})
+        self.assertEqual(set(queryset.values_list('name', flat=True)), {'Special Order', 'Regular Order'})
+        self.assertNotIn('search_rank', queryset.query.annotations)
+
+    def test_postgres_ranks_results(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            queryset = self.filter({'search': 'special'})
+        self.assertIn('search_rank', queryset.query.annotations)
+        self.assertEqual(queryset.query.order_by, ('-search_rank', '-date'))
+
+    def test_no_search_terms(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            queryset = self.filter({})
+        self.assertEqual(queryset.count(), 3)
+        self.assertNotIn('search_rank', queryset.query.annotations)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Postgres only')
+    def test_postgres_search(self):
+        queryset = self.filter({'search': 'special'})
+        self.assertEqual(list(queryset.values_list('name', flat=True)), ['Special Order', 'Regular Order'])
+        # Created by migration 0002 with their operator class (django.contrib.postgres installed)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE indexname LIKE 'order_%%_trgm_idx'")
+            indexes = dict(cursor.fetchall())
+        self.assertEqual(sorted(indexes), ['order_description_trgm_idx', 'order_name_trgm_idx'])
+        self.assertTrue(all('gin_trgm_ops' in definition for definition in indexes.values()))
@@ -0,0 +1,49 @@
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from ..metrics import LATENCY_BUCKETS, Metrics, QueryStats, metrics
+from ..models import Product
+
+
+class MetricsTestCase(APITestCase):
+    def test_render(self):
+        registry = Metrics()
+        queries = QueryStats()
+        queries.count, queries.time = 3, 0.002
+        registry.observe('/api/orders/', 'list', 'GET', 200, 0.03, queries)
+        registry.observe('/api/orders/', 'list', 'GET', 200, 20, queries)
+        output = registry.render()
+
+        labels = 'route="/api/orders/",action="list",method="GET"'
+        self.assertIn(f'api_requests_total{{{labels},status="200"}} 2', output)
+        self.assertIn(f'api_request_duration_seconds_bucket{{{labels},le="0.025"}} 0', output)
+        self.assertIn(f'api_request_duration_seconds_bucket{{{labels},le="0.05"}} 1', output)
+        self.assertIn(f'api_request_duration_seconds_bucket{{{labels},le="{LATENCY_BUCKETS[-1]}"}} 1', output)
+        self.assertIn(f'api_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', output)
+        self.assertIn(f'api_request_duration_seconds_count{{{labels}}} 2', output)
+        self.assertIn(f'api_db_queries_total{{{labels}}} 6', output)
+
+    def test_middleware(self):
+        product = Product.objects.create(name='Test Product', price=10.0)
+        metrics.reset()
+        self.client.get(reverse('product-detail', args=[product.id]))
+        self.client.post(reverse('product-restore', args=[product.id]))
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        output = response.content.decode()
+        self.assertIn('api_requests_total{route="/api/products/<pk>/",action="retrieve",method="GET",status="200"} 1',
+                      output)
+        self.assertIn('api_requests_total{route="/api/products/<pk>/restore/",action="restore",method="POST",'
+                      'status="404"} 1', output)
+        self.assertIn('api_db_queries_total{route="/api/products/<pk>/restore/",action="restore",method="POST"} 1',
+                      output)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        metrics.reset()
+        self.client.get(reverse('product-list'))
+        self.assertEqual(metrics.requests, {})
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_404_NOT_FOUND)
@@ -1,6 +1,12 @@
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+from django.db import connection
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from ..models import Product, Order
+from ..models import DailyOrderRollup, OrderQuerySet, Product, ProductQuerySet, Order
 
 
 class ProductModelTest(TestCase):
@@ -44,6 +50,32 @@ class ProductModelTest(TestCase):
         self.assertEqual(original_updated_at, self.product.updated_at)
 
 
+class SoftDeleteQuerySetTest(TestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Test Product {i}', price=10.00) for i in range(5)]
+
+    def test_bulk_soft_delete(self):
+        # Orders containing the products are looked up before the UPDATE, none here
+        with self.assertNumQueries(2):
+            deleted = Product.objects.filter(id__in=[p.id for p in self.products[:3]]).soft_delete()
+        self.assertEqual(deleted, 3)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Product.all_objects.filter(deleted_at__isnull=False).count(), 3)
+
+    def test_bulk_restore(self):
+        Product.objects.soft_delete()
+        with self.assertNumQueries(2):
+            restored = Product.all_objects.filter(id__in=[p.id for p in self.products[:2]]).restore()
+        self.assertEqual(restored, 2)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_bulk_soft_delete_skips_deleted(self):
+        self.products[0].delete()
+        deleted_at = Product.all_objects.get(id=self.products[0].id).deleted_at
+        self.assertEqual(Product.all_objects.soft_delete(), 4)
+        self.assertEqual(Product.all_objects.get(id=self.products[0].id).deleted_at, deleted_at)
+
+
 class OrderModelTest(TestCase):
     def setUp(self):
         self.product1 = Product.objects.create(name='Test Product 1', price=10.00)
@@ -101,3 +133,184 @@ class OrderModelTest(TestCase):
         order.products.add(self.product2)
         order.name = 'Updated Order'
         self.assertEqual(order.name, 'Updated Order')
+
+
+class OrderTotalsTest(TestCase):
+    def setUp(self):
+        self.product1 = Product.objects.create(name='Test Product 1', price=10.00)
+        self.product2 = Product.objects.create(name='Test Product 2', price=20.50)
+        self.order = Order.objects.create(name='Order', description='Totals', date=timezone.now().date())
+
+    def test_totals_on_products_change(self):
+        self.order.products.set([self.product1, self.product2])
+        self.assertEqual(self.order.total_price, Decimal('30.50'))
+        self.assertEqual(self.order.product_count, 2)
+
+        self.order.products.remove(self.product2)
+        self.assertEqual(self.order.total_price, Decimal('10.00'))
+        self.order.products.clear()
+        self.assertEqual(self.order.total_price, 0)
+        self.assertEqual(self.order.product_count, 0)
+
+    def test_totals_on_reverse_products_change(self):
+        self.product1.order_set.add(self.order)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.product_count, 1)
+        self.product1.order_set.clear()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.product_count, 0)
+
+    def test_totals_on_price_change(self):
+        self.order.products.set([self.product1, self.product2])
+        self.product1.delete()  # Deleted products are still part of the order
+        product = Product.all_objects.get(pk=self.product2.pk)
+        product.price = 5
+        # Orders are refreshed once the product change commits
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal('15.00'))
+
+    def test_orders_refreshed_in_batches_after_commit(self):
+        orders = [Order.objects.create(name=f'Order {i}', description='Batch', date='2024-01-01') for i in range(5)]
+        for order in orders:
+            order.products.add(self.product1)
+        self.product1.price = 5
+        with mock.patch.object(ProductQuerySet, 'refresh_batch_size', 2), \
+                mock.patch.object(OrderQuerySet, 'refresh_products', autospec=True,
+                                  side_effect=OrderQuerySet.refresh_products) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product1.save()
+                # Not refreshed in the transaction of the product write
+                refresh.assert_not_called()
+        # One transaction per batch of orders, in pk order
+        self.assertEqual([list(call.args[0].values_list('pk', flat=True)) for call in refresh.call_args_list],
+                         [[orders[0].pk, orders[1].pk], [orders[2].pk, orders[3].pk], [orders[4].pk]])
+        self.assertEqual(Order.objects.get(pk=orders[4].pk).total_price, Decimal('5.00'))
+
+    def test_totals_not_refreshed_without_changes(self):
+        self.order.products.set([self.product1])
+        product = Product.objects.get(pk=self.product1.pk)
+        with self.assertNumQueries(1):
+            product.save()
+
+
+class ProductsSnapshotTest(TestCase):
+    def setUp(self):
+        self.product1 = Product.objects.create(name='Test Product 1', price=10.00)
+        self.product2 = Product.objects.create(name='Test Product 2', price=20.50)
+        self.order = Order.objects.create(name='Order', description='Snapshot', date=timezone.now().date())
+        self.order.products.set([self.product2, self.product1])
+
+    def snapshot(self):
+        return Order.all_objects.get(pk=self.order.pk).products_snapshot
+
+    def test_products_change(self):
+        self.assertEqual(self.snapshot(), [
+            {'id': self.product1.id, 'name': 'Test Product 1', 'price': '10.00', 'is_deleted': False},
+            {'id': self.product2.id, 'name': 'Test Product 2', 'price': '20.50', 'is_deleted': False},
+        ])
+        self.order.products.remove(self.product1)
+        self.assertEqual([product['id'] for product in self.snapshot()], [self.product2.id])
+
+    def test_product_change(self):
+        product = Product.objects.get(pk=self.product1.pk)
+        product.name = 'Renamed Product'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.snapshot()[0]['name'], 'Renamed Product')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product2.delete()
+        self.assertTrue(self.snapshot()[1]['is_deleted'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.all_objects.filter(pk=self.product2.pk).restore()
+        self.assertFalse(self.snapshot()[1]['is_deleted'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product1.pk).update(price=5)
+        self.assertEqual(self.snapshot()[0]['price'], '5.00')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).total_price, Decimal('25.50'))
+
+
+class DailyOrderRollupTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Test Product', price=10.00)
+        self.day1, self.day2 = date(2024, 1, 1), date(2024, 1, 2)
+        self.orders = []
+        for day in [self.day1, self.day1, self.day2]:
+            order = Order.objects.create(name='Order', description='Rollup', date=day)
+            order.products.add(self.product)
+            self.orders.append(order)
+
+    def assertRollup(self, day, order_count, revenue):
+        rollup = DailyOrderRollup.objects.filter(date=day).first()
+        if order_count == 0:
+            self.assertIsNone(rollup)
+        else:
+            self.assertEqual((rollup.order_count, rollup.revenue), (order_count, revenue))
+            self.assertEqual(rollup.product_count, order_count)
+
+    def test_create(self):
+        self.assertRollup(self.day1, 2, Decimal('20.00'))
+        self.assertRollup(self.day2, 1, Decimal('10.00'))
+
+    def test_date_change(self):
+        order = Order.objects.get(pk=self.orders[0].pk)
+        order.date = self.day2
+        order.save()
+        self.assertRollup(self.day1, 1, Decimal('10.00'))
+        self.assertRollup(self.day2, 2, Decimal('20.00'))
+
+    def test_soft_delete_and_restore(self):
+        self.orders[2].delete()
+        self.assertRollup(self.day2, 0, 0)
+        self.orders[2].restore()
+        self.assertRollup(self.day2, 1, Decimal('10.00'))
+
+        Order.objects.filter(date=self.day1).soft_delete()
+        self.assertRollup(self.day1, 0, 0)
+        Order.all_objects.filter(date=self.day1).restore()
+        self.assertRollup(self.day1, 2, Decimal('20.00'))
+
+    def test_price_change(self):
+        self.product.price = 15
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertRollup(self.day1, 2, Decimal('30.00'))
+        self.assertRollup(self.day2, 1, Decimal('15.00'))
+
+    def test_products_change(self):
+        self.orders[2].products.add(Product.objects.create(name='Other', price=5))
+        rollup = DailyOrderRollup.objects.get(date=self.day2)
+        self.assertEqual((rollup.order_count, rollup.product_count, rollup.revenue), (1, 2, Decimal('15.00')))
+
+    def test_bulk_update_date(self):
+        self.orders[0].date = self.day2
+        Order.objects.bulk_update([self.orders[0]], ['date'])
+        self.assertRollup(self.day1, 1, Decimal('10.00'))
+        self.assertRollup(self.day2, 2, Decimal('20.00'))
+
+    def test_changes_are_added(self):
+        # A change committed by a concurrent write is kept, writes add their changes without recomputing
+        DailyOrderRollup.objects.filter(date=self.day1).update(order_count=F('order_count') + 5)
+        with CaptureQueriesContext(connection) as queries:
+            self.orders[0].delete()
+        self.assertEqual(DailyOrderRollup.objects.get(date=self.day1).order_count, 6)
+        self.assertFalse(any('SUM(' in query['sql'] for query in queries))
+
+    def test_stale_instance(self):
+        # The stored values are read with the row locked, not taken from the loaded instance
+        order = Order.objects.get(pk=self.orders[0].pk)
+        Order.objects.filter(pk=order.pk).update(date=self.day2)
+        order.delete()
+        self.assertRollup(self.day1, 1, Decimal('10.00'))
+        self.assertRollup(self.day2, 1, Decimal('10.00'))
+
+    def test_hard_delete_and_refresh(self):
+        Order.all_objects.filter(pk=self.orders[2].pk).delete()
+        self.assertRollup(self.day2, 0, 0)
+        DailyOrderRollup.objects.all().delete()
+        DailyOrderRollup.refresh([self.day1, self.day2])
+        self.assertRollup(self.day1, 2, Decimal('20.00'))
+        self.assertRollup(self.day2, 0, 0)
@@ -1,6 +1,8 @@
+from django.db.models import Prefetch
 from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
 from ..models import Product, Order
-from ..serializers import ProductSerializer, OrderSerializer
+from ..serializers import OrderFastListSerializer, ProductSerializer, OrderSerializer
 
 
 class ProductSerializerTestCase(TestCase):
@@ -74,6 +76,36 @@ class OrderSerializerTestCase(TestCase):
         self.assertIn('products', serializer.fields)
         self.assertIn('product_ids', serializer.fields)
 
+    def test_product_ids_validated_with_single_query(self):
+        products = [Product.objects.create(name=f'Product {i}', price=1.0) for i in range(200)]
+        data = dict(self.valid_order_data, product_ids=[product.id for product in products])
+        serializer = OrderSerializer(data=data)
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['product_ids'], products)
+
+    def test_product_ids_reports_all_missing_and_deleted(self):
+        deleted = Product.objects.create(name='Deleted Product', price=1.0)
+        deleted.delete()
+        data = dict(self.valid_order_data, product_ids=[self.product.id, deleted.id, 0])
+        serializer = OrderSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['product_ids'][0],
+                         f'Invalid pks "{deleted.id}, 0" - objects do not exist.')
+
+    def test_product_ids_incorrect_type(self):
+        data = dict(self.valid_order_data, product_ids=['abc'])
+        serializer = OrderSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('product_ids', serializer.errors)
+
+    def test_bulk_product_ids_validated_with_single_query(self):
+        products = [Product.objects.create(name=f'Product {i}', price=1.0) for i in range(10)]
+        data = [dict(self.valid_order_data, product_ids=[product.id]) for product in products]
+        serializer = OrderSerializer(data=data, many=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
     def test_update_order_with_products(self):
         order = Order.objects.create(
             name='Initial Order', description='Initial Description', date='2024-01-01')
@@ -91,3 +123,28 @@ class OrderSerializerTestCase(TestCase):
         self.assertTrue(serializer.is_valid())
         updated_order = serializer.save()
         self.assertEqual(updated_order.products.count(), 2)
+
+
+class OrderFastListSerializerTestCase(TestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Product {i}', price=i + 0.5) for i in range(4)]
+        for i in range(10):
+            order = Order.objects.create(name=f'Order {i}', description=f'Description {i}', date=f'2024-01-{i + 1:02}')
+            order.products.set(self.products[i % 4:] or self.products[:1])
+        Order.objects.create(name='Empty Order', description='No products', date='2024-02-01')
+        self.products[1].delete()  # Deleted products are still part of the orders
+        order = Order.objects.get(name='Order 9')
+        order.delete()
+
+    def test_same_output_of_order_serializer(self):
+        orders = Order.all_objects.order_by('-date').prefetch_related(
+            Prefetch('products', queryset=Product.all_objects.order_by('id')))
+        expected = JSONRenderer().render(OrderSerializer(orders, many=True).data)
+
+        rows = Order.all_objects.order_by('-date').values(*OrderFastListSerializer.get_columns())
+        with self.assertNumQueries(2):
+            data = OrderFastListSerializer(rows).data
+        self.assertEqual(JSONRenderer().render(data), expected)
+
+    def test_empty_list(self):
+        self.assertEqual(OrderFastListSerializer(Order.objects.none().values()).data, [])
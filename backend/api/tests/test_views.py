@@ -1,10 +1,26 @@
+import csv
+import json
 import random
+from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.settings import api_settings
 from rest_framework.test import APITestCase
-from ..models import Product, Order
+from ..models import DailyOrderRollup, Product, Order
+from ..pagination import ChangeFeedPagination, KeysetPagination
+from ..views import OrderViewSet
 
 
 class ProductViewSetTestCase(APITestCase):
@@ -104,6 +120,14 @@ class OrderViewSetTest(APITestCase):
         self.assertEqual(len(response.data['results']), page_size) # Check page number size result
         self.assertEqual(response.data['count'], 100) # Check total size result
 
+    def test_list_orders_same_output_of_retrieve(self):
+        # The fast list serialization must match the regular order serializer
+        self.products[0].delete()
+        response = self.client.get(reverse('order-list'))
+        for order in response.data['results'][:10]:
+            detail = self.client.get(reverse('order-detail', args=[order['id']]))
+            self.assertEqual(JSONRenderer().render(order), JSONRenderer().render(detail.data))
+
     def test_list_orders_excludes_soft_deleted(self):
         order = self.orders[0]
         url = reverse('order-detail', args=[order.id])
@@ -241,3 +265,801 @@ class OrderViewSetTest(APITestCase):
         order_ids = [order['id'] for order in response.data['results']]
         self.assertEqual(len(order_ids), 1)  # Assicurati di ottenere solo un risultato
         self.assertIn('Special Order', [order['name'] for order in response.data['results']])
+
+
+@mock.patch.object(KeysetPagination, 'page_size', 30)
+class OrderKeysetPaginationTest(APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Test Product', price=10.0)
+        # Create 100 orders sharing few dates to exercise the id tie breaker
+        self.orders = []
+        for i in range(100):
+            order = Order.objects.create(name=f'Order {i:03}', description=f'Description {i}',
+                                         date=f'2024-01-0{i % 3 + 1}')
+            order.products.add(self.product)
+            self.orders.append(order)
+        self.url = reverse('order-list') + '?pagination=keyset'
+
+    def collect_ids(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [order['id'] for order in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_page_number_is_default(self):
+        response = self.client.get(reverse('order-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 100)
+
+    def test_keyset_walks_all_orders_by_date_and_id(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertIsNone(response.data['previous'])
+
+        expected = list(Order.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(self.collect_ids(self.url), expected)
+
+    def test_keyset_with_ordering_and_date_filter(self):
+        url = self.url + '&ordering=name&date__gte=2024-01-02'
+        expected = list(Order.objects.filter(date__gte='2024-01-02')
+                        .order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual(self.collect_ids(url), expected)
+
+    def test_keyset_previous_page(self):
+        first = self.client.get(self.url)
+        second = self.client.get(first.data['next'])
+        previous = self.client.get(second.data['previous'])
+        self.assertEqual([order['id'] for order in previous.data['results']],
+                         [order['id'] for order in first.data['results']])
+
+    def test_cursor_stable_on_insert_and_soft_delete(self):
+        first = self.client.get(self.url)
+        first_ids = [order['id'] for order in first.data['results']]
+
+        # New order on top and soft deleted order in the next page
+        Order.objects.create(name='New Order', description='Newest', date='2024-02-01')
+        expected = list(Order.objects.order_by('-date', '-id').values_list('id', flat=True))
+        expected = expected[expected.index(first_ids[-1]) + 1:]
+        Order.objects.get(id=expected.pop(0)).delete()
+
+        self.assertEqual(self.collect_ids(first.data['next']), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url + '&cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class OrderBulkTest(APITestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Test Product {i}', price=10.0) for i in range(3)]
+        self.order = Order.objects.create(name='Existing Order', description='Existing', date='2024-01-01')
+        self.order.products.add(self.products[0])
+        self.url = reverse('order-bulk')
+
+    def test_bulk_create_orders(self):
+        data = [{
+            'name': f'Bulk Order {i}',
+            'description': f'Bulk Description {i}',
+            'date': '2024-01-02',
+            'product_ids': [product.id for product in self.products[:i + 1]]
+        } for i in range(3)]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([order['name'] for order in response.data], ['Bulk Order 0', 'Bulk Order 1', 'Bulk Order 2'])
+        self.assertEqual([len(order['products']) for order in response.data], [1, 2, 3])
+        self.assertEqual(Order.objects.count(), 4)
+
+    def test_bulk_create_and_update_orders(self):
+        data = [
+            {'id': self.order.id, 'name': 'Updated Order', 'description': 'Updated', 'date': '2024-01-03',
+             'product_ids': [self.products[1].id, self.products[2].id]},
+            {'name': 'New Order', 'description': 'New', 'date': '2024-01-03', 'product_ids': [self.products[0].id]},
+        ]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.name, 'Updated Order')
+        self.assertEqual(set(self.order.products.values_list('id', flat=True)), {self.products[1].id, self.products[2].id})
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_bulk_partial_update(self):
+        data = [{'id': self.order.id, 'description': 'Patched'}]
+        response = self.client.patch(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.description, 'Patched')
+        self.assertEqual(self.order.name, 'Existing Order')
+        self.assertEqual(self.order.products.count(), 1)
+
+    def test_bulk_errors_per_item_without_writes(self):
+        data = [
+            {'name': 'Valid Order', 'description': 'Valid', 'date': '2024-01-02', 'product_ids': [self.products[0].id]},
+            {'name': 'Invalid Order', 'description': 'No products', 'date': '2024-01-02', 'product_ids': []},
+            {'id': 0, 'name': 'Missing Order', 'description': 'Missing', 'date': '2024-01-02',
+             'product_ids': [self.products[0].id]},
+        ]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('product_ids', response.data[1])
+        self.assertIn('id', response.data[2])
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class OrderExportTest(APITestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Test Product {i}', price=10.0) for i in range(2)]
+        for i in range(5):
+            order = Order.objects.create(name=f'Order {i}', description=f'Description {i}', date=f'2024-01-0{i + 1}')
+            order.products.add(*self.products)
+        self.url = reverse('order-export')
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        response = self.client.get(self.url + '?date__gte=2024-01-03')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Order 4', 'Order 3', 'Order 2'])
+        self.assertEqual(len(rows[0]['products']), 2)
+
+    def test_export_csv(self):
+        response = self.client.get(self.url + '?export_format=csv&search=Order 1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(self.read(response).splitlines()))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['name'], 'Order 1')
+        self.assertEqual(rows[0]['products'], ' '.join(str(product.id) for product in self.products))
+
+    def test_export_products_prefetched_per_chunk(self):
+        # One cursor query for the orders and one products query for each chunk of 2 orders
+        with mock.patch.object(OrderViewSet, 'export_chunk_size', 2), self.assertNumQueries(4):
+            self.read(self.client.get(self.url))
+
+    async def test_export_streamed_under_asgi(self):
+        serialized = []
+        get_serializer = OrderViewSet.get_serializer
+
+        def count_serialized(view, *args, **kwargs):
+            serialized.extend(args)
+            return get_serializer(view, *args, **kwargs)
+
+        with mock.patch.object(OrderViewSet, 'export_chunk_size', 2), \
+                mock.patch.object(OrderViewSet, 'get_serializer', count_serialized):
+            response = await self.async_client.get(self.url + '?export_format=csv')
+            self.assertTrue(response.is_async)
+            chunks = aiter(response.streaming_content)
+            await anext(chunks)
+            await anext(chunks)
+            # Header and first order sent, the next orders are not read yet
+            self.assertEqual(len(serialized), 1)
+            rows = [chunk async for chunk in chunks]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(len(serialized), 5)
+
+    def test_export_invalid_format(self):
+        response = self.client.get(self.url + '?export_format=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkSoftDeleteTest(APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Test Product', price=10.0)
+        self.orders = [Order.objects.create(name=f'Order {i}', description=f'Description {i}',
+                                            date=f'2024-01-0{i + 1}') for i in range(5)]
+
+    def test_bulk_delete_by_ids(self):
+        response = self.client.post(reverse('order-bulk-delete'),
+                                    {'ids': [self.orders[0].id, self.orders[1].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_bulk_delete_by_filter(self):
+        response = self.client.post(reverse('order-bulk-delete') + '?date__lte=2024-01-03')
+        self.assertEqual(response.data, {'deleted': 3})
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {self.orders[3].id, self.orders[4].id})
+
+    def test_bulk_delete_requires_ids_or_filter(self):
+        response = self.client.post(reverse('order-bulk-delete') + '?ordering=name')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('product-bulk-delete'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_bulk_restore(self):
+        Order.objects.soft_delete()
+        response = self.client.post(reverse('order-bulk-restore') + '?date__gte=2024-01-04')
+        self.assertEqual(response.data, {'restored': 2})
+        response = self.client.post(reverse('order-bulk-restore'), {'ids': [self.orders[0].id]}, format='json')
+        self.assertEqual(response.data, {'restored': 1})
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_bulk_delete_products(self):
+        response = self.client.post(reverse('product-bulk-delete'), {'ids': [self.product.id]}, format='json')
+        self.assertEqual(response.data, {'deleted': 1})
+        response = self.client.post(reverse('product-bulk-restore'), {'ids': [self.product.id]}, format='json')
+        self.assertEqual(response.data, {'restored': 1})
+
+
+class OrderTotalsViewTest(APITestCase):
+    def setUp(self):
+        self.product1 = Product.objects.create(name='Test Product 1', price=10.0)
+        self.product2 = Product.objects.create(name='Test Product 2', price=25.0)
+        for i, products in enumerate([[self.product1], [self.product2], [self.product1, self.product2]]):
+            order = Order.objects.create(name=f'Order {i}', description=f'Description {i}', date=f'2024-01-0{i + 1}')
+            order.products.set(products)
+
+    def test_create_order_returns_totals(self):
+        data = {'name': 'New Order', 'description': 'New', 'date': '2024-01-01',
+                'product_ids': [self.product1.id, self.product2.id]}
+        response = self.client.post(reverse('order-list'), data, format='json')
+        self.assertEqual(response.data['total_price'], '35.00')
+        self.assertEqual(response.data['product_count'], 2)
+
+    def test_bulk_create_orders_totals(self):
+        data = [{'name': 'Bulk Order', 'description': 'Bulk', 'date': '2024-01-01',
+                 'product_ids': [self.product1.id, self.product2.id]}]
+        response = self.client.post(reverse('order-bulk'), data, format='json')
+        self.assertEqual(response.data[0]['total_price'], '35.00')
+        self.assertEqual(response.data[0]['product_count'], 2)
+
+    def test_order_and_filter_by_totals(self):
+        response = self.client.get(reverse('order-list') + '?ordering=-total_price&total_price__gte=20')
+        self.assertEqual([order['name'] for order in response.data['results']], ['Order 2', 'Order 1'])
+
+    def test_summary(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('order-summary') + '?date__gte=2024-01-02')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['order_count'], 2)
+        # Decimals rendered as strings, like the order totals
+        self.assertEqual(response.json(), {
+            'order_count': 2, 'total_price_sum': '60.00', 'total_price_avg': '30.00', 'total_price_min': '25.00',
+            'total_price_max': '35.00', 'product_count_sum': 3,
+        })
+
+    def test_summary_without_orders(self):
+        response = self.client.get(reverse('order-summary') + '?date__gte=2100-01-01')
+        self.assertEqual(response.json(), {
+            'order_count': 0, 'total_price_sum': '0.00', 'total_price_avg': None, 'total_price_min': None,
+            'total_price_max': None, 'product_count_sum': 0,
+        })
+
+
+class ResponseCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Test Product', price=10.0)
+        self.order = Order.objects.create(name='Order', description='Cached', date='2024-01-01')
+        self.order.products.add(self.product)
+
+    def test_list_cached(self):
+        url = reverse('product-list')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['results'][0]['name'], 'Test Product')
+        # Different query params are cached separately
+        self.assertEqual(self.client.get(url + '?page=1')['X-Cache'], 'MISS')
+
+    def test_invalidated_on_save_delete_and_restore(self):
+        url = reverse('product-detail', args=[self.product.id])
+        self.client.get(url)
+        self.client.patch(url, {'name': 'Updated Product'}, format='json')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Updated Product')
+
+        list_url = reverse('product-list')
+        self.client.get(list_url)
+        self.product.delete()
+        self.assertEqual(self.client.get(list_url).data['count'], 0)
+        self.product.restore()
+        self.assertEqual(self.client.get(list_url).data['count'], 1)
+        Product.objects.filter(pk=self.product.pk).soft_delete()
+        self.assertEqual(self.client.get(list_url).data['count'], 0)
+
+    def test_orders_invalidated_on_product_change(self):
+        url = reverse('order-detail', args=[self.order.id])
+        self.client.get(url)
+        self.product.name = 'Renamed Product'
+        self.product.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['products'][0]['name'], 'Renamed Product')
+
+    def test_stats(self):
+        url = reverse('product-list')
+        for _ in range(3):
+            self.client.get(url)
+        out = StringIO()
+        call_command('cache_stats', '--reset', stdout=out)
+        self.assertEqual(json.loads(out.getvalue()), {'hits': 2, 'misses': 1, 'hit_ratio': 0.6667})
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        url = reverse('product-list')
+        self.client.get(url)
+        self.assertNotIn('X-Cache', self.client.get(url))
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Test Product', price=10.0)
+        self.orders = []
+        for i in range(3):
+            order = Order.objects.create(name=f'Order {i}', description=f'Description {i}', date='2024-01-01')
+            order.products.add(self.product)
+            self.orders.append(order)
+        self.url = reverse('order-list')
+
+    def test_list_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertIn('ETag', response)
+        # Only the ETag, the rows updated_at don't cover every list change
+        self.assertNotIn('Last-Modified', response)
+
+        # Validated without querying the rows
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_validators_change_on_soft_delete_and_restore(self):
+        etag = self.client.get(self.url)['ETag']
+        self.orders[0].delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+
+        etag = response['ETag']
+        self.orders[0].restore()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+
+    def test_list_validators_depend_on_filters(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url + '?date__gte=2024-01-02', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_not_modified(self):
+        url = reverse('order-detail', args=[self.orders[0].id])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Orders embed products, a product change modifies the order too
+        self.product.name = 'Renamed Product'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class SparseFieldsetTest(APITestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Product {i}', price=10 + i) for i in range(3)]
+        self.orders = []
+        for i in range(5):
+            order = Order.objects.create(name=f'Order {i}', description=f'Description {i}', date=f'2024-01-0{i + 1}')
+            order.products.add(*self.products[:i % 3 + 1])
+            self.orders.append(order)
+        self.url = reverse('order-list')
+        self.detail_url = reverse('order-detail', args=[self.orders[0].id])
+
+    def test_list_fields(self):
+        # Orders page and count only, products are not requested
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url + '?fields=id,name,total_price')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data['results'][0]), ['id', 'name', 'total_price'])
+
+    def test_list_expand_products(self):
+        response = self.client.get(self.url + '?fields=name&expand=products')
+        self.assertEqual(list(response.data['results'][0]), ['name', 'products'])
+        self.assertEqual(response.data['results'][0]['products'][0]['name'], 'Product 0')
+
+    def test_list_product_ids_only(self):
+        full = self.client.get(self.url).data['results']
+        response = self.client.get(self.url + '?product_ids_only=1')
+        for order, expected in zip(response.data['results'], full):
+            self.assertEqual(order['products'], [product['id'] for product in expected['products']])
+
+    def test_list_fields_with_keyset_ordering(self):
+        response = self.client.get(self.url + '?fields=name&pagination=keyset&ordering=total_price')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data['results'][0]), ['name'])
+
+    def test_retrieve_fields(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url + '?fields=name,is_deleted')
+        self.assertEqual(response.data, {'name': 'Order 0', 'is_deleted': False})
+
+    def test_retrieve_product_ids_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url + '?product_ids_only=1')
+        self.assertEqual(response.data['products'], [self.products[0].id])
+        self.assertEqual(response.data['name'], 'Order 0')
+        # The ids are read from the through table, without joining the products
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(any('"api_product"' in query['sql'] for query in queries))
+        response = self.client.get(reverse('async-order-detail', args=[self.orders[2].id]) + '?product_ids_only=1')
+        self.assertEqual(response.json()['products'], [product.id for product in self.products])
+
+    def test_expand_requires_fields(self):
+        response = self.client.get(self.url + '?expand=products')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('expand', response.data)
+
+    def test_unknown_fields(self):
+        response = self.client.get(self.url + '?fields=name,secret')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', response.data)
+        response = self.client.get(self.detail_url + '?expand=customer')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_async_list_fields(self):
+        response = self.client.get(reverse('async-order-list') + '?fields=id,name&product_ids_only=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'name'])
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class ProductSnapshotViewTest(APITestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Product {i}', price=10 + i) for i in range(2)]
+        self.order = Order.objects.create(name='Order', description='Snapshot', date='2024-01-01')
+        self.order.products.add(*self.products)
+        self.expected = [
+            {'id': self.products[0].id, 'name': 'Product 0', 'price': '10.00', 'is_deleted': False},
+            {'id': self.products[1].id, 'name': 'Product 1', 'price': '11.00', 'is_deleted': False},
+        ]
+
+    def test_list(self):
+        # Count and page, no products query
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('order-list') + '?product_snapshot=1')
+        self.assertEqual(response.data['results'][0]['products'], self.expected)
+        # Full products by default
+        self.assertIn('created_at', self.client.get(reverse('order-list')).data['results'][0]['products'][0])
+
+    def test_retrieve(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('order-detail', args=[self.order.id]) + '?product_snapshot=1&fields=products')
+        self.assertEqual(response.data, {'products': self.expected})
+
+    def test_check_command(self):
+        Order.all_objects.filter(pk=self.order.pk).update(products_snapshot=[])
+        out = StringIO()
+        call_command('check_order_snapshots', stdout=out)
+        self.assertEqual(json.loads(out.getvalue()), {
+            'checked': 1, 'drifted': 1, 'repaired': 0, 'drifted_ids': [self.order.id]})
+
+        call_command('check_order_snapshots', '--repair', '--chunk-size', '1', stdout=StringIO())
+        self.assertEqual(Order.objects.get(pk=self.order.pk).products_snapshot, self.expected)
+        out = StringIO()
+        call_command('check_order_snapshots', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['drifted'], 0)
+
+
+class ImportViewTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('product-import-file')
+        self.file = SimpleUploadedFile('products.csv', b'name,price\nImported,10\nInvalid,\n')
+
+    def test_staff_only(self):
+        response = self.client.post(self.url, {'file': self.file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import(self):
+        self.client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+        response = self.client.post(self.url, {'file': self.file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['imported'], response.data['rejected']), (1, 1))
+        self.assertTrue(Product.objects.filter(name='Imported').exists())
+
+        response = self.client.post(self.url, {}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DailyReportViewTest(APITestCase):
+    def setUp(self):
+        product = Product.objects.create(name='Test Product', price=10.0)
+        for day in ['2024-01-01', '2024-01-01', '2024-01-02', '2024-01-03']:
+            order = Order.objects.create(name='Order', description='Report', date=day)
+            order.products.add(product)
+        self.url = reverse('daily-report-list')
+
+    def test_daily_report(self):
+        # Rollup only, no join to the orders
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url + '?date__gte=2024-01-01&date__lte=2024-01-02')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'date': '2024-01-01', 'order_count': 2, 'product_count': 2, 'revenue': '20.00'},
+            {'date': '2024-01-02', 'order_count': 1, 'product_count': 1, 'revenue': '10.00'},
+        ])
+
+    def test_rebuild(self):
+        DailyOrderRollup.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_daily_rollup', '--from', '2024-01-02', stdout=out)
+        self.assertEqual(json.loads(out.getvalue()), {'dates': 2, 'rollups': 2})
+        self.assertEqual(self.client.get(self.url).data['count'], 2)
+        call_command('rebuild_daily_rollup', stdout=StringIO())
+        self.assertEqual(self.client.get(self.url).data['count'], 3)
+
+
+class PoolStatsViewTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('pool-stats')
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stats(self):
+        self.client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Not pooled on the test database
+        self.assertEqual(response.data, {'default': None})
+
+        pool = mock.Mock(**{'get_stats.return_value': {'pool_size': 4, 'pool_available': 3}})
+        with mock.patch('api.pool.get_pool', return_value=pool):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['default']['in_use'], 1)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class MinimalWriteTest(APITestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Product {i}', price=10 + i) for i in range(3)]
+        self.order = Order.objects.create(name='Order', description='Test', date='2024-01-01')
+        self.order.products.add(*self.products[:2])
+        self.url = reverse('order-detail', args=[self.order.id])
+
+    def get_writes(self, queries):
+        return [query['sql'] for query in queries.captured_queries
+                if query['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))]
+
+    def test_patch_one_field(self):
+        # Order and products lookup, UPDATE of the changed column (in a savepoint), products of the response
+        with self.assertNumQueries(6) as queries:
+            response = self.client.patch(self.url, {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = self.get_writes(queries)
+        self.assertEqual(len(writes), 1)
+        self.assertIn('"name" = ', writes[0])
+        self.assertNotIn('"description"', writes[0])
+        self.assertEqual(Order.objects.get(pk=self.order.pk).name, 'Renamed')
+
+    def test_put_without_changes(self):
+        data = {'name': 'Order', 'description': 'Test', 'date': '2024-01-01',
+                'product_ids': [product.id for product in self.products[:2]]}
+        # Products validation added, no write
+        with self.assertNumQueries(6) as queries:
+            self.client.put(self.url, data, format='json')
+        self.assertEqual(self.get_writes(queries), [])
+
+    def test_products_diff(self):
+        data = {'product_ids': [self.products[1].id, self.products[2].id]}
+        # Order, products and validation lookups, the links writes, the totals (with the rollup)
+        # and snapshot refreshes, the products of the response: no UPDATE of updated_at alone
+        with self.assertNumQueries(16) as queries:
+            response = self.client.patch(self.url, data, format='json')
+        self.assertEqual([product['id'] for product in response.data['products']],
+                         [self.products[1].id, self.products[2].id])
+        links = [sql.split(' ')[0] for sql in self.get_writes(queries)
+                 if sql.startswith(('DELETE FROM "api_order_products"', 'INSERT INTO "api_order_products"'))]
+        self.assertEqual(links, ['DELETE', 'INSERT'])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal('23'))
+        self.assertFalse([sql for sql in self.get_writes(queries)
+                          if sql.startswith('UPDATE "api_order" SET "updated_at"')])
+
+    def test_soft_delete_writes_two_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.delete(self.url)
+        update = next(sql for sql in self.get_writes(queries) if sql.startswith('UPDATE "api_order"'))
+        self.assertNotIn('"name"', update)
+        self.assertIn('"deleted_at"', update)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class OptimisticConcurrencyTest(APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Test Product', price=10)
+        self.order = Order.objects.create(name='Order', description='Test', date='2024-01-01')
+        self.order.products.add(self.product)
+        self.url = reverse('order-detail', args=[self.order.id])
+
+    def test_if_match(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'name': 'First'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The second editor read the order before the first write
+        response = self.client.patch(self.url, {'name': 'Second'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).name, 'First')
+        response = self.client.delete(self.url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_if_match_products_only(self):
+        etag = self.client.get(self.url)['ETag']
+        other = Product.objects.create(name='Other Product', price=5)
+        Order.objects.filter(pk=self.order.pk).update(name='Concurrent')
+        # Nothing saved but the products, the totals refresh checks the precondition
+        response = self.client.patch(self.url, {'product_ids': [other.id]}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(list(self.order.products.all()), [self.product])
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'product_ids': [other.id]}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(self.order.products.all()), [other])
+
+    def test_if_match_any_representation(self):
+        etag = self.client.get(self.url, {'product_snapshot': 1})['ETag']
+        self.assertEqual(self.client.get(self.url)['ETag'], etag)
+        response = self.client.put(self.url, {'name': 'Renamed', 'description': 'Test', 'date': '2024-01-01',
+                                              'product_ids': [self.product.id]}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_not_changed_by_other_orders(self):
+        etag = self.client.get(self.url)['ETag']
+        other = Order.objects.create(name='Other', description='Test', date='2024-01-01')
+        other.delete()
+        response = self.client.patch(self.url, {'name': 'Renamed'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_concurrent_write_between_check_and_update(self):
+        etag = self.client.get(self.url)['ETag']
+        check = OrderViewSet.check_preconditions
+
+        def write_concurrently(view, request, instance):
+            result = check(view, request, instance)
+            Order.objects.get(pk=instance.pk).save()
+            return result
+
+        with mock.patch.object(OrderViewSet, 'check_preconditions', write_concurrently):
+            response = self.client.patch(self.url, {'name': 'Lost'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).name, 'Order')
+
+    def test_without_precondition(self):
+        response = self.client.patch(self.url, {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(CHANGE_FEED_DELAY=0)
+class ChangeFeedTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('product-changes')
+        self.start = timezone.now() - timedelta(hours=1)
+        self.products = [Product.objects.create(name=f'Product {i}', price=10) for i in range(5)]
+        # Distinct change times, the last product changed first
+        for i, product in enumerate(reversed(self.products)):
+            Product.all_objects.filter(pk=product.pk).update(updated_at=self.start + timedelta(minutes=i))
+
+    def get_feed(self, url, **params):
+        with mock.patch.object(KeysetPagination, 'page_size', 2):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_ordered_pages_and_resume(self):
+        data = self.get_feed(self.url, updated_since=self.start.isoformat())
+        ids = [item['id'] for item in data['results']]
+        self.assertTrue(data['has_more'])
+        while data['has_more']:
+            data = self.get_feed(data['next'])
+            ids += [item['id'] for item in data['results']]
+        self.assertEqual(ids, [product.id for product in reversed(self.products)])
+
+        # Nothing new, the next link stays on the last change
+        data = self.get_feed(data['next'])
+        self.assertEqual((data['results'], data['has_more']), ([], False))
+        self.products[0].name = 'Renamed'
+        self.products[0].save()
+        data = self.get_feed(data['next'])
+        self.assertEqual([item['name'] for item in data['results']], ['Renamed'])
+
+    def test_tombstones_and_restore(self):
+        since = timezone.now().isoformat()
+        self.products[1].delete()
+        data = self.get_feed(self.url, updated_since=since)
+        self.assertEqual(data['results'], [{
+            'id': self.products[1].id,
+            'updated_at': data['results'][0]['updated_at'],
+            'is_deleted': True,
+            'deleted_at': data['results'][0]['deleted_at'],
+        }])
+        self.products[1].restore()
+        data = self.get_feed(data['next'])
+        self.assertEqual(data['results'][0]['id'], self.products[1].id)
+        self.assertFalse(data['results'][0]['is_deleted'])
+        self.assertEqual(data['results'][0]['name'], 'Product 1')
+
+    def test_order_changes_include_product_changes(self):
+        order = Order.objects.create(name='Order', description='Test', date='2024-01-01')
+        order.products.add(self.products[0])
+        since = timezone.now().isoformat()
+        self.products[0].price = 20
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        data = self.get_feed(reverse('order-changes'), updated_since=since)
+        self.assertEqual([item['id'] for item in data['results']], [order.id])
+        self.assertEqual(data['results'][0]['total_price'], '20.00')
+
+    @override_settings(CHANGE_FEED_DELAY=60)
+    def test_recent_changes_held_back(self):
+        since = timezone.now().isoformat()
+        self.products[0].delete()
+        data = self.get_feed(self.url, updated_since=since)
+        self.assertEqual(data['results'], [])
+
+    @override_settings(CHANGE_FEED_MAX_DELAY=7200)
+    def test_held_back_by_oldest_transaction(self):
+        # The changes after the start of a transaction still open may be followed by earlier ones
+        oldest = self.start + timedelta(minutes=2, seconds=30)
+        with mock.patch.object(ChangeFeedPagination, 'get_oldest_transaction', return_value=oldest):
+            data = self.get_feed(self.url, updated_since=self.start.isoformat())
+            data = self.get_feed(data['next'])
+        self.assertEqual((len(data['results']), data['has_more']), (1, False))
+        data = self.get_feed(data['next'])
+        self.assertEqual(len(data['results']), 2)
+
+    @override_settings(CHANGE_FEED_MAX_DELAY=600)
+    def test_oldest_transaction_holdback_capped(self):
+        # A transaction open for longer than the maximum delay doesn't freeze the feed
+        oldest = self.start + timedelta(minutes=2, seconds=30)
+        with mock.patch.object(ChangeFeedPagination, 'get_oldest_transaction', return_value=oldest):
+            data = self.get_feed(self.url, updated_since=self.start.isoformat())
+            data = self.get_feed(data['next'])
+            data = self.get_feed(data['next'])
+        self.assertEqual((len(data['results']), data['has_more']), (1, False))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Postgres only')
+    def test_oldest_write_transaction(self):
+        pagination = ChangeFeedPagination()
+        other = connection.copy()
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute('BEGIN')
+            cursor.execute('SELECT 1')
+            # Read only transactions don't hold the feed back
+            self.assertIsNone(pagination.get_oldest_transaction(connection))
+            cursor.execute('SELECT pg_current_xact_id()')
+            self.clear_activity_snapshot()
+            self.assertIsNotNone(pagination.get_oldest_transaction(connection))
+            cursor.execute('ROLLBACK')
+        self.clear_activity_snapshot()
+
+    def clear_activity_snapshot(self):
+        # The sessions activity is read once per transaction, the test one lasts for the whole class
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_stat_clear_snapshot()')
+
+    def test_invalid_parameters(self):
+        response = self.client.get(self.url, {'updated_since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,12 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet, ProductViewSet
+from .async_views import AsyncOrderView, AsyncProductView
+from .views import DailyReportViewSet, OrderViewSet, PoolStatsView, ProductViewSet
 
 
 router = DefaultRouter()
 router.register(r'orders', OrderViewSet)
 router.register(r'products', ProductViewSet)
+router.register(r'reports/daily', DailyReportViewSet, basename='daily-report')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('pool-stats/', PoolStatsView.as_view(), name='pool-stats'),
+    # Async read path, for ASGI deployments
+    path('async/orders/', AsyncOrderView.as_view(), name='async-order-list'),
+    path('async/orders/<int:pk>/', AsyncOrderView.as_view(), name='async-order-detail'),
+    path('async/products/', AsyncProductView.as_view(), name='async-product-list'),
+    path('async/products/<int:pk>/', AsyncProductView.as_view(), name='async-product-detail'),
 ]
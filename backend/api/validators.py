@@ -0,0 +1,17 @@
+from django.core.exceptions import ValidationError
+
+
+def validate_price(value):
+    """
+    Product prices cannot be negative.
+    """
+    if value < 0:
+        raise ValidationError("Price cannot be negative.")
+
+
+def validate_product_ids(value):
+    """
+    Orders need at least one product.
+    """
+    if not value:
+        raise ValidationError("Order must contain at least one product.")
@@ -1,21 +1,224 @@
+import csv
+import hashlib
+import io
+import json
+from functools import cached_property
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.db import models
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets, filters, status
+from rest_framework import mixins, viewsets, filters, permissions, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.response import Response
-from .models import Order, Product
-from .serializers import OrderSerializer, ProductSerializer
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from . import cache, pool
+from .importer import FORMATS as IMPORT_FORMATS, OrderImporter, ProductImporter
+from .metrics import CONTENT_TYPE, metrics
+from .filters import TrigramSearchFilter
+from .models import ConcurrentUpdate, DailyOrderRollup, Order, Product
+from .pagination import ChangeFeedPagination, OrderPagination
+from .serializers import (
+    BulkIdsSerializer, DailyOrderRollupSerializer, OrderFastListSerializer, OrderSerializer, OrderSummarySerializer,
+    ProductSerializer
+)
+
+
+class Echo:
+    """
+    Pseudo buffer for csv.writer, returns the written row instead of storing it.
+    """
+
+    def write(self, value):
+        return value
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The item was modified since it was read, reload it and retry.'
+    default_code = 'precondition_failed'
 
 
 class BaseViewSet(viewsets.ModelViewSet):
     """
     A base viewset to handle soft delete and restore.
+    List and retrieve responses are cached, invalidated by the version of the `cache_models`,
+    and support conditional GET with ETag validators (and Last-Modified for retrieve).
+    Updates and deletes honor the If-Match and If-Unmodified-Since preconditions (optimistic concurrency).
+    List and retrieve return only the fields requested with `?fields=` (sparse fieldsets),
+    loading only their columns.
     """
+    cache_models = None
+    # Bulk importer of the uploaded files
+    importer_class = None
+    sparse_fields_param = 'fields'
+    expand_param = 'expand'
+    # Fields returned only when requested with `?fields=` or `?expand=`
+    expandable_fields = []
+    read_actions = ['list', 'retrieve']
+    # Fields of the deleted items in the change feed
+    tombstone_fields = ['id', 'updated_at', 'is_deleted', 'deleted_at']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'changes':
+            # Deleted items too, returned as tombstones
+            queryset = queryset.model.all_objects.all()
+        if self.sparse_fields is not None:
+            queryset = queryset.only(*self.get_sparse_columns(queryset))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.sparse_fields is not None:
+            kwargs.setdefault('fields', self.sparse_fields)
+        return super().get_serializer(*args, **kwargs)
+
+    @cached_property
+    def sparse_fields(self):
+        """
+        Readable fields requested with `?fields=` (plus the `?expand=` ones), None for all of them.
+        """
+        if getattr(self, 'request', None) is None or self.action not in self.read_actions:
+            return None
+        expanded = self.expanded_fields
+        requested = self.get_query_list(self.sparse_fields_param)
+        if not requested:
+            if expanded:
+                # All the fields are returned already
+                raise ValidationError({self.expand_param: [
+                    f"Expansions require a list of fields (`?{self.sparse_fields_param}=`)."]})
+            return None
+        readable = [name for name, field in self.get_serializer_class()().fields.items() if not field.write_only]
+        unknown = [name for name in requested if name not in readable]
+        if unknown:
+            raise ValidationError({self.sparse_fields_param: [f"Unknown fields: {', '.join(unknown)}."]})
+        requested += [name for name in expanded if name in readable]
+        return [name for name in readable if name in requested]
+
+    @cached_property
+    def expanded_fields(self):
+        if getattr(self, 'request', None) is None or self.action not in self.read_actions:
+            return []
+        expanded = self.get_query_list(self.expand_param)
+        unknown = [name for name in expanded if name not in self.expandable_fields]
+        if unknown:
+            raise ValidationError({self.expand_param: [f"Unknown expansions: {', '.join(unknown)}."]})
+        return expanded
+
+    def get_query_list(self, param):
+        value = self.request.query_params.get(param, '')
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    def get_sparse_columns(self, queryset):
+        # Columns of the requested fields, plus the pk, the validators and the ordering ones
+        # (e.g. for keyset cursors)
+        model = queryset.model
+        attnames = {field.name: field.attname for field in model._meta.concrete_fields}
+        serializer_class = self.get_serializer_class()
+        serializer = serializer_class(context=self.get_serializer_context(), fields=self.sparse_fields)
+        sources = [model._meta.pk.name, 'updated_at']
+        for name, field in serializer.fields.items():
+            if not field.write_only:
+                sources.append(serializer_class.column_sources.get(field.source, field.source))
+        ordering = self.request.query_params.get(api_settings.ORDERING_PARAM, '').split(',')
+        sources += [field.strip().lstrip('-') for field in [*queryset.query.order_by, *ordering]
+                    if isinstance(field, str)]
+        return list(dict.fromkeys(attnames[source] for source in sources if source in attnames))
+
+    def get_cache_models(self):
+        return self.cache_models or [self.get_queryset().model]
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not cache.get_timeout():
+            return handler(request, *args, **kwargs)
+
+        key = cache.get_response_key(self.basename, self.get_cache_models(), request)
+        data = cache.get_response(key)
+        if data is not None:
+            cache.record('hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        cache.record('misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set_response(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_list_etag(self, request):
+        # ETag of the request URL and the related models versions
+        versions = cache.get_versions(*self.get_cache_models())
+        key = ':'.join(str(value) for value in [request.get_full_path(), *versions])
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def get_object_validators(self, request, instance):
+        # Validators of a single item, changed by its writes (its updated_at) only, to be usable as write
+        # preconditions: the versions of the models would change with the writes of any other item.
+        # Not keyed on the URL, the ETag of any representation (e.g. ?product_snapshot=1) matches on write
+        key = ':'.join(str(value) for value in [instance._meta.label_lower, instance.pk, instance.updated_at])
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        return etag, int(instance.updated_at.timestamp())
+
+    def check_preconditions(self, request, instance):
+        """
+        Check the If-Match and If-Unmodified-Since headers against the item, return whether there are any.
+        """
+        if 'If-Match' not in request.headers and 'If-Unmodified-Since' not in request.headers:
+            return False
+        etag, last_modified = self.get_object_validators(request, instance)
+        if get_conditional_response(request._request, etag=etag, last_modified=last_modified) is not None:
+            raise PreconditionFailed()
+        return True
+
+    def write_if_unmodified(self, instance, write, *args):
+        # With preconditions, the UPDATE also requires the row still has the read updated_at,
+        # so a concurrent write in between fails with 412 instead of being overwritten, without row locks
+        if self.check_preconditions(self.request, instance):
+            instance._expected_updated_at = instance.updated_at
+        try:
+            return write(*args)
+        except ConcurrentUpdate:
+            raise PreconditionFailed()
+
+    def conditional_response(self, request, etag, last_modified, handler, *args, **kwargs):
+        # Answer with 304 (without building the response) if the client validators match
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(*args, **kwargs)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        # Validators from the versions of the models, bumped by every write (raw SQL imports included),
+        # so a 304 costs no query, whatever the filters and the pagination
+        etag = self.get_list_etag(request)
+        # No Last-Modified: writes leaving the rows updated_at unchanged (e.g. soft deletes moving rows
+        # out of the page, raw SQL imports) would answer If-Modified-Since with a stale 304
+        return self.conditional_response(
+            request, etag, None, self.cached_response, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = self.get_object_validators(request, instance)
+        return self.conditional_response(
+            request, etag, last_modified, self.cached_response,
+            lambda request, *args, **kwargs: Response(self.get_serializer(instance).data),
+            request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        self.write_if_unmodified(serializer.instance, serializer.save)
 
     def destroy(self, request, *args, **kwarg):
         instance = self.get_object()
-        instance.delete()  # Soft delete
+        self.write_if_unmodified(instance, instance.delete)  # Soft delete
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post'], url_path='restore')
@@ -27,6 +230,66 @@ class BaseViewSet(viewsets.ModelViewSet):
         except self.get_queryset().model.DoesNotExist:
             raise NotFound("Item not found or not deleted.")
 
+    @action(detail=False, methods=['post'], url_path='bulk-delete', serializer_class=BulkIdsSerializer)
+    def bulk_delete(self, request):
+        """
+        Soft delete the items with the given ids, or matching the query filters, with a single UPDATE.
+        """
+        queryset = self.get_bulk_queryset(request, self.get_queryset())
+        return Response({'deleted': queryset.soft_delete()})
+
+    @action(detail=False, methods=['post'], url_path='bulk-restore', serializer_class=BulkIdsSerializer)
+    def bulk_restore(self, request):
+        """
+        Restore the deleted items with the given ids, or matching the query filters, with a single UPDATE.
+        """
+        queryset = self.get_bulk_queryset(request, self.get_queryset().model.all_objects.all())
+        return Response({'restored': queryset.restore()})
+
+    @action(detail=False, methods=['get'], url_path='changes', pagination_class=ChangeFeedPagination)
+    def changes(self, request):
+        """
+        Change feed of the items created, updated, soft deleted or restored since `?updated_since=`,
+        ordered by (updated_at, id), to sync a mirror with deltas instead of reading all the items.
+        Deleted items are tombstones with only their id, updated_at, is_deleted and deleted_at.
+        Follow (and store) the `next` link to resume the feed.
+        """
+        page = self.paginate_queryset(self.get_queryset())
+        serializer, tombstone = self.get_serializer(), self.get_serializer(fields=self.tombstone_fields)
+        return self.get_paginated_response([
+            (tombstone if item.deleted_at else serializer).to_representation(item) for item in page
+        ])
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser],
+            permission_classes=[permissions.IsAdminUser])
+    def import_file(self, request):
+        """
+        Import the items of the uploaded CSV or NDJSON `file` in batches, staff only.
+        Returns the imported and rejected rows (with their errors) and the rows per second.
+        """
+        if self.importer_class is None:
+            raise NotFound()
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ["No file was submitted."]})
+        import_format = request.query_params.get('import_format') or upload.name.rsplit('.', 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            raise ValidationError({'import_format': [f"Supported formats: {', '.join(IMPORT_FORMATS)}."]})
+        importer = self.importer_class()
+        stats = importer.run(io.TextIOWrapper(upload.file, encoding='utf-8', newline=''), import_format)
+        return Response(stats)
+
+    def get_bulk_queryset(self, request, queryset):
+        # Restrict the queryset to the given ids or to the query filters, never to the whole table
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if 'ids' in serializer.validated_data:
+            return queryset.filter(pk__in=serializer.validated_data['ids'])
+        filtered = self.filter_queryset(queryset)
+        if filtered.query.where == queryset.query.where:
+            raise ValidationError({'ids': ["Provide a list of ids or at least one filter."]})
+        return filtered
+
 
 class ProductViewSet(BaseViewSet):
     """
@@ -34,6 +297,7 @@ class ProductViewSet(BaseViewSet):
     """
     queryset = Product.objects.all().order_by('id')
     serializer_class = ProductSerializer
+    importer_class = ProductImporter
 
 
 class OrderViewSet(BaseViewSet):
@@ -42,16 +306,188 @@ class OrderViewSet(BaseViewSet):
     """
     queryset = Order.objects.all().order_by('-date')
     serializer_class = OrderSerializer
+    importer_class = OrderImporter
+    # Orders embed their products
+    cache_models = [Order, Product]
+    pagination_class = OrderPagination
     filter_backends = [DjangoFilterBackend,
-                       filters.SearchFilter, filters.OrderingFilter]
+                       TrigramSearchFilter, filters.OrderingFilter]
     filterset_fields = {
         'date': ['gte', 'lte'],
+        'total_price': ['gte', 'lte'],
+        'product_count': ['gte', 'lte'],
     }
     search_fields = ['name', 'description']
-    ordering_fields = ['name', 'date']
+    ordering_fields = ['name', 'date', 'total_price', 'product_count']
+    expandable_fields = ['products']
+    product_ids_only_param = 'product_ids_only'
+    product_snapshot_param = 'product_snapshot'
+
+    bulk_max_length = 10000
+    export_chunk_size = 2000
+    export_formats = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
 
     def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Fast list path, rows are serialized by OrderFastListSerializer
+            columns = OrderFastListSerializer.get_columns(snapshot=self.product_snapshot) \
+                if self.sparse_fields is None else self.get_sparse_columns(queryset)
+            return queryset.values(*columns)
+        if self.sparse_fields is not None and 'products' not in self.sparse_fields:
+            # Products not requested, skip their query
+            return queryset
+        if self.product_snapshot and not self.product_ids_only:
+            # Products read from the order row
+            return queryset
+        if self.product_ids_only:
+            # Only the product ids are represented, read from the through table without joining the products
+            return queryset.with_product_ids()
         # Override queryset to load orders with relative products (even the deleted ones)
-        return super().get_queryset().prefetch_related(
-            models.Prefetch('products', queryset=Product.all_objects.all())
+        return queryset.prefetch_related(
+            models.Prefetch('products', queryset=Product.all_objects.order_by('id'))
         )
+
+    def get_read_flag(self, param):
+        return getattr(self, 'request', None) is not None and self.action in self.read_actions and \
+            self.request.query_params.get(param) in ('1', 'true')
+
+    @property
+    def product_ids_only(self):
+        return self.get_read_flag(self.product_ids_only_param)
+
+    @property
+    def product_snapshot(self):
+        return self.get_read_flag(self.product_snapshot_param)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['product_ids_only'] = self.product_ids_only
+        context['product_snapshot'] = self.product_snapshot
+        return context
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action == 'list' and kwargs.get('many'):
+            return OrderFastListSerializer(*args, context=self.get_serializer_context(), fields=self.sparse_fields)
+        return super().get_serializer(*args, **kwargs)
+
+    @action(detail=False, methods=['post', 'patch'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Create (items without id) or update (items with id) a list of orders in a single transaction.
+        PATCH only accepts partial updates of existing orders.
+        Returns the written orders, or the list of errors per item (nothing is written).
+        """
+        items = request.data if isinstance(request.data, list) else []
+        order_ids = [item['id'] for item in items if isinstance(item, dict) and isinstance(item.get('id'), int)]
+        instances = Order.objects.in_bulk(order_ids) if order_ids else None
+        serializer = self.get_serializer(
+            instances, data=request.data, many=True,
+            partial=request.method == 'PATCH', max_length=self.bulk_max_length
+        )
+        serializer.is_valid(raise_exception=True)
+        orders = serializer.save()
+
+        # Reload the written orders with their products in bulk for the response
+        written = self.get_queryset().in_bulk([order.id for order in orders])
+        data = self.get_serializer([written[order.id] for order in orders], many=True).data
+        return Response(data, status=status.HTTP_200_OK if instances else status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='summary')
+    def summary(self, request):
+        """
+        Aggregates of the filtered orders, computed with a single query on the denormalized totals.
+        """
+        queryset = self.filter_queryset(super().get_queryset()).order_by()
+        return Response(OrderSummarySerializer(queryset.aggregate(
+            order_count=models.Count('id'),
+            total_price_sum=models.Sum('total_price', default=0),
+            total_price_avg=models.Avg('total_price'),
+            total_price_min=models.Min('total_price'),
+            total_price_max=models.Max('total_price'),
+            product_count_sum=models.Sum('product_count', default=0),
+        )).data)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Stream all the filtered orders as NDJSON (default) or CSV, selected with `?export_format=`.
+        Orders are read in chunks with a server-side cursor and products are prefetched per chunk,
+        so memory stays flat regardless of the number of exported rows.
+        """
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in self.export_formats:
+            raise ValidationError({'export_format': [f"Supported formats: {', '.join(self.export_formats)}."]})
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if isinstance(request._request, ASGIRequest):
+            # Under ASGI a sync iterator would be read whole (in a thread) before the first byte is sent,
+            # stream from an async one instead
+            stream = self.astream_rows(queryset.aiterator(chunk_size=self.export_chunk_size), export_format)
+        else:
+            stream = self.stream_rows(queryset.iterator(chunk_size=self.export_chunk_size), export_format)
+
+        response = StreamingHttpResponse(stream, content_type=self.export_formats[export_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+    def get_export_writer(self, export_format):
+        # Header lines and row writer of the export format
+        if export_format == 'ndjson':
+            return [], lambda row: json.dumps(row, cls=JSONEncoder) + '\n'
+        writer = csv.writer(Echo())
+        header = [name for name, field in self.get_serializer().fields.items() if not field.write_only]
+
+        def write_row(row):
+            # Products are flattened to their ids
+            row['products'] = ' '.join(str(product['id']) for product in row['products'])
+            return writer.writerow(row[field] for field in header)
+        return [writer.writerow(header)], write_row
+
+    def stream_rows(self, orders, export_format):
+        header, write_row = self.get_export_writer(export_format)
+        yield from header
+        for order in orders:
+            yield write_row(self.get_serializer(order).data)
+
+    async def astream_rows(self, orders, export_format):
+        header, write_row = self.get_export_writer(export_format)
+        for line in header:
+            yield line
+        async for order in orders:
+            yield write_row(self.get_serializer(order).data)
+
+
+class DailyReportViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Daily count, products and revenue of the active orders, filtered by date range.
+    Read from the daily rollup only, without touching the orders.
+    """
+    queryset = DailyOrderRollup.objects.all()
+    serializer_class = DailyOrderRollupSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = {
+        'date': ['gte', 'lte'],
+    }
+
+
+class PoolStatsView(APIView):
+    """
+    Statistics of the database connection pools of the serving worker (null when not pooled), staff only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(pool.get_all_pool_stats(reset=request.query_params.get('reset') == '1'))
+
+
+def metrics_view(request):
+    """
+    Request metrics of the serving worker, in the Prometheus text format.
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)
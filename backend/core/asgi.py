@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+if settings.DEBUG:
+    # Static files (admin, Swagger UI) served like runserver does in development
+    django_application = ASGIStaticFilesHandler(django_application)
+
+# Server-sent events of the order and product changes, streamed without a thread per connection
+from api.events import EventStreamApp  # noqa: E402
+
+application = EventStreamApp(django_application, path='/api/events/')
@@ -38,6 +38,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # OpClass and the other Postgres specific expressions of the search indexes
+    'django.contrib.postgres',
     'rest_framework',
     'drf_spectacular',
     'drf_spectacular_sidecar',
@@ -53,8 +55,12 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.MetricsMiddleware',
 ]
 
+# Request latency and SQL metrics of each worker, served in Prometheus format at `metrics/`
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true') == 'true'
+
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -93,6 +99,60 @@ DATABASES = {
     }
 }
 
+# Connection pool (psycopg-pool), enabled with DB_POOL=true, connections are reused between
+# requests instead of being opened per request.
+# Otherwise DB_CONN_MAX_AGE keeps persistent connections per worker (0 closes them per request).
+if os.getenv('DB_POOL', 'false') == 'true':
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            # Seconds to wait for a free connection before failing the request
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            # Seconds after which a connection is replaced
+            'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 0))
+# Check the connections before reusing them
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.getenv('DB_CONN_HEALTH_CHECKS', 'true') == 'true'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Use FileBasedCache (shared between processes) when running more than one worker
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'store-api'),
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', 300)),
+        'OPTIONS': {
+            # Bounded size, a fraction of the entries is evicted when full
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 5000)),
+        },
+    }
+}
+
+# Timeout in seconds of the cached list/retrieve API responses, 0 to disable
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Days a soft deleted row is kept before `archive_deleted` archives or purges it
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', 90))
+
+# Seconds the most recent changes are held back by the change feed, until their transactions commit:
+# on Postgres the changes since the oldest open write transaction are held back too, the delay only covers
+# the clock skew, elsewhere it must exceed the longest write transaction
+CHANGE_FEED_DELAY = int(os.getenv('CHANGE_FEED_DELAY', 2))
+# Maximum seconds the oldest open write transaction holds the Postgres change feed back, so a stuck one
+# doesn't freeze it: the changes of longer write transactions may be skipped
+CHANGE_FEED_MAX_DELAY = int(os.getenv('CHANGE_FEED_MAX_DELAY', 300))
+
+# Broker of the change events streamed on /api/events/ (ASGI only): 'local' reaches the streams
+# of the same process, 'postgres' uses LISTEN/NOTIFY to reach the ones of every worker
+EVENTS_BROKER = os.getenv('EVENTS_BROKER', 'local')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -138,7 +198,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageNumberPagination',
     'PAGE_SIZE': 100
 }
 
@@ -18,7 +18,13 @@ echo "Starting Collectstatic..."
 python manage.py collectstatic --noinput
 echo ====================================
 
-echo "Starting Development Server..."
-python manage.py runserver 0.0.0.0:8000
+# ASGI server, required by the change events stream (/api/events/)
+if [ "$DEBUG" == "true" ]; then
+    echo "Starting Development Server..."
+    uvicorn core.asgi:application --host 0.0.0.0 --port 8000 --reload
+else
+    echo "Starting Server..."
+    uvicorn core.asgi:application --host 0.0.0.0 --port 8000
+fi
 
 exec "$@"
\ No newline at end of file